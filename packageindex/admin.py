@@ -1,22 +1,50 @@
 from django.contrib import admin
 from packageindex.models import Package, Release, Classifier, \
-                              Distribution, PackageIndex
+                              Distribution, PackageIndex, SyncQueueItem, \
+                              JournalEntry, CrawledPage
+from packageindex.operations.crawler import ExternalLinkCrawler
+from packageindex.operations.mirror import mirror_distributions
 
 class PackageIndexAdmin(admin.ModelAdmin):
+    list_display = ('__unicode__', 'updated_from_remote_at', 'full_sync_started_at', 'sync_progress',)
     actions = ('full_update', 'update',)
 
+    def sync_progress(self, obj):
+        return u"%(done)s/%(total)s done, %(failed)s failed" % obj.sync_progress()
+
     def full_update(self, request, queryset):
         for package_index in queryset:
             package_index.update_package_list(full=True)
 
     def update(self, request, queryset):
         for package_index in queryset:
-            if not package_index.updated_from_remote_at:
+            if not package_index.updated_from_remote_at or package_index.full_sync_started_at:
                 package_index.update_package_list(full=True)
             else:
                 package_index.update_package_list(full=False)
 admin.site.register(PackageIndex, PackageIndexAdmin)
 
+class SyncQueueItemAdmin(admin.ModelAdmin):
+    list_display = ('package_name', 'index', 'state', 'retries', 'next_attempt_at', 'updated_at',)
+    list_filter = ('state', 'index',)
+    search_fields = ('package_name', 'last_error',)
+admin.site.register(SyncQueueItem, SyncQueueItemAdmin)
+
+class JournalEntryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'version', 'action', 'submitted_at',)
+    search_fields = ('name', 'action',)
+    date_hierarchy = 'submitted_at'
+    readonly_fields = ('name', 'version', 'action', 'submitted_at',)
+admin.site.register(JournalEntry, JournalEntryAdmin)
+
+class CrawledPageAdmin(admin.ModelAdmin):
+    list_display = ('url', 'status', 'fetched_at', 'checked_at',)
+    list_filter = ('status',)
+    search_fields = ('url',)
+    readonly_fields = ('url', 'etag', 'last_modified', 'status', 'links',
+                       'fetched_at', 'checked_at',)
+admin.site.register(CrawledPage, CrawledPageAdmin)
+
 class PackageReleaseInline(admin.TabularInline):
     model = Release
     extra = 0
@@ -34,8 +62,7 @@ class PackageAdmin(admin.ModelAdmin):
             package.update_release_metadata()
 
     def update_external_release_metadata(self, request, queryset):
-        for package in queryset:
-            package.update_external_release_metadata()
+        ExternalLinkCrawler().crawl(queryset.select_related('index'))
 
 
 class ReleaseAdmin(admin.ModelAdmin):
@@ -65,8 +92,7 @@ class DistributionAdmin(admin.ModelAdmin):
     is_hosted_locally.admin_order_field = 'file'
 
     def mirror_distribution(self, request, queryset):
-        for distribution in queryset:
-            distribution.mirror_package(commit=True)
+        mirror_distributions(queryset)
 
 admin.site.register(Package, PackageAdmin)
 admin.site.register(Release, ReleaseAdmin)
@@ -95,11 +95,51 @@ XMLRPC_COMMANDS = {
     'package_releases': 'packageindex.views.xmlrpc.package_releases',
     'release_urls': 'packageindex.views.xmlrpc.release_urls',
     'release_data': 'packageindex.views.xmlrpc.release_data',
-    #'search': xmlrpc.search, Not done yet
-    #'changelog': xmlrpc.changelog, Not done yet
+    'system.multicall': 'packageindex.views.xmlrpc.multicall',
+    'changelog': 'packageindex.views.xmlrpc.changelog',
+    'changelog_last_serial': 'packageindex.views.xmlrpc.changelog_last_serial',
+    'changelog_since_serial': 'packageindex.views.xmlrpc.changelog_since_serial',
+    'search': 'packageindex.views.xmlrpc.search',
     #'ratings': xmlrpc.ratings, Not done yet
 }
 
+""" Number of worker threads used to sync packages from the upstream index, and
+the maximum number of xml-rpc calls per second per upstream host. The rate
+limits are a dict mapping host names (e.g. 'pypi.python.org') to calls per 
+second, SYNC_DEFAULT_RATE_LIMIT applies to all other hosts (None means no 
+limit). """
+SYNC_CONCURRENCY = 4
+SYNC_RATE_LIMITS = {}
+SYNC_DEFAULT_RATE_LIMIT = None
+
+""" Full syncs are backed by a persistent queue of packages and can be resumed
+after an interruption. Packages that fail are retried up to SYNC_MAX_RETRIES 
+times, waiting SYNC_RETRY_BACKOFF seconds before the first retry and twice as
+long before each further one. SYNC_QUEUE_BATCH_SIZE packages are taken from 
+the queue at once. Packages that have been in progress for more than
+SYNC_CLAIM_TIMEOUT seconds (left over by a run that crashed) are taken again
+by incremental syncs. """
+SYNC_MAX_RETRIES = 5
+SYNC_RETRY_BACKOFF = 60
+SYNC_QUEUE_BATCH_SIZE = 100
+SYNC_CLAIM_TIMEOUT = 60 * 60
+
+""" Incremental syncs apply the upstream changelog in chunks of this many 
+events, the changelog position is saved after every chunk. """
+CHANGELOG_CHUNK_SIZE = 500
+
+""" Number of xml-rpc calls (e.g. release_data for every release of a package)
+that are sent to the upstream index in one system.multicall request. Set to 1
+to disable multicall. """
+XMLRPC_MULTICALL_BATCH_SIZE = 50
+
+""" Distribution files are mirrored with MIRROR_CONCURRENCY parallel downloads,
+streamed in chunks of MIRROR_CHUNK_SIZE bytes. Partial downloads are kept in 
+MIRROR_TEMP_DIR (the system temp directory if None) and resumed. """
+MIRROR_CONCURRENCY = 4
+MIRROR_CHUNK_SIZE = 64 * 1024
+MIRROR_TEMP_DIR = None
+
 """ These settings enable proxying of packages that are not in the local index 
 to another index, http://pypi.python.org/ by default. This feature is disabled 
 by default and can be enabled by setting packageindex_PROXY_MISSING to True in 
@@ -108,9 +148,128 @@ PROXY_BASE_URL = 'http://pypi.python.org/simple'
 
 PROXY_MISSING = False
 
+""" With PROXY_PULL_THROUGH (and PROXY_MISSING) missing packages are not
+redirected to PROXY_BASE_URL but pulled from there: their releases and
+distributions are created (in the index with PROXY_BASE_URL as simple url, or
+in a new PROXY_INDEX_SLUG index), their simple page is served locally and read
+again from upstream after PROXY_CACHE_TIMEOUT seconds. Distribution files are
+stored on their first download. Concurrent requests for the same package or
+file wait up to PROXY_LOCK_TIMEOUT seconds for the first one. See
+operations.proxy. """
+PROXY_PULL_THROUGH = False
+PROXY_INDEX_SLUG = 'proxy'
+PROXY_CACHE_TIMEOUT = 60 * 30
+PROXY_LOCK_TIMEOUT = 60 * 5
+
 """ Allow any user to maintain a package. """
 GLOBAL_OWNERSHIP = False
 
+""" Storage layout of mirrored distribution files. 'flat' stores every file at
+its RELEASE_UPLOAD_TO path. 'content_hash' stores every distinct file once in
+BLOB_DIR (named by its md5) and hardlinks it to the RELEASE_UPLOAD_TO path (or,
+on non local storages, points the distribution at the blob). Unreferenced
+blobs are removed by the pi_gc_blobs command. """
+DISTRIBUTION_STORAGE_LAYOUT = 'flat'
+BLOB_DIR = 'blobs'
+
+""" The /simple/ pages are rendered when a package changes and kept in the
+django cache for SIMPLE_PAGE_CACHE_TIMEOUT seconds (pages that expired or
+that are older than the last change of their package are rendered again on
+the next request). """
+SIMPLE_PAGE_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+""" Uploads from distutils are read from the request in chunks of
+UPLOAD_CHUNK_SIZE bytes, files are written to temporary files as they
+arrive. """
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+""" Stored distribution files are hashed (md5 and sha256) in chunks of
+HASH_CHUNK_SIZE bytes. pi_hash_distributions hashes existing files with
+HASH_CONCURRENCY worker threads. """
+HASH_CHUNK_SIZE = 64 * 1024
+HASH_CONCURRENCY = 4
+
+""" The xml-rpc release_urls and release_data responses are cached per
+release for XMLRPC_RELEASE_CACHE_TIMEOUT seconds (and built again when the
+package changed). """
+XMLRPC_RELEASE_CACHE_TIMEOUT = 60 * 60 * 24
+
+""" Maximum number of releases returned by the xml-rpc search (None for no
+limit). """
+SEARCH_MAX_RESULTS = 1000
+
+""" Store Release.package_info compressed (zlib, base64 encoded and prefixed
+with 'zlib:'). Values shorter than PACKAGE_INFO_COMPRESSION_MIN_SIZE bytes
+are stored as plain JSON. Rows in either format are read, existing rows are
+rewritten in the configured format by pi_compress_package_info. """
+PACKAGE_INFO_COMPRESSION = False
+PACKAGE_INFO_COMPRESSION_MIN_SIZE = 512
+
+""" Rendered release descriptions are cached for RST_CACHE_TIMEOUT seconds.
+They are rendered when releases are synced or uploaded, by one background
+thread with a queue of at most RST_PRERENDER_QUEUE_SIZE batches if
+RST_PRERENDER_IN_BACKGROUND is set (or else right away). Descriptions that
+are rendered by the sync commands are only used by the site if both share
+the cache backend (e.g. memcached, not the local memory cache). """
+RST_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+RST_PRERENDER_IN_BACKGROUND = True
+RST_PRERENDER_QUEUE_SIZE = 100
+
+""" The xml-rpc list_packages response is written (reading the package names
+in batches of LIST_PACKAGES_BATCH_SIZE) to a gzip compressed file in
+LIST_PACKAGES_CACHE_DIR (the system temp directory if None) and served from
+there until a package is added or removed (in any process), or
+LIST_PACKAGES_CACHE_TIMEOUT seconds have passed. """
+LIST_PACKAGES_BATCH_SIZE = 5000
+LIST_PACKAGES_CACHE_DIR = None
+LIST_PACKAGES_CACHE_TIMEOUT = 60 * 60 * 24
+
+""" All xml-rpc calls to upstream indexes share a pool of keep-alive
+connections (at most UPSTREAM_POOL_SIZE idle connections per host), time out
+after UPSTREAM_TIMEOUT seconds and are retried UPSTREAM_RETRIES times on
+network errors, waiting UPSTREAM_RETRY_BACKOFF seconds (with jitter) before
+the first retry and twice as long before each further one. Requests larger
+than UPSTREAM_GZIP_THRESHOLD bytes are sent gzip encoded, if it is set (not
+every server accepts compressed requests, so this is off by default). """
+UPSTREAM_POOL_SIZE = 8
+UPSTREAM_TIMEOUT = 60
+UPSTREAM_RETRIES = 3
+UPSTREAM_RETRY_BACKOFF = 1.0
+UPSTREAM_GZIP_THRESHOLD = None
+
+""" Upstream responses (xml-rpc calls and the external links of packages)
+can be kept in UPSTREAM_CACHE_DIR. UPSTREAM_CACHE_MODE is None (not cached),
+'cache' (responses are used for UPSTREAM_CACHE_TTLS seconds, by xml-rpc
+method or 'external_links', not at all for other methods), 'record' (every
+response is stored) or 'replay' (only stored responses are used, for
+offline syncs). See operations.response_cache. """
+UPSTREAM_CACHE_DIR = None
+UPSTREAM_CACHE_MODE = None
+UPSTREAM_CACHE_TTLS = {
+    'package_releases': 60 * 60,
+    'release_data': 60 * 60 * 24,
+    'release_urls': 60 * 60 * 24,
+    'external_links': 60 * 60 * 24,
+}
+
+""" The external links of packages (on their simple pages and the home and
+download pages linked from there) are crawled by CRAWL_CONCURRENCY worker
+threads. Every host gets at most CRAWL_RATE_LIMITS requests per second (a dict
+mapping host names to requests per second, CRAWL_DEFAULT_RATE_LIMIT for all
+other hosts, None means no limit). Pages time out after CRAWL_TIMEOUT seconds
+and only the first CRAWL_MAX_PAGE_SIZE bytes of a page are read. See
+operations.crawler. """
+CRAWL_CONCURRENCY = 4
+CRAWL_RATE_LIMITS = {}
+CRAWL_DEFAULT_RATE_LIMIT = 2
+CRAWL_TIMEOUT = 30
+CRAWL_MAX_PAGE_SIZE = 1024 * 1024
+
+""" Home and download pages that are linked from several packages are read
+once per crawl, the links of the last CRAWL_SHARED_PAGES pages are kept for
+that. """
+CRAWL_SHARED_PAGES = 10000
+
 for k in dir(settings):
     if k.startswith('packageindex_'):
         locals()[k.split('packageindex_', 1)[1]] = getattr(settings, k)
\ No newline at end of file
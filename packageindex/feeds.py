@@ -45,8 +45,10 @@ class ReleaseFeed(Feed):
     
     def items(self, obj):
         if isinstance(obj, Package):
-            return obj.releases.filter(hidden=False).order_by('-created')[:25]
-        return Release.objects.filter(hidden=False).order_by('-created')[:40]
+            return obj.releases.without_package_info().filter(hidden=False)\
+                                                      .order_by('-created')[:25]
+        return Release.objects.without_package_info().filter(hidden=False)\
+                                                     .order_by('-created')[:40]
     
     def item_description(self, item):
         if isinstance(item, Release):
@@ -1,8 +1,13 @@
+from cStringIO import StringIO
+
 from django.http import HttpResponse, QueryDict
 from django.core.files.uploadedfile import TemporaryUploadedFile
 from django.utils.datastructures import MultiValueDict
 from django.contrib.auth import authenticate
 
+from packageindex import conf
+from packageindex.operations.hashing import Digests
+
 
 class HttpResponseNotImplemented(HttpResponse):
     status_code = 501
@@ -16,6 +21,63 @@ class HttpResponseUnauthorized(HttpResponse):
         self['WWW-Authenticate'] = 'Basic realm="%s"' % realm
 
 
+class MultipartReader(object):
+    """ Reads a multipart body from ``stream`` in chunks of ``chunk_size``
+    bytes and never keeps more than about one chunk in memory. """
+    max_line_length = 8 * 1024
+
+    def __init__(self, stream, chunk_size):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        # the first boundary is found like all others, after a line break
+        self.buffer = '\n'
+        self.eof = False
+
+    def fill(self):
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer += chunk
+        return True
+
+    def read_until(self, delimiter, write):
+        """ Passes everything up to ``delimiter`` to ``write`` and consumes
+        the delimiter. Returns False if the stream ended before it. """
+        # a delimiter may be split between two chunks, and the '\r' of a
+        # '\r\n' line break before it must not be written. distutils writes
+        # an extra '\n' after values that end in '\r', which is dropped too.
+        keep = len(delimiter) + 2
+        while True:
+            index = self.buffer.find(delimiter)
+            if index >= 0:
+                data = self.buffer[:index]
+                if data.endswith('\r') or data.endswith('\r\n'):
+                    data = data[:-1]
+                write(data)
+                self.buffer = self.buffer[index + len(delimiter):]
+                return True
+            if len(self.buffer) > keep:
+                write(self.buffer[:-keep])
+                self.buffer = self.buffer[-keep:]
+            if not self.fill():
+                write(self.buffer)
+                self.buffer = ''
+                return False
+
+    def read_line(self):
+        line = []
+        def write(data):
+            line.append(data)
+            if sum(map(len, line)) > self.max_line_length:
+                raise ValueError('Invalid post data')
+        if not self.read_until('\n', write) and not ''.join(line):
+            return None
+        return ''.join(line).rstrip('\r')
+
+
 def parse_distutils_request(request):
     """ This is being used because the built in request parser that Django uses,
     django.http.multipartparser.MultiPartParser is interperting the POST data
@@ -23,47 +85,71 @@ def parse_distutils_request(request):
     
     One portion of this is the end marker: \r\n\r\n (what Django expects) 
     versus \n\n (what distutils is sending). 
+
+    The body is read from the request stream in chunks of UPLOAD_CHUNK_SIZE,
+    files are written straight to a ``TemporaryUploadedFile`` which gets the
+    md5 and sha256 of its content as ``md5_digest`` and ``sha256_digest``.
     """
-    
-    try:
-        sep = request.raw_post_data.splitlines()[1]
-    except:
-        raise ValueError('Invalid post data')
-    
-    
+    if hasattr(request, '_stream'):
+        stream = request
+    else:
+        stream = StringIO(request.raw_post_data)
+    reader = MultipartReader(stream, conf.UPLOAD_CHUNK_SIZE)
+
+    boundary = parse_header(request.META.get('CONTENT_TYPE', '')).get('boundary')
+    if not boundary:
+        line = reader.read_line()
+        while line is not None and not line.strip():
+            line = reader.read_line()
+        if not line or not line.startswith('--'):
+            raise ValueError('Invalid post data')
+        boundary = line[2:]
+    else:
+        reader.read_until('\n--' + boundary, lambda data: None)
+        reader.read_line()
+    delimiter = '\n--' + boundary
+
     request.POST = QueryDict('',mutable=True)
     try:
         request._files = MultiValueDict()
     except Exception, e:
         pass
-    
-    for part in filter(lambda e: e.strip(), request.raw_post_data.split(sep)):
-        try:
-            header, content = part.lstrip().split('\n',1)
-        except Exception, e:
-            continue
-        
-        if content.startswith('\n'):
-            content = content[1:]
-        
-        if content.endswith('\n'):
-            content = content[:-1]
-        
-        headers = parse_header(header)
-        
-        if "name" not in headers:
-            continue
-        
+
+    while True:
+        # the headers of the part, up to an empty line
+        headers = {}
+        line = reader.read_line()
+        while line:
+            headers.update(parse_header(line))
+            line = reader.read_line()
+        if line is None:
+            break
+
         if "filename" in headers:
             dist = TemporaryUploadedFile(name=headers["filename"],
-                                         size=len(content),
+                                         size=0,
                                          content_type="application/gzip",
                                          charset='utf-8')
-            dist.write(content)
+            digests = Digests()
+            def write(data):
+                digests.update(data)
+                dist.write(data)
+            found = reader.read_until(delimiter, write)
+            dist.size = dist.tell()
+            dist.md5_digest = digests.md5
+            dist.sha256_digest = digests.sha256
             dist.seek(0)
-            request.FILES.appendlist(headers['name'], dist)
+            if "name" in headers:
+                request.FILES.appendlist(headers['name'], dist)
         else:
-            request.POST.appendlist(headers["name"],content)
+            content = []
+            found = reader.read_until(delimiter, content.append)
+            if "name" in headers:
+                request.POST.appendlist(headers["name"], ''.join(content))
+
+        # the rest of the boundary line, '--' after the last part
+        if not found or (reader.read_line() or '').startswith('--'):
+            break
     return
 
 def parse_header(header):
@@ -0,0 +1,62 @@
+"""
+Management command for rewriting the package_info of all releases in the
+format set by PACKAGE_INFO_COMPRESSION, reporting the space saved.
+"""
+
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from packageindex import conf
+from packageindex.models import Release, encode_package_info, \
+                                decode_package_info
+
+def recompress(rows, compress):
+    """ Rewrites the raw ``(pk, metadata_digest, package_info)`` ``rows`` that
+    are not stored in the wanted format. A row is only written if its digest
+    is still the same, so metadata saved since the rows were read is kept.
+    Returns the number of rewritten rows and their size before and after. """
+    rewritten, before, after = 0, 0, 0
+    for pk, digest, value in rows:
+        encoded = encode_package_info(decode_package_info(value), compress)
+        if encoded == value:
+            continue
+        if not Release.objects.filter(pk=pk, metadata_digest=digest)\
+                              .update(package_info=encoded):
+            continue
+        rewritten += 1
+        before += len(value)
+        after += len(encoded)
+    return rewritten, before, after
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=500,
+                    help='number of releases that are rewritten per transaction'),
+        make_option('--decompress', action='store_true', dest='decompress',
+                    default=False,
+                    help='store all rows as plain JSON, regardless of PACKAGE_INFO_COMPRESSION'),
+    )
+    help = """Rewrite the package_info of all releases compressed (or uncompressed)"""
+
+    def handle(self, *args, **options):
+        compress = conf.PACKAGE_INFO_COMPRESSION and not options['decompress']
+        last_pk = 0
+        count = 0
+        rewritten, before, after = 0, 0, 0
+        while True:
+            # the raw values, without decoding them into model instances
+            rows = list(Release.objects.filter(pk__gt=last_pk).order_by('pk')
+                                       .values_list('pk', 'metadata_digest',
+                                                    'package_info')
+                                       [:options['batch_size']])
+            if not rows:
+                break
+            result = transaction.commit_on_success(recompress)(rows, compress)
+            rewritten += result[0]
+            before += result[1]
+            after += result[2]
+            last_pk = rows[-1][0]
+            count += len(rows)
+            print "processed %s releases, %s rewritten" % (count, rewritten)
+        print "%s bytes before, %s bytes after, %s bytes saved" % (
+                before, after, before - after)
@@ -0,0 +1,35 @@
+"""
+Management command for crawling the external links (home and download pages)
+of packages for distributions that are not hosted on their index.
+"""
+
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from packageindex.models import Package
+from packageindex.operations.crawler import ExternalLinkCrawler
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--concurrency', dest='concurrency', type='int',
+                    default=None, help='number of packages that are crawled in parallel'),
+        make_option('--index', dest='index', default=None,
+                    help='only crawl the packages of the index with this slug'),
+    )
+    args = '<package_name package_name ...>'
+    help = """Crawl the external links of the given packages (or of all packages)"""
+
+    def handle(self, *args, **options):
+        packages = Package.objects.select_related('index').order_by('name')
+        if args:
+            packages = packages.filter(name__in=args)
+        if options['index']:
+            packages = packages.filter(index__slug=options['index'])
+        crawler = ExternalLinkCrawler(concurrency=options['concurrency'])
+        failed = crawler.crawl(packages.iterator())
+        stats = crawler.stats
+        print "%s packages crawled, %s unchanged, %s failed" % (
+                        stats['packages'], stats['skipped'], stats['failed'])
+        print "%s pages downloaded, %s not modified, %s errors" % (
+                        stats['fetched'], stats['unchanged'], stats['errors'])
+        for package in failed:
+            print "  %s" % package
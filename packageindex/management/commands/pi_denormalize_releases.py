@@ -0,0 +1,44 @@
+"""
+Management command for filling the release columns that are copied from
+``package_info`` (summary, author, license, requires_python and the
+classifiers) of existing releases.
+"""
+
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from packageindex.models import Release, denormalized_values, \
+                                sync_release_classifiers
+
+def denormalize_releases(releases):
+    updated = 0
+    for release in releases:
+        values = denormalized_values(release.package_info)
+        changed = dict((field, value) for field, value in values.items()
+                       if getattr(release, field) != value)
+        if changed:
+            Release.objects.filter(pk=release.pk).update(**changed)
+            updated += 1
+    sync_release_classifiers(releases)
+    return updated
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=500,
+                    help='number of releases that are updated per transaction'),
+    )
+    help = """Copy the frequently read package_info fields of all releases into their columns"""
+
+    def handle(self, *args, **options):
+        last_pk = 0
+        count = 0
+        updated = 0
+        while True:
+            releases = list(Release.objects.filter(pk__gt=last_pk).order_by('pk')
+                                           [:options['batch_size']])
+            if not releases:
+                break
+            updated += transaction.commit_on_success(denormalize_releases)(releases)
+            last_pk = releases[-1].pk
+            count += len(releases)
+            print "processed %s releases, %s updated" % (count, updated)
@@ -0,0 +1,23 @@
+"""
+Management command for writing the /simple/ pages into a directory, so they
+can be served by a plain web server.
+"""
+
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from packageindex.operations.export import export_simple
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--incremental', action='store_true', dest='incremental',
+                    default=False,
+                    help='only write the packages that changed since the last export'),
+    )
+    args = '<directory>'
+    help = """Export the simple index (root listing and one index.html per package) into a directory"""
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('usage: pi_export_simple [--incremental] <directory>')
+        written, removed = export_simple(args[0], incremental=options['incremental'])
+        print "wrote %s package pages, removed %s" % (written, removed)
@@ -0,0 +1,28 @@
+"""
+Management command for removing blobs of the content addressed distribution
+storage that no distribution references anymore.
+"""
+
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from packageindex.models import Distribution
+from packageindex.operations.blobs import collect_garbage
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run', action='store_true', dest='dry_run',
+                    default=False, help='only report the blobs that would be removed'),
+    )
+    help = """Remove blobs that are not referenced by any distribution"""
+
+    def handle(self, *args, **options):
+        referenced = set(Distribution.objects.exclude(Q(file='') | Q(file__isnull=True))
+                                     .values_list('file', flat=True))
+        storage = Distribution._meta.get_field('file').storage
+        count, size = collect_garbage(storage, referenced,
+                                      dry_run=options['dry_run'])
+        if options['dry_run']:
+            print "would remove %s blobs (%s bytes)" % (count, size)
+        else:
+            print "removed %s blobs (%s bytes)" % (count, size)
@@ -0,0 +1,33 @@
+"""
+Management command for computing the md5 and sha256 digests of distribution
+files that are already in the local mirror.
+"""
+
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from packageindex.models import Distribution
+from packageindex.operations.hashing import hash_distributions
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--concurrency', dest='concurrency', type='int',
+                    default=None, help='number of files that are hashed in parallel'),
+        make_option('--all', action='store_true', dest='all', default=False,
+                    help='hash all files, not only those without a sha256 digest'),
+    )
+    args = '<package_name package_name ...>'
+    help = """Hash the mirrored distribution files of the given packages (or of all packages)"""
+
+    def handle(self, *args, **options):
+        distributions = Distribution.objects.exclude(Q(file='') | Q(file__isnull=True))
+        if args:
+            distributions = distributions.filter(release__package__name__in=args)
+        if not options['all']:
+            distributions = distributions.filter(sha256_digest='')
+        failed, mismatched = hash_distributions(distributions.iterator(),
+                                                concurrency=options['concurrency'])
+        print "%s distributions failed, %s do not match their md5" % (
+                                                len(failed), len(mismatched))
+        for distribution in failed + mismatched:
+            print "  %s" % distribution.file.name
@@ -0,0 +1,58 @@
+"""
+Management command for importing the files of an existing on-disk mirror.
+Files are matched to distributions by their md5, not by their path.
+"""
+
+import datetime
+import os
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from packageindex.models import Distribution
+from packageindex.operations import blobs
+from packageindex.operations.hashing import file_digests
+
+class Command(BaseCommand):
+    args = '<directory>'
+    help = """Import the files of an existing mirror directory for all distributions with a matching md5"""
+
+    def handle(self, *args, **options):
+        if len(args) != 1 or not os.path.isdir(args[0]):
+            raise CommandError('usage: pi_import_mirror <directory>')
+        by_md5 = {}
+        sha256s = {}
+        for dirpath, dirnames, filenames in os.walk(args[0]):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                fh = open(path, 'rb')
+                try:
+                    digests = file_digests(fh)
+                finally:
+                    fh.close()
+                by_md5.setdefault(digests.md5, path)
+                sha256s[digests.md5] = digests.sha256
+        print "hashed %s files" % len(by_md5)
+        imported = 0
+        md5s = by_md5.keys()
+        while md5s:
+            chunk, md5s = md5s[:500], md5s[500:]
+            distributions = Distribution.objects.filter(md5_digest__in=chunk)\
+                                        .filter(Q(file='') | Q(file__isnull=True))
+            for distribution in distributions:
+                path = by_md5[distribution.md5_digest]
+                if blobs.is_content_addressed():
+                    blob = blobs.add_blob(distribution.file.storage, path,
+                                          distribution.md5_digest, move=False)
+                    blobs.link_distribution(distribution, blob)
+                else:
+                    fh = open(path, 'rb')
+                    try:
+                        distribution.file.save(distribution.filename, File(fh), save=False)
+                    finally:
+                        fh.close()
+                distribution.sha256_digest = sha256s[distribution.md5_digest]
+                distribution.mirrored_at = datetime.datetime.now()
+                distribution.save()
+                imported += 1
+                print "  %s <- %s" % (distribution.file.name, path)
+        print "imported %s distributions" % imported
@@ -0,0 +1,32 @@
+"""
+Management command for downloading distribution files into the local mirror.
+"""
+
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from packageindex.models import Distribution
+from packageindex.operations.mirror import mirror_distributions
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--concurrency', dest='concurrency', type='int',
+                    default=None, help='number of parallel downloads'),
+        make_option('--overwrite', action='store_true', dest='overwrite',
+                    default=False, help='download files that are already mirrored again'),
+    )
+    args = '<package_name package_name ...>'
+    help = """Mirror the distribution files of the given packages (or of all packages)"""
+
+    def handle(self, *args, **options):
+        distributions = Distribution.objects.exclude(url=None).exclude(url='')
+        if args:
+            distributions = distributions.filter(release__package__name__in=args)
+        if not options['overwrite']:
+            distributions = distributions.filter(Q(file='') | Q(file__isnull=True))
+        failed = mirror_distributions(distributions.iterator(),
+                                      overwrite=options['overwrite'],
+                                      concurrency=options['concurrency'])
+        print "%s distributions failed" % len(failed)
+        for distribution in failed:
+            print "  %s" % distribution.url
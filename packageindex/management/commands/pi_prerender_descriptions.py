@@ -0,0 +1,30 @@
+"""
+Management command for rendering the descriptions of all releases into the
+cache.
+"""
+
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from packageindex.models import Release
+from packageindex.operations.descriptions import prerender
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=500,
+                    help='number of releases that are loaded at once'),
+    )
+    help = """Render the descriptions of all releases that are not cached yet"""
+
+    def handle(self, *args, **options):
+        last_pk = 0
+        count = 0
+        rendered = 0
+        while True:
+            releases = list(Release.objects.filter(pk__gt=last_pk).order_by('pk')
+                                           [:options['batch_size']])
+            if not releases:
+                break
+            rendered += prerender([release.description for release in releases])
+            last_pk = releases[-1].pk
+            count += len(releases)
+            print "processed %s releases, %s descriptions rendered" % (count, rendered)
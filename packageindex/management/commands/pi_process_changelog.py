@@ -1,17 +1,37 @@
 """
-Management command for loading all the known packages from the official
-pypi.
+Management command for applying the changes of the upstream changelog to the
+local package index.
 """
 
-from django.core.management.base import BaseCommand
-from packageindex.operations.packages import process_changelog
-import datetime
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from packageindex.models import PackageIndex
+from packageindex.operations.changelog import ChangelogSync, last_serial
 
 class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--index', dest='index', default='pypi',
+                    help='slug of the package index to update (default: pypi)'),
+        make_option('--serial', dest='serial', type='int', default=None,
+                    help='apply the changes after this changelog serial instead of the stored position'),
+    )
     help = """Update the package index with changed packages"""
     def handle(self, *args, **options):
-        since = datetime.datetime.now()-datetime.timedelta(days=1)
-        print "updating change from pypi since %s" % since
-        process_changelog(since,
-                update_releases=True, update_distributions=True,
-                mirror_distributions=False)
+        try:
+            index = PackageIndex.objects.get(slug=options['index'])
+        except PackageIndex.DoesNotExist:
+            raise CommandError('package index "%s" does not exist' % options['index'])
+        if options['serial'] is not None:
+            index.changelog_serial = options['serial']
+        if index.changelog_serial is None:
+            serial = last_serial(index.client)
+            if serial is None:
+                raise CommandError('%s does not support changelog serials' % index.xml_rpc_url)
+            raise CommandError('no changelog position is known for "%s". Run a '
+                               'full sync first or pass --serial (the latest '
+                               'upstream serial is %s)' % (index.slug, serial))
+        print "updating changes from %s since serial %s" % (index.slug, index.changelog_serial)
+        result = ChangelogSync(index).run()
+        print "updated %s packages, %s failed, now at serial %s" % (
+                len(result['synced']), len(result['failed']), index.changelog_serial)
+        print result['result']
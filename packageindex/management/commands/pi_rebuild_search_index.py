@@ -0,0 +1,29 @@
+"""
+Management command for (re)building the search terms of all releases.
+"""
+
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from packageindex.models import Release
+from packageindex.operations.search import index_releases
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=500,
+                    help='number of releases that are indexed per transaction'),
+    )
+    help = """Rebuild the search index of all releases"""
+
+    def handle(self, *args, **options):
+        last_pk = 0
+        count = 0
+        while True:
+            releases = list(Release.objects.filter(pk__gt=last_pk).order_by('pk')
+                                           [:options['batch_size']])
+            if not releases:
+                break
+            transaction.commit_on_success(index_releases)(releases)
+            last_pk = releases[-1].pk
+            count += len(releases)
+            print "indexed %s releases" % count
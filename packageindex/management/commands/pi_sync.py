@@ -0,0 +1,47 @@
+"""
+Management command for syncing a package index (packages, releases and
+distribution metadata) from its upstream index with several workers.
+"""
+
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from packageindex import conf
+from packageindex.models import PackageIndex
+from packageindex.operations.transport import metrics
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--index', dest='index', default='pypi',
+                    help='slug of the package index to sync (default: pypi)'),
+        make_option('--full', action='store_true', dest='full', default=False,
+                    help='sync all packages instead of only the changed ones (resumes an interrupted full sync)'),
+        make_option('--concurrency', dest='concurrency', type='int',
+                    default=None,
+                    help='number of packages that are synced in parallel'),
+        make_option('--upstream-cache', dest='upstream_cache', default=None,
+                    choices=['cache', 'record', 'replay'],
+                    help='cache, record or replay the upstream responses in UPSTREAM_CACHE_DIR'),
+    )
+    help = """Sync the package index with its upstream index"""
+
+    def handle(self, *args, **options):
+        try:
+            index = PackageIndex.objects.get(slug=options['index'])
+        except PackageIndex.DoesNotExist:
+            raise CommandError('package index "%s" does not exist' % options['index'])
+        if options['upstream_cache']:
+            if not conf.UPSTREAM_CACHE_DIR:
+                raise CommandError('UPSTREAM_CACHE_DIR is not set')
+            conf.UPSTREAM_CACHE_MODE = options['upstream_cache']
+        # an interrupted full sync is resumed
+        full = (options['full'] or not index.updated_from_remote_at or
+                index.full_sync_started_at)
+        result = index.update_package_list(full=full,
+                                           concurrency=options['concurrency'])
+        print "synced %s packages, %s failed" % (len(result['synced']),
+                                                 len(result['failed']))
+        print result['result']
+        for package_name in result['failed']:
+            print "  failed: %s" % package_name
+        print "upstream calls:"
+        print metrics
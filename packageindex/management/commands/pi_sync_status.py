@@ -0,0 +1,25 @@
+"""
+Management command for monitoring the progress of the full sync of a package
+index.
+"""
+
+from django.core.management.base import BaseCommand
+from packageindex.models import PackageIndex, SyncQueueItem
+
+class Command(BaseCommand):
+    args = '<index_slug index_slug ...>'
+    help = """Show the progress of the full sync of package indexes"""
+
+    def handle(self, *args, **options):
+        indexes = PackageIndex.objects.all()
+        if args:
+            indexes = indexes.filter(slug__in=args)
+        for index in indexes:
+            progress = index.sync_progress()
+            if index.full_sync_started_at:
+                print "%s: full sync in progress since %s" % (index.slug, index.full_sync_started_at)
+            else:
+                print "%s: last synced at %s" % (index.slug, index.updated_from_remote_at)
+            for state, label in SyncQueueItem.STATES:
+                print "  %-12s %s" % (state, progress[state])
+            print "  %-12s %s" % ('total', progress['total'])
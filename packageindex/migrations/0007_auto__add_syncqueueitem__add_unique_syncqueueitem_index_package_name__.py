@@ -0,0 +1,110 @@
+# encoding: utf-8
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        
+        # Adding model 'SyncQueueItem'
+        db.create_table('packageindex_syncqueueitem', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('index', self.gf('django.db.models.fields.related.ForeignKey')(related_name='sync_queue', to=orm['packageindex.PackageIndex'])),
+            ('package_name', self.gf('django.db.models.fields.CharField')(max_length=255)),
+            ('state', self.gf('django.db.models.fields.CharField')(default='pending', max_length=16, db_index=True)),
+            ('retries', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+            ('last_error', self.gf('django.db.models.fields.TextField')(default='', blank=True)),
+            ('next_attempt_at', self.gf('django.db.models.fields.DateTimeField')(db_index=True, null=True, blank=True)),
+            ('updated_at', self.gf('django.db.models.fields.DateTimeField')(auto_now=True, blank=True)),
+        ))
+        db.send_create_signal('packageindex', ['SyncQueueItem'])
+
+        # Adding unique constraint on 'SyncQueueItem', fields ['index', 'package_name']
+        db.create_unique('packageindex_syncqueueitem', ['index_id', 'package_name'])
+
+        # Adding field 'PackageIndex.full_sync_started_at'
+        db.add_column('packageindex_packageindex', 'full_sync_started_at', self.gf('django.db.models.fields.DateTimeField')(null=True, blank=True), keep_default=False)
+
+
+    def backwards(self, orm):
+        
+        # Removing unique constraint on 'SyncQueueItem', fields ['index', 'package_name']
+        db.delete_unique('packageindex_syncqueueitem', ['index_id', 'package_name'])
+
+        # Deleting model 'SyncQueueItem'
+        db.delete_table('packageindex_syncqueueitem')
+
+        # Deleting field 'PackageIndex.full_sync_started_at'
+        db.delete_column('packageindex_packageindex', 'full_sync_started_at')
+
+
+    models = {
+        'packageindex.classifier': {
+            'Meta': {'ordering': "('name',)", 'object_name': 'Classifier'},
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255', 'primary_key': 'True'})
+        },
+        'packageindex.distribution': {
+            'Meta': {'unique_together': "(('release', 'filetype', 'pyversion'),)", 'object_name': 'Distribution'},
+            'comment': ('django.db.models.fields.TextField', [], {'default': "''", 'blank': 'True'}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'file': ('django.db.models.fields.files.FileField', [], {'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            'filename': ('django.db.models.fields.CharField', [], {'default': "''", 'max_length': '255', 'blank': 'True'}),
+            'filetype': ('django.db.models.fields.CharField', [], {'max_length': '32'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_from_external': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'md5_digest': ('django.db.models.fields.CharField', [], {'max_length': '32', 'blank': 'True'}),
+            'mirrored_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'pyversion': ('django.db.models.fields.CharField', [], {'max_length': '16', 'blank': 'True'}),
+            'release': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'distributions'", 'to': "orm['packageindex.Release']"}),
+            'signature': ('django.db.models.fields.TextField', [], {'default': "''", 'blank': 'True'}),
+            'size': ('django.db.models.fields.IntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'uploaded_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'upstream_digest': ('django.db.models.fields.CharField', [], {'default': "''", 'max_length': '40', 'blank': 'True'}),
+            'url': ('django.db.models.fields.URLField', [], {'max_length': '255', 'null': 'True', 'blank': 'True'})
+        },
+        'packageindex.package': {
+            'Meta': {'ordering': "['name']", 'object_name': 'Package'},
+            'auto_hide': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'index': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['packageindex.PackageIndex']"}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '255', 'primary_key': 'True'}),
+            'parsed_external_links_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'updated_from_remote_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'})
+        },
+        'packageindex.packageindex': {
+            'Meta': {'object_name': 'PackageIndex'},
+            'full_sync_started_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'simple_url': ('django.db.models.fields.URLField', [], {'default': "'http://pypi.python.org/simple'", 'max_length': '200', 'blank': 'True'}),
+            'slug': ('django.db.models.fields.CharField', [], {'default': "'pypi'", 'unique': 'True', 'max_length': '255'}),
+            'updated_from_remote_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'xml_rpc_url': ('django.db.models.fields.URLField', [], {'default': "'http://pypi.python.org/pypi'", 'max_length': '200', 'blank': 'True'})
+        },
+        'packageindex.release': {
+            'Meta': {'ordering': "['-created']", 'unique_together': "(('package', 'version'),)", 'object_name': 'Release'},
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'hidden': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_from_external': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'metadata_digest': ('django.db.models.fields.CharField', [], {'default': "''", 'max_length': '40', 'blank': 'True'}),
+            'metadata_version': ('django.db.models.fields.CharField', [], {'default': "'1.0'", 'max_length': '64'}),
+            'package': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'releases'", 'to': "orm['packageindex.Package']"}),
+            'package_info': ('packageindex.models.PackageInfoField', [], {}),
+            'version': ('django.db.models.fields.CharField', [], {'max_length': '128'})
+        },
+        'packageindex.syncqueueitem': {
+            'Meta': {'unique_together': "(('index', 'package_name'),)", 'object_name': 'SyncQueueItem'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'index': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'sync_queue'", 'to': "orm['packageindex.PackageIndex']"}),
+            'last_error': ('django.db.models.fields.TextField', [], {'default': "''", 'blank': 'True'}),
+            'next_attempt_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'package_name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'retries': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'state': ('django.db.models.fields.CharField', [], {'default': "'pending'", 'max_length': '16', 'db_index': 'True'}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['packageindex']
\ No newline at end of file
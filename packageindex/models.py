@@ -1,51 +1,197 @@
+from __future__ import with_statement
+import base64
 import os
-import xmlrpclib
+import zlib
+from pkg_resources import safe_name
 from setuptools.package_index import distros_for_filename, distros_for_url
-from z3c.pypimirror import mirror
-from django.core.files.uploadedfile import SimpleUploadedFile
 from django.db import models
 from django.utils import simplejson as json
 from django.utils.datastructures import MultiValueDict
+from django.utils.hashcompat import sha_constructor
 from django.utils.translation import ugettext_lazy as _
-from z3c.pypimirror.mirror import PackageError
 from packageindex import conf
+from packageindex.utils import multicall
 import datetime
 import time
-import urllib2
 
 PYPI_API_URL = 'http://pypi.python.org/pypi'
 PYPI_SIMPLE_URL = 'http://pypi.python.org/simple'
 MIRROR_FILETYPES = ['*.zip', '*.tgz', '*.egg', '*.tar.gz', '*.tar.bz2']
+TIMEFORMAT = "%Y%m%dT%H:%M:%S"
+# marks compressed package_info values, see conf.PACKAGE_INFO_COMPRESSION
+COMPRESSED_PREFIX = 'zlib:'
+# package_info fields that are also stored as Release columns
+DENORMALIZED_FIELDS = ('summary', 'author', 'license', 'requires_python')
+
+def normalize_package_info(info):
+    """ Returns ``info`` (a MultiValueDict) as a plain dict of lists in the
+    form it takes after a round trip through the database. """
+    return json.loads(json.dumps(dict(info.iterlists())))
+
+def package_info_digest(info):
+    """ A stable sha1 digest of the normalized ``info`` """
+    return sha_constructor(json.dumps(normalize_package_info(info),
+                                      sort_keys=True)).hexdigest()
+
+def _info_values(info, key):
+    # upstream data stores lists as a single value
+    values = []
+    for value in info.getlist(key):
+        if isinstance(value, (list, tuple)):
+            values.extend(value)
+        else:
+            values.append(value)
+    return [value for value in values if value]
+
+def classifier_names(info):
+    """ The trove classifiers in ``info``, which are stored as ``classifier``
+    by uploads and as ``classifiers`` by the upstream sync """
+    names = []
+    for value in _info_values(info, 'classifier') + _info_values(info, 'classifiers'):
+        value = unicode(value)
+        if value not in names:
+            names.append(value)
+    return names
+
+def denormalized_values(info):
+    """ The values of the columns that ``Release`` keeps in step with its
+    ``package_info`` """
+    values = {}
+    for field in DENORMALIZED_FIELDS:
+        value = _info_values(info, field)
+        values[field] = value and unicode(value[0])[:Release._meta.get_field(field).max_length] or u''
+    return values
+
+def upstream_dist_digest(dist):
+    """ A stable sha1 digest of an upstream ``release_urls`` record """
+    return sha_constructor(json.dumps(dist, sort_keys=True,
+                                      default=str)).hexdigest()
+
+def encode_package_info(data, compress=None):
+    """ Serializes ``data`` (a dict of lists) for the database, compressed if
+    ``compress`` (by default conf.PACKAGE_INFO_COMPRESSION) is set """
+    if compress is None:
+        compress = conf.PACKAGE_INFO_COMPRESSION
+    value = json.dumps(data)
+    if compress and len(value) >= conf.PACKAGE_INFO_COMPRESSION_MIN_SIZE:
+        value = COMPRESSED_PREFIX + base64.b64encode(zlib.compress(value))
+    return value
+
+def decode_package_info(value):
+    """ The dict of lists stored in the database value ``value``, which may
+    be plain JSON or compressed """
+    if not value:
+        return {}
+    if value.startswith(COMPRESSED_PREFIX):
+        value = zlib.decompress(base64.b64decode(value[len(COMPRESSED_PREFIX):]))
+    return json.loads(value)
+
+class PackageInfo(MultiValueDict):
+    """
+    The decoded value of a ``PackageInfoField``. Remembers the JSON it was
+    decoded from, which is written back as is unless the value was changed
+    with one of the MultiValueDict methods (changing the lists returned by
+    ``getlist`` in place is not noticed, use ``setlist``).
+    """
+    def __init__(self, key_to_list_mapping=(), encoded=None):
+        super(PackageInfo, self).__init__(key_to_list_mapping)
+        self.encoded = encoded
+
+    @property
+    def changed(self):
+        return self.encoded is None
+
+def _package_info_mutator(name):
+    def method(self, *args, **kwargs):
+        self.encoded = None
+        return getattr(super(PackageInfo, self), name)(*args, **kwargs)
+    method.__name__ = name
+    return method
+
+for _name in ('__setitem__', '__delitem__', 'setlist', 'setdefault',
+              'setlistdefault', 'appendlist', 'update', 'pop', 'popitem',
+              'clear'):
+    setattr(PackageInfo, _name, _package_info_mutator(_name))
+
+
+class PackageInfoDescriptor(object):
+    """ Keeps the raw database value of a ``PackageInfoField`` on the
+    instance and decodes it on first access """
+    def __init__(self, field):
+        self.field = field
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = instance.__dict__[self.field.attname]
+        if not isinstance(value, PackageInfo):
+            value = self.field.to_python(value)
+            instance.__dict__[self.field.attname] = value
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
 
 class PackageInfoField(models.Field):
+    """
+    A MultiValueDict stored as JSON (optionally compressed, see
+    ``encode_package_info``). Instead of decoding the value when a model is
+    instantiated (like ``SubfieldBase`` does), the value is decoded when the
+    attribute is first accessed, and is only encoded again on save if it was
+    changed.
+    """
     description = u'Python Package Information Field'
-    __metaclass__ = models.SubfieldBase
 
     def __init__(self, *args, **kwargs):
         kwargs['editable'] = False
         super(PackageInfoField, self).__init__(*args, **kwargs)
 
+    def contribute_to_class(self, cls, name):
+        super(PackageInfoField, self).contribute_to_class(cls, name)
+        setattr(cls, self.name, PackageInfoDescriptor(self))
+
+    def is_changed(self, instance):
+        """ Whether the value of ``instance`` differs from the loaded one,
+        without decoding it """
+        value = instance.__dict__.get(self.attname)
+        if isinstance(value, PackageInfo):
+            return value.changed
+        return not (value is None or isinstance(value, basestring))
+
     def to_python(self, value):
+        if isinstance(value, PackageInfo):
+            return value
         if isinstance(value, basestring):
-            if value:
-                return MultiValueDict(json.loads(value))
-            else:
-                return MultiValueDict()
-        if isinstance(value, dict):
-            return MultiValueDict(value)
+            return PackageInfo(decode_package_info(value), encoded=value)
         if isinstance(value, MultiValueDict):
-            return value
+            return PackageInfo(dict(value.iterlists()))
+        if isinstance(value, dict):
+            return PackageInfo(value)
         raise ValueError('Unexpected value encountered when converting data to python')
 
+    def pre_save(self, model_instance, add):
+        # the raw value, unchanged values are not decoded
+        if self.attname not in model_instance.__dict__:
+            # deferred, e.g. by ``Release.objects.without_package_info()``,
+            # the stored value is loaded to be written back
+            return getattr(model_instance, self.attname)
+        return model_instance.__dict__[self.attname]
+
     def get_prep_value(self, value):
+        if isinstance(value, PackageInfo) and not value.changed:
+            return value.encoded
         if isinstance(value, MultiValueDict):
-            return json.dumps(dict(value.iterlists()))
+            return encode_package_info(dict(value.iterlists()))
         if isinstance(value, dict):
-            return json.dumps(value)
+            return encode_package_info(value)
         if isinstance(value, basestring) or value is None:
             return value
         raise ValueError('Unexpected value encountered when preparing for database')
 
+    def value_to_string(self, obj):
+        return self.get_prep_value(self._get_val_from_obj(obj))
+
     def get_internal_type(self):
         return 'TextField'
 
@@ -70,6 +216,10 @@ class PackageIndex(models.Model):
     updated_from_remote_at = models.DateTimeField(null=True, blank=True)
     xml_rpc_url = models.URLField(blank=True, verify_exists=False, default=PYPI_API_URL)
     simple_url = models.URLField(blank=True, verify_exists=False, default=PYPI_SIMPLE_URL)
+    full_sync_started_at = models.DateTimeField(null=True, blank=True,
+                                                help_text='start of the full sync that is currently in progress')
+    changelog_serial = models.IntegerField(null=True, blank=True,
+                                           help_text='serial of the last upstream changelog event that has been synced')
 
     objects = PackageIndexManager()
 
@@ -82,24 +232,93 @@ class PackageIndex(models.Model):
     @property
     def client(self):
         if not hasattr(self, '_client'):
-            self._client = xmlrpclib.ServerProxy(self.xml_rpc_url)
+            from packageindex.operations.transport import server_proxy
+            self._client = server_proxy(self.xml_rpc_url)
         return self._client
     
-    def update_package_list(self, since=None, full=False):
+    def update_package_list(self, since=None, full=False, concurrency=None):
+        """
+        Syncs the packages from the upstream index. Without ``since`` only
+        the changes since the last sync are applied: by changelog serial if
+        the upstream supports it, by timestamp otherwise.
+        """
+        from packageindex.operations.sync import SyncEngine, QueuedSyncEngine
+        from packageindex.operations.changelog import ChangelogSync
         now = datetime.datetime.now()
+        if not full and since is None and self.changelog_serial is not None:
+            return ChangelogSync(self, concurrency=concurrency).run()
         since = since or self.updated_from_remote_at
-        if since and not full:
-            timestamp = int(time.mktime(since.timetuple()))
-            packages = set([item[0] for item in self.client.changelog(timestamp)])
-        else:
-            packages = self.client.list_packages()
-        for package_name in packages:
-            package, created = Package.objects.get_or_create(index=self, name=package_name, defaults={'updated_from_remote_at': now})
-            print package, created
-            package.update_release_metadata(update_distribution_metadata=True)
+        if not since or full:
+            return QueuedSyncEngine(self, concurrency=concurrency).run_full()
+        timestamp = int(time.mktime(since.timetuple()))
+        packages = set([item[0] for item in self.client.changelog(timestamp)])
+        result = SyncEngine(self, concurrency=concurrency).run(packages)
         self.updated_from_remote_at = now
         self.save()
+        return result
+
+    def sync_progress(self):
+        """ Returns the number of queued packages of the current (or last) full
+        sync per state, plus the ``total``. """
+        progress = dict((state, 0) for state, label in SyncQueueItem.STATES)
+        for row in self.sync_queue.values('state').annotate(count=models.Count('pk')):
+            progress[row['state']] = row['count']
+        progress['total'] = sum(progress.values())
+        return progress
+
+
+
+class SyncQueueItem(models.Model):
+    """ A package that is part of the full sync of a package index """
+    PENDING = 'pending'
+    IN_PROGRESS = 'in_progress'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATES = (
+        (PENDING, _(u'pending')),
+        (IN_PROGRESS, _(u'in progress')),
+        (DONE, _(u'done')),
+        (FAILED, _(u'failed')),
+    )
+    index = models.ForeignKey(PackageIndex, related_name='sync_queue')
+    package_name = models.CharField(max_length=255)
+    state = models.CharField(max_length=16, choices=STATES, default=PENDING,
+                             db_index=True)
+    retries = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    next_attempt_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _(u"sync queue item")
+        verbose_name_plural = _(u"sync queue items")
+        unique_together = ("index", "package_name")
+
+    def __unicode__(self):
+        return u"%s (%s)" % (self.package_name, self.state)
+
 
+class JournalEntry(models.Model):
+    """
+    An append-only log of changes to packages, releases and distributions,
+    served by the ``changelog`` xml-rpc methods. The id is the serial of the
+    entry, ``submitted_at`` is in UTC.
+    """
+    name = models.CharField(max_length=255, db_index=True)
+    version = models.CharField(max_length=128, null=True, blank=True)
+    action = models.CharField(max_length=255)
+    submitted_at = models.DateTimeField(default=datetime.datetime.utcnow,
+                                        db_index=True)
+
+    class Meta:
+        verbose_name = _(u"journal entry")
+        verbose_name_plural = _(u"journal entries")
+        ordering = ['id']
+
+    def __unicode__(self):
+        if self.version:
+            return u"%s %s: %s" % (self.name, self.version, self.action)
+        return u"%s: %s" % (self.name, self.action)
 
 
 class Package(models.Model):
@@ -108,7 +327,9 @@ class Package(models.Model):
     auto_hide = models.BooleanField(default=True, blank=False)
     updated_from_remote_at = models.DateTimeField(null=True, blank=True)
     parsed_external_links_at = models.DateTimeField(null=True, blank=True)
-
+    last_modified = models.DateTimeField(null=True, blank=True, db_index=True,
+                                         editable=False,
+                                         help_text='the last time the releases or distributions of the package changed')
 
     class Meta:
         verbose_name = _(u"package")
@@ -137,57 +358,73 @@ class Package(models.Model):
         except Release.DoesNotExist:
             return None
 
+    def autohide_releases(self, unhide_latest=False, latest=None):
+        """ Hides all releases but the latest one (by ``created``, or
+        ``latest``) if ``auto_hide`` is set, with a single update query.
+        Returns the versions whose visibility changed. """
+        if not self.auto_hide:
+            return []
+        if latest is None:
+            try:
+                latest = self.releases.latest('created')
+            except Release.DoesNotExist:
+                return []
+        hide = self.releases.exclude(pk=latest.pk).filter(hidden=False)
+        changed = list(hide.values_list('version', flat=True))
+        if changed:
+            self.releases.filter(version__in=changed).update(hidden=True)
+        if unhide_latest and latest.hidden:
+            self.releases.filter(pk=latest.pk).update(hidden=False)
+            latest.hidden = False
+            changed.append(latest.version)
+        return changed
+
     def update_release_metadata(self, update_distribution_metadata=True):
+        """ Syncs the releases (and distributions) of this package from the
+        upstream index. Returns a ``ReconcileResult`` with the row counts. """
+        from packageindex.operations.reconcile import ReconcileResult, reconcile_package
         now = datetime.datetime.now()
         try:
             name = self.name.encode('ascii')
         except UnicodeEncodeError:
             print "illegal package name!"
-            return 
-        for release_string in self.index.client.package_releases(self.name, True): # True -> show hidden
-            data = self.index.client.release_data(self.name, release_string)
-            kwargs = {
-                'hidden': data.get('_pypi_hidden', False),
-                'package_info': MultiValueDict(),
-                'is_from_external': False,
-            }
-            for key, value in data.items():
-                kwargs['package_info'][key] = value
-            release, created = Release.objects.get_or_create(package=self, version=release_string, defaults=kwargs)
-            if not created:
-                for key, value in kwargs.items():
-                    setattr(release, key, value)
-                release.save()
-            if update_distribution_metadata:
-                release.update_distribution_metatdata()
+            return ReconcileResult()
+        client = self.index.client
+        versions = client.package_releases(self.name, True) # True -> show hidden
+        arglist = [(self.name, version) for version in versions]
+        releases_data = multicall(client, 'release_data', arglist)
+        releases_urls = [None] * len(versions)
+        if update_distribution_metadata:
+            releases_urls = multicall(client, 'release_urls', arglist)
+        result = reconcile_package(self, zip(versions, releases_data, releases_urls))
         self.updated_from_remote_at = now
         self.save()
+        return result
 
     def update_external_release_metadata(self, update_distribution_metadata=True):
-        try:
-            name = self.name.encode('ascii')
-        except UnicodeEncodeError:
-            print "illegal package name!"
-            return
-        mpackage = mirror.Package(package_name=name,
-                                  pypi_base_url=self.index.simple_url)
-        try:
-            files = mpackage.ls(filename_matches='*', external_links=True, follow_external_index_pages=True)
-        except (PackageError,), e:
-            print type(e), e
-            files = []
+        """ Adds the distributions that are linked from the simple page of
+        this package (and from the home and download pages it links to), see
+        ``operations.crawler`` """
+        from packageindex.operations.crawler import ExternalLinkCrawler
+        ExternalLinkCrawler(concurrency=1).crawl([self])
+
+    def add_distribution_links(self, files, is_from_external=True):
+        """ Creates the releases and distributions for ``files``, a list of
+        ``(url, filename, md5)`` tuples of links to distribution files:
+        external links (see ``operations.crawler``) or, with
+        ``is_from_external=False``, files hosted on the upstream index (see
+        ``operations.proxy``). Returns a ``ReconcileResult``. """
+        from packageindex.operations.reconcile import reconcile_links
+        project_name = safe_name(self.name).lower()
+        links = []
         for (dist_url, file_name, md5sum) in files:
             if dist_url.startswith('../../'):
                 # Ignore relative urls, as they are files hosted on pypi and have already been fetched over the xml-rpc
                 # api
                 continue
-            i = 1
             for dist in distros_for_url(dist_url):
-                if not dist.project_name == self.name or not dist.version:
+                if not dist.project_name.lower() == project_name or not dist.version:
                     continue
-                release = Release.objects.get_or_create(package=self,
-                                                        version=dist.version,
-                                                        defaults={'is_from_external': True})[0]
                 pyversion = dist.py_version or 'any'
                 f, ext = os.path.splitext(file_name)
                 if ext.startswith('.egg'):
@@ -198,33 +435,22 @@ class Package(models.Model):
                     filetype = 'bdist_dmg'
                 elif ext in ('.rpm',):
                     filetype = 'bdist_rpm'
-                elif ext in ('.tar.gz', '.zip', '.bz2'):
+                elif file_name.endswith(('.tar.gz', '.tgz', '.tar.bz2', '.zip')):
                     filetype = 'sdist'
                 else:
                     continue
-                defaults = {
-                    'filename': file_name,
-                    'url': dist_url,
-                    'is_from_external': True
-                }
-                distribution = Distribution.objects.get_or_create(
-                    release=release, pyversion=pyversion, filetype=filetype,
-                    defaults=defaults
-                )[0]
-                if distribution.is_from_external and not distribution.file:
-                    # we only overwrite the url if the package has not been mirrored yet and it is not a real pypi
-                    # hosted package
-                    distribution.filename = file_name
-                    distribution.url = dist_url
-                    distribution.save()
-
-                print i, dist.project_name, dist.py_version, dist.version, distribution
-                i += 1
-        self.parsed_external_links_at = datetime.datetime.now()
-        self.save()
-
+                print dist.project_name, dist.py_version, dist.version, file_name
+                links.append((dist.version, filetype, pyversion, file_name,
+                              dist_url, md5sum or ''))
+        return reconcile_links(self, links, is_from_external=is_from_external)
 
 
+class ReleaseManager(models.Manager):
+    def without_package_info(self):
+        """ Releases with ``package_info`` deferred, for listings that only
+        need the denormalized columns. Accessing ``package_info`` loads it
+        with an extra query. """
+        return self.get_query_set().defer('package_info')
 
 
 class Release(models.Model):
@@ -232,11 +458,27 @@ class Release(models.Model):
     version = models.CharField(max_length=128)
     metadata_version = models.CharField(max_length=64, default='1.0')
     package_info = PackageInfoField(blank=False)
+    metadata_digest = models.CharField(max_length=40, blank=True, default='',
+                                       editable=False,
+                                       help_text='digest of package_info, used to detect changes')
+    # copies of package_info fields, see DENORMALIZED_FIELDS
+    summary = models.CharField(max_length=255, blank=True, default='',
+                               db_index=True, editable=False)
+    author = models.CharField(max_length=255, blank=True, default='',
+                              db_index=True, editable=False)
+    license = models.CharField(max_length=255, blank=True, default='',
+                               db_index=True, editable=False)
+    requires_python = models.CharField(max_length=64, blank=True, default='',
+                                       db_index=True, editable=False)
+    classifiers = models.ManyToManyField(Classifier, related_name='releases',
+                                         blank=True, editable=False)
     hidden = models.BooleanField(default=False)
     created = models.DateTimeField(auto_now_add=True)
 
     is_from_external = models.BooleanField(default=False)
 
+    objects = ReleaseManager()
+
     class Meta:
         verbose_name = _(u"release")
         verbose_name_plural = _(u"releases")
@@ -247,50 +489,76 @@ class Release(models.Model):
     def __unicode__(self):
         return self.release_name
 
+    def save(self, *args, **kwargs):
+        changed = False
+        # an unchanged package_info is neither decoded nor encoded again
+        if not self.pk or self._meta.get_field('package_info').is_changed(self):
+            digest = package_info_digest(self.package_info)
+            changed = not self.pk or digest != self.metadata_digest
+            self.metadata_digest = digest
+            for field, value in denormalized_values(self.package_info).items():
+                setattr(self, field, value)
+        super(Release, self).save(*args, **kwargs)
+        if changed:
+            sync_release_classifiers([self])
+
     @property
     def release_name(self):
         return u"%s-%s" % (self.package.name, self.version)
 
-    @property
-    def summary(self):
-        return self.package_info.get('summary', u'')
-
     @property
     def description(self):
         return self.package_info.get('description', u'')
 
-    @property
-    def classifiers(self):
-        return self.package_info.getlist('classifier')
-
     @models.permalink
     def get_absolute_url(self):
         return ('packageindex-release', (), {'package': self.package.name,
                                            'version': self.version})
 
-    def update_distribution_metatdata(self):
-        for dist in self.package.index.client.release_urls(self.package.name, self.version):
-            data = {
-                'filename': dist['filename'],
-                'md5_digest': dist['md5_digest'],
-                'size': dist['size'],
-                'url': dist['url'],
-                'comment': dist['comment_text'],
-            }
-            try:
-                data['uploaded_at'] = datetime.datetime.strptime(dist['upload_time'].value, TIMEFORMAT)
-            except:
-                pass
-            distribution, created = Distribution.objects.get_or_create(
-                                        release=self,
-                                        filetype=dist['packagetype'],
-                                        pyversion=dist['python_version'],
-                                        defaults=data)
-            if not created:
-                # this means we have to update the existing record
-                for key, value in data.items():
-                    setattr(distribution, key, value)
-                distribution.save()
+    def update_distribution_metatdata(self, dists=None):
+        """ Updates the distributions of this release from the upstream
+        ``release_urls``. ``dists`` can be passed in if they have already
+        been fetched (e.g. in a multicall batch). """
+        from packageindex.operations.reconcile import reconcile_distributions
+        if dists is None:
+            dists = self.package.index.client.release_urls(self.package.name, self.version)
+        return reconcile_distributions([(self, dists)])
+
+def sync_release_classifiers(releases):
+    """ Sets the ``classifiers`` of ``releases`` to the classifiers in their
+    ``package_info``, with one query per step for all releases. Unknown
+    classifiers are created. """
+    from packageindex.utils import bulk_create
+    releases = [release for release in releases if release.pk]
+    if not releases:
+        return
+    names = dict((release.pk, classifier_names(release.package_info))
+                 for release in releases)
+    all_names = set(name for release_names in names.values() for name in release_names)
+    known = set(Classifier.objects.filter(name__in=all_names)
+                                  .values_list('name', flat=True))
+    bulk_create(Classifier, [Classifier(name=name) for name in all_names - known])
+    through = Release.classifiers.through
+    through.objects.filter(release__in=names.keys()).delete()
+    bulk_create(through, [through(release_id=pk, classifier_id=name)
+                          for pk, release_names in names.items()
+                          for name in release_names])
+
+class SearchTerm(models.Model):
+    """
+    Inverted index of the searchable ``package_info`` fields of releases, one
+    row per (release, field, word). See ``packageindex.operations.search``.
+    """
+    release = models.ForeignKey(Release, related_name="search_terms")
+    field = models.CharField(max_length=32)
+    term = models.CharField(max_length=64, db_index=True)
+
+    class Meta:
+        verbose_name = _(u"search term")
+        verbose_name_plural = _(u"search terms")
+
+    def __unicode__(self):
+        return u"%s: %s" % (self.field, self.term)
 
 class Distribution(models.Model):
     release = models.ForeignKey(Release, related_name="distributions")
@@ -305,6 +573,7 @@ class Distribution(models.Model):
                             max_length=255)
     size = models.IntegerField(null=True, blank=True)
     md5_digest = models.CharField(max_length=32, blank=True)
+    sha256_digest = models.CharField(max_length=64, blank=True, default='')
     filetype = models.CharField(max_length=32, blank=False,
                                 choices=conf.DIST_FILE_TYPES)
     pyversion = models.CharField(max_length=16, blank=True,
@@ -320,7 +589,9 @@ class Distribution(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     is_from_external = models.BooleanField(default=False)
-
+    upstream_digest = models.CharField(max_length=40, blank=True, default='',
+                                       editable=False,
+                                       help_text='digest of the upstream release_urls record, used to detect changes')
 
     class Meta:
         verbose_name = _(u"distribution")
@@ -342,8 +613,16 @@ class Distribution(models.Model):
 
     @property
     def path(self):
+        from packageindex.operations import proxy
         if self.file:
             return self.file.url
+        elif self.url and proxy.is_enabled() and \
+                proxy.is_proxied_package(self.release.package):
+            # stored on the first download, see operations.proxy
+            from django.core.urlresolvers import reverse
+            return reverse('packageindex-distribution-download',
+                           kwargs={'distribution_id': self.pk,
+                                   'filename': self.filename})
         else:
             return self.url
     
@@ -355,49 +634,64 @@ class Distribution(models.Model):
             return False
     
     def mirror_package(self, overwrite=False, commit=True):
+        """ Downloads the file into the local mirror, see
+        ``packageindex.operations.mirror``. Returns True if the file is
+        mirrored. """
+        from packageindex.operations.mirror import MirrorError, mirror_distribution
         if not overwrite and self.file:
             # file already downloaded. do nothing
             print u"already downloaded %s" % self.file
-            return
-        needs_save = False
-#        # try to find the package in my existing local mirror location
-#        EXISTING_MIRROR = '/Users/stefanfoulis/Coding/mirrors/mypypi/files/'
-#        maybe = os.path.abspath(os.path.join(EXISTING_MIRROR,
-#                                             self.release.package.name,
-#                                             self.filename))
-#        if os.path.exists(maybe):
-#            # yay! we already have the file!
-#            if False:
-#                # copy the file
-#                self.file = UploadedFile(name=maybe)
-#            else:
-#                # hardlink the file
-#                print "   hardlinking to '%s'" % maybe
-#                path = conf.RELEASE_UPLOAD_TO(instance=self, filename=self.filename)
-#                fullpath = os.path.join(settings.MEDIA_ROOT, path)
-#                if not os.path.exists(os.path.dirname(fullpath)):
-#                    os.makedirs(os.path.dirname(fullpath))
-#                if not os.path.exists(fullpath):
-#                    os.link(maybe, fullpath)
-#                self.file = path
-#            self.mirrored_at = datetime.datetime.now()
-#            needs_save = True
-        if self.url:
-            print "   downloading from '%s'" % self.url
-            try:
-                self.file = SimpleUploadedFile(
-                                name=self.filename,
-                                content=urllib2.urlopen(self.url).read())
-                self.mirrored_at = datetime.datetime.now()
-                needs_save = True
-            except (urllib2.HTTPError, urllib2.URLError, ValueError), e:
-                print u"      failed! %s (%s)" % (e, type(e),)
-                
-        if needs_save and commit:
+            return True
+        try:
+            mirror_distribution(self, overwrite=overwrite)
+        except MirrorError, e:
+            print u"      %s" % e
+            return False
+        if commit:
             self.save()
+        return True
     mirror_package.alters_data = True
 
 
+class CrawledPage(models.Model):
+    """
+    HTTP cache entry of a page read by the external link crawler (the simple
+    page of a package and the home and download pages it links to), see
+    ``packageindex.operations.crawler``. The links of the page are kept, so
+    a page that has not changed is not downloaded again.
+    """
+    url = models.TextField()
+    url_digest = models.CharField(max_length=40, unique=True, editable=False)
+    etag = models.CharField(max_length=255, blank=True, default='')
+    last_modified = models.CharField(max_length=64, blank=True, default='')
+    status = models.PositiveIntegerField(null=True, blank=True)
+    links = models.TextField(blank=True, default='[]')
+    fetched_at = models.DateTimeField(null=True, blank=True)
+    checked_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = _(u"crawled page")
+        verbose_name_plural = _(u"crawled pages")
+
+    def __unicode__(self):
+        return self.url
+
+    @staticmethod
+    def digest(url):
+        return sha_constructor(url.encode('utf-8')).hexdigest()
+
+    def save(self, *args, **kwargs):
+        self.url_digest = self.digest(self.url)
+        return super(CrawledPage, self).save(*args, **kwargs)
+
+    def get_links(self):
+        """ The ``(url, rel)`` pairs of the links on the page """
+        return [tuple(link) for link in json.loads(self.links or '[]')]
+
+    def set_links(self, links):
+        self.links = json.dumps([list(link) for link in links])
+
+
 try:
     from south.modelsinspector import add_introspection_rules
     add_introspection_rules([], ["^packageindex\.models\.PackageInfoField"])
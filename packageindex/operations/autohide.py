@@ -0,0 +1,59 @@
+#-*- coding: utf-8 -*-
+"""
+Autohide of old releases.
+
+Packages with ``auto_hide`` show only their latest release. The signal
+handlers apply this with one set-based update per package (see
+``Package.autohide_releases``) instead of saving every release. Within
+``suspended()`` (used by the syncs, which write many releases of a package)
+the handlers only remember the package, autohide is applied once per
+package when the outermost ``suspended()`` block ends. Suspension is per
+thread.
+"""
+from __future__ import with_statement
+import threading
+from contextlib import contextmanager
+
+from packageindex.models import Package
+from packageindex.operations import journal
+
+_state = threading.local()
+
+
+def is_suspended():
+    return getattr(_state, 'depth', 0) > 0
+
+def schedule(package_id, unhide_latest=False):
+    """ Remembers a package for the end of the current suspension """
+    _state.pending[package_id] = _state.pending.get(package_id, False) or unhide_latest
+
+def apply(package, unhide_latest=False, latest=None):
+    """ Hides all but the latest release of ``package`` (see
+    ``Package.autohide_releases``) and journals the changes. While autohide
+    is suspended the package is only scheduled. """
+    if is_suspended():
+        schedule(package.pk, unhide_latest)
+        return []
+    changed = package.autohide_releases(unhide_latest=unhide_latest, latest=latest)
+    journal.record_many((package.pk, version, u"update hidden")
+                        for version in changed)
+    return changed
+
+@contextmanager
+def suspended():
+    """ Suspends the autohide signal handlers in this thread and applies
+    autohide to the affected packages at the end """
+    if not is_suspended():
+        _state.pending = {}
+    _state.depth = getattr(_state, 'depth', 0) + 1
+    try:
+        yield
+    except:
+        _state.depth -= 1
+        raise
+    _state.depth -= 1
+    if _state.depth:
+        return
+    pending, _state.pending = _state.pending, {}
+    for package in Package.objects.filter(pk__in=pending.keys()):
+        apply(package, unhide_latest=pending[package.pk])
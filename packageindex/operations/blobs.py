@@ -0,0 +1,124 @@
+#-*- coding: utf-8 -*-
+"""
+Content addressed storage for mirrored distribution files.
+
+With ``DISTRIBUTION_STORAGE_LAYOUT = 'content_hash'`` every distinct file is
+stored once, as a blob named after its md5 under ``BLOB_DIR``. On a local
+file system storage the usual per-package path (``RELEASE_UPLOAD_TO``) is a
+hardlink to the blob, on other storages ``Distribution.file`` refers to the
+blob directly.
+"""
+import os
+import shutil
+
+from django.core.files import File
+from django.core.files.move import file_move_safe
+
+from packageindex import conf
+
+
+def is_content_addressed():
+    return conf.DISTRIBUTION_STORAGE_LAYOUT == 'content_hash'
+
+def blob_name(md5):
+    return os.path.join(conf.BLOB_DIR, md5[:2], md5[2:4], md5)
+
+def is_local(storage):
+    try:
+        storage.path('')
+    except NotImplementedError:
+        return False
+    return True
+
+def link_or_copy(src, dst):
+    if not os.path.exists(os.path.dirname(dst)):
+        os.makedirs(os.path.dirname(dst))
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        # different file systems
+        shutil.copyfile(src, dst)
+
+def add_blob(storage, path, md5, move=True):
+    """
+    Adds the local file ``path`` with the given ``md5`` to the blob store (or
+    drops it if the blob already exists) and returns the blob name. With
+    ``move=False`` the file is hardlinked (or copied) instead of moved.
+    """
+    name = blob_name(md5)
+    if storage.exists(name):
+        if move:
+            os.remove(path)
+        return name
+    if is_local(storage):
+        target = storage.path(name)
+        if not os.path.exists(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        if move:
+            file_move_safe(path, target)
+        else:
+            link_or_copy(path, target)
+    else:
+        fh = open(path, 'rb')
+        try:
+            storage.save(name, File(fh))
+        finally:
+            fh.close()
+        if move:
+            os.remove(path)
+    return name
+
+def link_distribution(distribution, blob):
+    """ Points the file of ``distribution`` at ``blob`` (without saving) """
+    storage = distribution.file.storage
+    if is_local(storage):
+        name = distribution.file.field.generate_filename(distribution, distribution.filename)
+        link_or_copy(storage.path(blob), storage.path(name))
+        distribution.file = name
+    else:
+        distribution.file = blob
+
+def iter_blobs(storage):
+    """ Yields the names of all blobs in ``storage`` """
+    if not storage.exists(conf.BLOB_DIR):
+        return
+    level1, files = storage.listdir(conf.BLOB_DIR)
+    for d1 in level1:
+        level2, files = storage.listdir(os.path.join(conf.BLOB_DIR, d1))
+        for d2 in level2:
+            dirs, files = storage.listdir(os.path.join(conf.BLOB_DIR, d1, d2))
+            for filename in files:
+                yield os.path.join(conf.BLOB_DIR, d1, d2, filename)
+
+def collect_garbage(storage, referenced_names, dry_run=False):
+    """
+    Deletes all blobs that none of the stored files ``referenced_names``
+    (the ``Distribution.file`` names) refers to, either by name or, on a
+    local storage, as a hardlink. Returns the number of deleted blobs and of
+    freed bytes.
+    """
+    referenced = set(referenced_names)
+    inodes = set()
+    local = is_local(storage)
+    if local:
+        for name in referenced:
+            try:
+                stat = os.stat(storage.path(name))
+            except OSError:
+                continue
+            inodes.add((stat.st_dev, stat.st_ino))
+    count, size = 0, 0
+    for name in iter_blobs(storage):
+        if name in referenced:
+            continue
+        if local:
+            stat = os.stat(storage.path(name))
+            if (stat.st_dev, stat.st_ino) in inodes:
+                continue
+        count += 1
+        size += storage.size(name)
+        if not dry_run:
+            storage.delete(name)
+    return count, size
@@ -0,0 +1,214 @@
+#-*- coding: utf-8 -*-
+"""
+Incremental sync of a package index driven by the serial numbers of the
+upstream changelog (``changelog_since_serial``).
+
+``PackageIndex.changelog_serial`` is a durable cursor: the serial of the last
+upstream event that has been applied. Events are applied in chunks and the
+cursor is saved after every chunk. Every event only touches the release or
+distribution it is about, instead of re-fetching the whole package.
+
+The cursor moves past events that failed to apply. Their packages are put in
+the ``SyncQueueItem`` table instead and are synced completely (with the
+backoff of a ``QueuedSyncEngine``) at the end of later runs.
+"""
+from __future__ import with_statement
+import datetime
+import xmlrpclib
+
+from django.db import transaction
+
+from packageindex import conf
+from packageindex.models import Package, Distribution, SyncQueueItem
+from packageindex.operations import autohide
+from packageindex.operations.reconcile import ReconcileResult, \
+                                              reconcile_package, \
+                                              reconcile_distributions
+from packageindex.operations.sync import QueuedSyncEngine
+from packageindex.utils import multicall
+
+
+def last_serial(client):
+    """ Returns the serial of the newest upstream changelog event, or None if
+    the upstream index does not support serials. """
+    try:
+        return client.changelog_last_serial()
+    except (xmlrpclib.Fault, xmlrpclib.ProtocolError):
+        return None
+
+
+class PackageChanges(object):
+    """ What has to be done for one package to apply a set of events """
+    def __init__(self, name):
+        self.name = name
+        self.create = False
+        self.remove = False
+        # version -> set of 'data', 'urls', 'remove'
+        self.releases = {}
+        # (version, filename) of removed files
+        self.removed_files = []
+
+    def release(self, version):
+        return self.releases.setdefault(version, set())
+
+    def add(self, version, action):
+        if action == 'remove':
+            if version:
+                self.releases[version] = set(['remove'])
+            else:
+                self.remove = True
+                self.releases = {}
+            return
+        self.remove = False
+        if action == 'create':
+            self.create = True
+        elif not version:
+            # package level actions (e.g. owner changes) are not mirrored
+            return
+        elif action == 'new release':
+            self.release(version).discard('remove')
+            self.release(version).update(['data', 'urls'])
+        elif action.startswith('add ') and ' file ' in action:
+            self.release(version).add('urls')
+        elif action.startswith('remove file '):
+            self.removed_files.append((version, action[len('remove file '):]))
+        elif action.startswith('update '):
+            self.release(version).add('data')
+        elif action == 'docupdate' or action.startswith(('add ', 'remove ')):
+            # documentation uploads and owner/maintainer changes
+            return
+        else:
+            self.release(version).update(['data', 'urls'])
+
+
+def plan_changes(events):
+    """ Groups ``(name, version, timestamp, action, serial)`` events by
+    package, in the order in which the packages were first changed. """
+    changes = {}
+    order = []
+    for event in sorted(events, key=lambda e: e[4]):
+        name, version, timestamp, action = event[:4]
+        if name not in changes:
+            changes[name] = PackageChanges(name)
+            order.append(name)
+        changes[name].add(version, action)
+    return [changes[name] for name in order]
+
+
+class ChangelogSync(object):
+    """
+    Applies the upstream changelog events since ``index.changelog_serial``.
+    """
+    def __init__(self, index, chunk_size=None, concurrency=None):
+        self.index = index
+        self.chunk_size = chunk_size or conf.CHANGELOG_CHUNK_SIZE
+        self.concurrency = concurrency
+        self.synced = []
+        self.failed = []
+        self.result = ReconcileResult()
+
+    def run(self):
+        client = self.index.client
+        events = client.changelog_since_serial(self.index.changelog_serial)
+        events = sorted(events, key=lambda e: e[4])
+        while events:
+            chunk, events = events[:self.chunk_size], events[self.chunk_size:]
+            for changes in plan_changes(chunk):
+                self.apply_package(changes)
+            self.index.changelog_serial = chunk[-1][4]
+            self.index.updated_from_remote_at = datetime.datetime.now()
+            self.index.save()
+        self.retry_queued()
+        return {'synced': self.synced, 'failed': self.failed,
+                'result': self.result}
+
+    def apply_package(self, changes):
+        try:
+            with autohide.suspended():
+                result = self._apply_package(changes)
+        except Exception, e:
+            print u"failed to apply changes of %s: %s (%s)" % (changes.name, e, type(e))
+            self.failed.append(changes.name)
+            self.queue_retry(changes.name, e)
+        else:
+            self.synced.append(changes.name)
+            self.result.add(result)
+
+    def queue_retry(self, package_name, error):
+        """ Queues a package whose events could not be applied for a complete
+        sync, see ``retry_queued`` """
+        item, created = SyncQueueItem.objects.get_or_create(
+                            index=self.index, package_name=package_name)
+        if item.state in (SyncQueueItem.DONE, SyncQueueItem.FAILED):
+            # left over from the last full sync
+            item.state = SyncQueueItem.PENDING
+            item.retries = 0
+            item.save()
+        QueuedSyncEngine(self.index).package_failed(package_name, error)
+
+    def retry_queued(self):
+        """ Syncs the queued packages that are due, and the ones a crashed
+        run left in progress. A full sync in progress syncs them itself. """
+        if self.index.full_sync_started_at:
+            return
+        engine = QueuedSyncEngine(self.index, concurrency=self.concurrency)
+        engine.release_stale()
+        package_names = engine.claim_batch()
+        while package_names:
+            engine.run(package_names)
+            package_names = engine.claim_batch()
+        self.synced.extend(engine.synced)
+        self.failed.extend(engine.failed)
+        self.result.add(engine.result)
+
+    @transaction.commit_on_success
+    def _apply_package(self, changes):
+        result = ReconcileResult()
+        if changes.remove:
+            print u"removing %s" % changes.name
+            Package.objects.filter(index=self.index, name=changes.name).delete()
+            return result
+        package, created = Package.objects.get_or_create(
+                                index=self.index, name=changes.name,
+                                defaults={'updated_from_remote_at': datetime.datetime.now()})
+        package.index = self.index
+        print u"applying changes to %s" % package
+
+        removed = [version for version, needs in changes.releases.items()
+                   if 'remove' in needs]
+        if removed:
+            package.releases.filter(version__in=removed).delete()
+        for version, filename in changes.removed_files:
+            Distribution.objects.filter(release__package=package,
+                                        release__version=version,
+                                        filename=filename).delete()
+
+        existing = set(package.releases.filter(version__in=changes.releases.keys())
+                                      .values_list('version', flat=True))
+        needs_data = []
+        needs_urls = []
+        for version, needs in changes.releases.items():
+            if 'remove' in needs:
+                continue
+            if 'data' in needs or version not in existing:
+                needs_data.append(version)
+            if 'urls' in needs:
+                needs_urls.append(version)
+
+        client = self.index.client
+        data = dict(zip(needs_data, multicall(client, 'release_data',
+                                              [(package.name, v) for v in needs_data])))
+        urls = dict(zip(needs_urls, multicall(client, 'release_urls',
+                                              [(package.name, v) for v in needs_urls])))
+        if needs_data:
+            result.add(reconcile_package(package,
+                            [(version, data[version], urls.get(version))
+                             for version in needs_data]))
+        urls_only = [version for version in needs_urls if version not in data]
+        if urls_only:
+            releases = package.releases.filter(version__in=urls_only)
+            result.add(reconcile_distributions([(release, urls[release.version])
+                                                for release in releases]))
+        package.updated_from_remote_at = datetime.datetime.now()
+        package.save()
+        return result
@@ -0,0 +1,264 @@
+#-*- coding: utf-8 -*-
+"""
+Crawler for the external links of packages.
+
+For every package the simple page on its upstream index is read, and the
+home and download pages it links to (``rel="homepage"`` and
+``rel="download"``) are followed one level. Links to distribution files on
+these pages become ``is_from_external`` releases and distributions, see
+``Package.add_distribution_links``. Links that are relative to the simple page
+are hosted on the index and synced over xml-rpc.
+
+Packages are crawled by ``CRAWL_CONCURRENCY`` worker threads, every host is
+requested at most ``CRAWL_RATE_LIMITS`` (or ``CRAWL_DEFAULT_RATE_LIMIT``)
+times per second. The ETag and Last-Modified date and the links of every
+page are stored as a ``CrawledPage``, pages are requested conditionally and
+an unchanged page is not downloaded again. Packages whose pages have not
+changed since they were last crawled are skipped.
+"""
+from __future__ import with_statement
+import cgi
+import collections
+import datetime
+import httplib
+import os
+import threading
+import urllib
+import urllib2
+import urlparse
+from HTMLParser import HTMLParser, HTMLParseError
+
+from packageindex import conf
+from packageindex.models import CrawledPage, Package
+from packageindex.operations import response_cache
+from packageindex.operations.sync import RateLimiter
+from packageindex.utils import run_concurrently
+
+FOLLOWED_RELS = ('homepage', 'download')
+DISTRIBUTION_EXTENSIONS = ('.tar.gz', '.tgz', '.tar.bz2', '.zip', '.egg',
+                           '.exe', '.dmg', '.rpm')
+FETCH_ERRORS = (urllib2.URLError, httplib.HTTPException, IOError, ValueError)
+
+
+class CrawlError(Exception):
+    pass
+
+
+class LinkParser(HTMLParser):
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag != 'a':
+            return
+        attrs = dict(attrs)
+        if attrs.get('href'):
+            self.links.append((attrs['href'].strip(), attrs.get('rel') or ''))
+
+
+def parse_links(html):
+    """ The ``(href, rel)`` pairs of all links in ``html``. Broken markup
+    ends the parsing, the links before it are returned. """
+    parser = LinkParser()
+    try:
+        parser.feed(html)
+        parser.close()
+    except (HTMLParseError, UnicodeError):
+        pass
+    return parser.links
+
+def decode_page(response, content):
+    charset = cgi.parse_header(response.info().getheader('Content-Type') or '')[1]\
+                 .get('charset', 'utf-8')
+    try:
+        return content.decode(charset, 'replace')
+    except LookupError:
+        return content.decode('utf-8', 'replace')
+
+def is_distribution_url(url):
+    path = urlparse.urlsplit(url)[2]
+    return path.lower().endswith(DISTRIBUTION_EXTENSIONS)
+
+def file_link(url):
+    """ ``(url, filename, md5)`` of a link to a distribution file, the md5
+    is taken from a ``#md5=`` fragment """
+    url, fragment = urlparse.urldefrag(url)
+    md5 = ''
+    if fragment.startswith('md5='):
+        md5 = fragment[len('md5='):]
+    filename = urllib.unquote(os.path.basename(urlparse.urlsplit(url)[2]))
+    return url, filename, md5
+
+def fetch_page(url, timeout=None):
+    """
+    Reads the page at ``url`` with a conditional request and stores it as a
+    ``CrawledPage``. Returns the page and whether it was downloaded (False if
+    it has not been modified). Raises one of ``FETCH_ERRORS`` (e.g. a
+    ``urllib2.HTTPError`` for a missing page) if the page can't be read.
+    """
+    try:
+        page = CrawledPage.objects.get(url_digest=CrawledPage.digest(url))
+    except CrawledPage.DoesNotExist:
+        page = CrawledPage(url=url)
+    request = urllib2.Request(url.encode('utf-8'))
+    if page.etag:
+        request.add_header('If-None-Match', page.etag)
+    if page.last_modified:
+        request.add_header('If-Modified-Since', page.last_modified)
+    page.checked_at = datetime.datetime.now()
+    try:
+        response = urllib2.urlopen(request, timeout=timeout or conf.CRAWL_TIMEOUT)
+    except urllib2.HTTPError, e:
+        if page.pk:
+            page.status = e.code
+            page.save()
+        if e.code == 304 and page.pk:
+            return page, False
+        raise
+    try:
+        info = response.info()
+        links = []
+        if 'html' in (info.getheader('Content-Type') or 'text/html'):
+            content = response.read(conf.CRAWL_MAX_PAGE_SIZE)
+            links = parse_links(decode_page(response, content))
+    finally:
+        response.close()
+    page.etag = (info.getheader('ETag') or '')[:255]
+    page.last_modified = (info.getheader('Last-Modified') or '')[:64]
+    page.status = response.getcode()
+    page.fetched_at = page.checked_at
+    page.set_links(links)
+    page.save()
+    return page, True
+
+def simple_page_url(package):
+    name = urllib.quote(package.name.encode('utf-8'))
+    return '%s/%s/' % (package.index.simple_url.rstrip('/'), name)
+
+
+class ExternalLinkCrawler(object):
+    """ Crawls the external links of packages, see the module
+    documentation """
+    def __init__(self, concurrency=None, limiter=None):
+        if concurrency is None:
+            concurrency = conf.CRAWL_CONCURRENCY
+        self.concurrency = concurrency
+        self.limiter = limiter or RateLimiter(conf.CRAWL_RATE_LIMITS,
+                                              conf.CRAWL_DEFAULT_RATE_LIMIT)
+        self.stats = {'packages': 0, 'skipped': 0, 'failed': 0,
+                      'fetched': 0, 'unchanged': 0, 'errors': 0}
+        self._lock = threading.Lock()
+        # pages that are linked from several packages are read once per crawl,
+        # the oldest are dropped after CRAWL_SHARED_PAGES
+        self._pages = {}
+        self._page_order = collections.deque()
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def crawl(self, packages):
+        """ Crawls ``packages`` (any iterable of ``Package`` objects).
+        Returns the packages that failed. """
+        failed = []
+        def crawl_package(package):
+            try:
+                self.crawl_package(package)
+            except Exception, e:
+                print u"failed to crawl %s: %s (%s)" % (package, e, type(e))
+                self.count('failed')
+                with self._lock:
+                    failed.append(package)
+        run_concurrently(crawl_package, packages, self.concurrency)
+        return failed
+
+    def crawl_package(self, package):
+        fetched = []
+        def fetch():
+            files, fetched_at, page_urls = self.package_files(package)
+            fetched.append(fetched_at)
+            return files, page_urls
+        files = response_cache.page_listing(simple_page_url(package), fetch)
+        self.count('packages')
+        last_crawled = package.parsed_external_links_at
+        if fetched and last_crawled and fetched[0] and fetched[0] <= last_crawled:
+            self.count('skipped')
+            Package.objects.filter(pk=package.pk).update(
+                                parsed_external_links_at=datetime.datetime.now())
+            return
+        package.add_distribution_links(files)
+        package.parsed_external_links_at = datetime.datetime.now()
+        package.save()
+
+    def package_files(self, package):
+        """ The ``(url, filename, md5)`` tuples of the external distribution
+        files of ``package``, the time any of its pages was last downloaded
+        and the urls of the pages. Raises ``CrawlError`` if the simple page
+        can't be read. """
+        url = simple_page_url(package)
+        links, fetched_at = self.get_page(url)
+        if fetched_at is None:
+            raise CrawlError(u"the simple page %s could not be read" % url)
+        files = []
+        followed = []
+        page_urls = [url]
+        for href, rel in links:
+            if not urlparse.urlsplit(href)[0]:
+                # hosted on the index
+                continue
+            if rel in FOLLOWED_RELS and not is_distribution_url(href):
+                followed.append(href)
+            elif is_distribution_url(href):
+                files.append(file_link(href))
+        for page_url in followed:
+            if urlparse.urlsplit(page_url)[0] not in ('http', 'https'):
+                continue
+            page_links, page_fetched_at = self.get_page(page_url)
+            page_urls.append(page_url)
+            for href, rel in page_links:
+                href = urlparse.urljoin(page_url, href)
+                if is_distribution_url(href):
+                    files.append(file_link(href))
+            if page_fetched_at is not None:
+                fetched_at = max(fetched_at, page_fetched_at)
+        return files, fetched_at, page_urls
+
+    def get_page(self, url):
+        """ The links of the page at ``url`` and the time it was last
+        downloaded, every url is read once per crawl (as long as it is one
+        of the last ``CRAWL_SHARED_PAGES``) """
+        with self._lock:
+            event = self._pages.get(url)
+            owner = event is None
+            if owner:
+                event = self._pages[url] = threading.Event()
+                self._page_order.append(url)
+                if len(self._page_order) > conf.CRAWL_SHARED_PAGES:
+                    # threads that wait for the page keep their event
+                    del self._pages[self._page_order.popleft()]
+        if owner:
+            try:
+                event.result = self.read_page(url)
+            finally:
+                event.set()
+        else:
+            event.wait()
+        return getattr(event, 'result', ([], None))
+
+    def read_page(self, url):
+        """ The links of the page at ``url`` and the time it was last
+        downloaded, the stored links if the page can't be read """
+        self.limiter.wait(urlparse.urlsplit(url)[1])
+        try:
+            page, modified = fetch_page(url)
+        except FETCH_ERRORS, e:
+            print u"   failed to read %s: %s (%s)" % (url, e, type(e))
+            self.count('errors')
+            try:
+                page = CrawledPage.objects.get(url_digest=CrawledPage.digest(url))
+            except CrawledPage.DoesNotExist:
+                return [], None
+            return page.get_links(), page.fetched_at
+        self.count(modified and 'fetched' or 'unchanged')
+        return page.get_links(), page.fetched_at
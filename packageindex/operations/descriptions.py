@@ -0,0 +1,117 @@
+#-*- coding: utf-8 -*-
+"""
+Cached reStructuredText rendering of release descriptions.
+
+The HTML fragment of a description is kept in the django cache under a key
+made from the md5 of the description and of the docutils settings
+(``RESTRUCTUREDTEXT_FILTER_SETTINGS``), so changed descriptions or settings
+never get a stale fragment. Descriptions are rendered when releases are
+synced or uploaded, the ``saferst`` filter only renders descriptions that are
+missing from the cache.
+
+With ``RST_PRERENDER_IN_BACKGROUND`` the descriptions are rendered by a single
+worker thread from a queue of at most ``RST_PRERENDER_QUEUE_SIZE`` batches
+(callers wait while it is full). The queue is drained before the process
+exits, so a sync command does not drop the descriptions it queued. Fragments
+rendered by a command only reach the web server through a cache backend that
+both processes share (e.g. memcached, not the local memory cache).
+"""
+from __future__ import with_statement
+import atexit
+import Queue
+import threading
+import traceback
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.encoding import smart_str, force_unicode
+from django.utils.hashcompat import md5_constructor
+from django.utils.html import escape
+
+from packageindex import conf
+
+
+def docutils_settings():
+    return getattr(settings, "RESTRUCTUREDTEXT_FILTER_SETTINGS", dict())
+
+def description_key(text):
+    digest = md5_constructor(smart_str(text))
+    digest.update(repr(sorted(docutils_settings().items())))
+    return 'packageindex:rst:%s' % digest.hexdigest()
+
+def render(text):
+    """ The HTML fragment of the reStructuredText ``text``, or the escaped
+    ``text`` if it can not be rendered """
+    try:
+        from docutils.core import publish_parts
+    except ImportError:
+        return force_unicode(escape(text))
+    try:
+        parts = publish_parts(source=smart_str(text),
+                              writer_name="html4css1",
+                              settings_overrides=docutils_settings())
+    except:
+        return force_unicode(escape(text))
+    return force_unicode(parts["fragment"])
+
+def get_rendered(text):
+    """ The cached HTML fragment of ``text``, rendered if it is missing """
+    key = description_key(text)
+    html = cache.get(key)
+    if html is None:
+        html = render(text)
+        cache.set(key, html, conf.RST_CACHE_TIMEOUT)
+    return html
+
+def prerender(texts):
+    """ Renders the ``texts`` that are not cached yet. Returns the number of
+    rendered texts. """
+    keys = dict((description_key(text), text) for text in texts if text)
+    if not keys:
+        return 0
+    cached = cache.get_many(keys.keys())
+    rendered = 0
+    for key, text in keys.items():
+        if key not in cached:
+            cache.set(key, render(text), conf.RST_CACHE_TIMEOUT)
+            rendered += 1
+    return rendered
+
+_queue = Queue.Queue(conf.RST_PRERENDER_QUEUE_SIZE)
+_worker = None
+_worker_lock = threading.Lock()
+
+def _work():
+    while True:
+        texts = _queue.get()
+        try:
+            prerender(texts)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            _queue.task_done()
+
+def _start_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_work,
+                                       name='packageindex-prerender')
+            _worker.daemon = True
+            _worker.start()
+
+def wait():
+    """ Blocks until the queued descriptions are rendered """
+    _queue.join()
+
+atexit.register(wait)
+
+def prerender_releases(releases):
+    """ Renders the descriptions of ``releases``, in the background worker if
+    ``RST_PRERENDER_IN_BACKGROUND`` is set """
+    texts = [release.description for release in releases]
+    if not conf.RST_PRERENDER_IN_BACKGROUND:
+        return prerender(texts)
+    if texts:
+        _start_worker()
+        _queue.put(texts)
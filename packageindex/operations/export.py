@@ -0,0 +1,88 @@
+#-*- coding: utf-8 -*-
+"""
+Export of the ``/simple/`` pages into a directory that can be served by a
+plain web server: ``index.html`` for the root listing and
+``<package>/index.html`` for every package, rendered with the same templates
+as the views.
+
+Every file is written to a temporary file in the same directory and renamed
+into place, so the web server never sees a partially written page. The time
+of the last export is kept in ``.last-export``; an incremental export only
+writes the packages whose ``last_modified`` is newer and the root listing if
+packages were added or removed.
+"""
+import datetime
+import os
+import shutil
+import tempfile
+
+from packageindex.models import Package
+from packageindex.operations.simple_pages import render_index_page, \
+                                                 render_package_page
+
+MARKER = '.last-export'
+MARKER_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def write_atomic(path, content):
+    directory = os.path.dirname(path)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        os.write(fd, content)
+        os.close(fd)
+        os.chmod(temp_path, 0644)
+        os.rename(temp_path, path)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def last_export(directory):
+    try:
+        value = open(os.path.join(directory, MARKER)).read().strip()
+        return datetime.datetime.strptime(value, MARKER_FORMAT)
+    except (IOError, ValueError):
+        return None
+
+def exported_packages(directory):
+    if not os.path.isdir(directory):
+        return set()
+    return set(name.decode('utf-8') for name in os.listdir(directory)
+               if os.path.exists(os.path.join(directory, name, 'index.html')))
+
+def export_simple(directory, incremental=False):
+    """
+    Writes the simple pages into ``directory``. Returns the number of written
+    and of removed package pages.
+    """
+    started_at = datetime.datetime.now()
+    since = incremental and last_export(directory) or None
+    package_names = set(Package.objects.values_list('name', flat=True))
+    exported = exported_packages(directory)
+
+    packages = Package.objects.all()
+    if since is not None:
+        # the marker has a resolution of seconds, changes in the second in
+        # which the last export started are written again
+        changed = dict((package.name, package) for package in
+                       packages.filter(last_modified__gte=since))
+        for package in packages.filter(name__in=package_names - exported):
+            changed[package.name] = package
+        packages = changed.values()
+    written = 0
+    for package in packages:
+        write_atomic(os.path.join(directory, package.name.encode('utf-8'), 'index.html'),
+                     render_package_page(package).encode('utf-8'))
+        written += 1
+
+    removed = exported - package_names
+    for name in removed:
+        shutil.rmtree(os.path.join(directory, name.encode('utf-8')))
+    if since is None or package_names != exported:
+        write_atomic(os.path.join(directory, 'index.html'),
+                     render_index_page().encode('utf-8'))
+    write_atomic(os.path.join(directory, MARKER),
+                 started_at.strftime(MARKER_FORMAT))
+    return written, len(removed)
@@ -0,0 +1,88 @@
+#-*- coding: utf-8 -*-
+"""
+Chunked hashing of distribution files.
+
+Files are read in chunks of ``HASH_CHUNK_SIZE`` bytes and their md5 and
+sha256 are computed in one pass. The digests are stored with a queryset
+``update``, so hashing a distribution never saves (and signals) it again.
+"""
+from __future__ import with_statement
+import hashlib
+import threading
+
+from packageindex import conf
+from packageindex.models import Distribution
+from packageindex.utils import run_concurrently
+
+
+class Digests(object):
+    """ The md5 and sha256 of data that is passed to ``update`` """
+    def __init__(self):
+        self._md5 = hashlib.md5()
+        self._sha256 = hashlib.sha256()
+
+    def update(self, data):
+        self._md5.update(data)
+        self._sha256.update(data)
+
+    @property
+    def md5(self):
+        return self._md5.hexdigest()
+
+    @property
+    def sha256(self):
+        return self._sha256.hexdigest()
+
+
+def file_digests(fh, chunk_size=None):
+    digests = Digests()
+    for chunk in iter(lambda: fh.read(chunk_size or conf.HASH_CHUNK_SIZE), ''):
+        digests.update(chunk)
+    return digests
+
+def hash_distribution(distribution, overwrite_md5=False):
+    """
+    Hashes the stored file of ``distribution`` and stores the sha256 (and the
+    md5 if it is not known or ``overwrite_md5`` is set). Returns the
+    ``Digests``.
+    """
+    storage = distribution.file.storage
+    with storage.open(distribution.file.name, 'rb') as fh:
+        digests = file_digests(fh)
+    values = {'sha256_digest': digests.sha256}
+    if overwrite_md5 or not distribution.md5_digest:
+        values['md5_digest'] = digests.md5
+    Distribution.objects.filter(pk=distribution.pk).update(**values)
+    for field, value in values.items():
+        setattr(distribution, field, value)
+    return digests
+
+def hash_distributions(distributions, concurrency=None):
+    """
+    Hashes the files of all ``distributions`` with ``concurrency`` worker
+    threads. Returns the distributions that could not be hashed and those
+    whose file does not match the known md5.
+    """
+    if concurrency is None:
+        concurrency = conf.HASH_CONCURRENCY
+    failed = []
+    mismatched = []
+    lock = threading.Lock()
+
+    def hash(distribution):
+        expected_md5 = distribution.md5_digest
+        try:
+            digests = hash_distribution(distribution)
+        except Exception, e:
+            print u"failed to hash %s: %s (%s)" % (distribution, e, type(e))
+            with lock:
+                failed.append(distribution)
+            return
+        if expected_md5 and digests.md5 != expected_md5:
+            print u"md5 mismatch for %s: expected %s, got %s" % (
+                                    distribution, expected_md5, digests.md5)
+            with lock:
+                mismatched.append(distribution)
+
+    run_concurrently(hash, distributions, concurrency)
+    return failed, mismatched
@@ -0,0 +1,61 @@
+#-*- coding: utf-8 -*-
+"""
+The event journal behind the ``changelog`` xml-rpc methods.
+
+Actions use the vocabulary of the upstream changelog, so another
+packageindex can sync from this one with ``ChangelogSync``:
+
+ - ``create`` and ``remove`` (without a version) for packages
+ - ``new release``, ``update <fields>`` and ``remove`` for releases
+ - ``add <pyversion> file <filename>`` and ``remove file <filename>`` for
+   distributions
+
+Changes made through the models (distutils uploads, the admin) are recorded
+by signal handlers (see ``packageindex.signals``), the bulk sync code
+records its changes with ``record_many``.
+"""
+import calendar
+import datetime
+
+from packageindex.models import JournalEntry
+from packageindex.utils import bulk_create
+
+
+def add_file_action(distribution):
+    return u"add %s file %s" % (distribution.pyversion, distribution.filename)
+
+def remove_file_action(distribution):
+    return u"remove file %s" % distribution.filename
+
+def record(name, version, action):
+    return JournalEntry.objects.create(name=name, version=version, action=action)
+
+def record_many(entries):
+    """ Records ``(name, version, action)`` tuples with one insert """
+    now = datetime.datetime.utcnow()
+    bulk_create(JournalEntry, [JournalEntry(name=name, version=version,
+                                            action=action, submitted_at=now)
+                               for name, version, action in entries])
+
+def timestamp(entry):
+    return calendar.timegm(entry.submitted_at.utctimetuple())
+
+def since(since):
+    """ The entries since the UTC timestamp ``since`` (seconds since the
+    epoch) """
+    since = datetime.datetime.utcfromtimestamp(since)
+    return JournalEntry.objects.filter(submitted_at__gte=since).order_by('id')
+
+def since_serial(serial):
+    return JournalEntry.objects.filter(id__gt=serial).order_by('id')
+
+def last_serial():
+    last = JournalEntry.objects.order_by('-id').values_list('id', flat=True)[:1]
+    return last and last[0] or 0
+
+def last_package_serial():
+    """ The serial of the last entry that created or removed a package """
+    last = JournalEntry.objects.filter(version__isnull=True,
+                                       action__in=(u"create", u"remove"))\
+                               .order_by('-id').values_list('id', flat=True)[:1]
+    return last and last[0] or 0
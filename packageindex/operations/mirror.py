@@ -0,0 +1,184 @@
+#-*- coding: utf-8 -*-
+"""
+Streaming download of distribution files into the local mirror.
+
+Files are downloaded in chunks of ``MIRROR_CHUNK_SIZE`` into a partial file
+in ``MIRROR_TEMP_DIR`` while their md5 and sha256 are computed. The md5 is
+verified against ``Distribution.md5_digest`` before the file is moved into
+storage.
+Interrupted downloads are resumed with a HTTP range request and files that
+are already in storage with a matching size and md5 are not downloaded again.
+With the content addressed layout (see ``operations.blobs``) files whose md5
+is already in the blob store are only linked.
+"""
+from __future__ import with_statement
+import datetime
+import os
+import tempfile
+import threading
+import urllib2
+
+from django.core.files import File
+
+from packageindex import conf
+from packageindex.operations import blobs
+from packageindex.operations.hashing import Digests, file_digests
+from packageindex.utils import run_concurrently
+
+
+class MirrorError(Exception):
+    pass
+
+
+class PartialFile(File):
+    """ A downloaded file on disk. FileSystemStorage moves it into place
+    instead of copying it. """
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def partial_path(distribution):
+    temp_dir = conf.MIRROR_TEMP_DIR or tempfile.gettempdir()
+    return os.path.join(temp_dir, 'packageindex-%s-%s.part' % (
+                            distribution.pk, os.path.basename(distribution.filename)))
+
+def stored_copy(distribution):
+    """ Returns the storage name of an existing copy of the file with the
+    expected size and md5, or None """
+    storage = distribution.file.storage
+    name = distribution.file.field.generate_filename(distribution, distribution.filename)
+    if not storage.exists(name) or not distribution.md5_digest:
+        return None
+    if distribution.size is not None and storage.size(name) != distribution.size:
+        return None
+    with storage.open(name, 'rb') as fh:
+        if file_digests(fh).md5 != distribution.md5_digest:
+            return None
+    return name
+
+def download(url, path, chunk_size=None):
+    """
+    Streams ``url`` to ``path`` and returns the ``Digests`` of the complete
+    file. If ``path`` already exists the download is resumed where it stopped,
+    a partial file that is already complete is used as it is.
+    """
+    chunk_size = chunk_size or conf.MIRROR_CHUNK_SIZE
+    digests = Digests()
+    offset = 0
+    request = urllib2.Request(url)
+    if os.path.exists(path):
+        offset = os.path.getsize(path)
+        request.add_header('Range', 'bytes=%s-' % offset)
+    try:
+        response = urllib2.urlopen(request)
+    except urllib2.HTTPError, e:
+        if e.code != 416 or not offset:
+            raise
+        # the partial file is not shorter than the file, it is either complete
+        # or broken
+        length = (e.info().getheader('Content-Range') or '').rpartition('/')[2]
+        e.close()
+        if length != str(offset):
+            os.remove(path)
+            return download(url, path, chunk_size)
+        with open(path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(chunk_size), ''):
+                digests.update(chunk)
+        return digests
+    try:
+        if offset and response.getcode() == 206:
+            mode = 'ab'
+            with open(path, 'rb') as fh:
+                for chunk in iter(lambda: fh.read(chunk_size), ''):
+                    digests.update(chunk)
+        else:
+            # the server does not support ranges, start over
+            mode = 'wb'
+        with open(path, mode) as fh:
+            for chunk in iter(lambda: response.read(chunk_size), ''):
+                digests.update(chunk)
+                fh.write(chunk)
+    finally:
+        response.close()
+    return digests
+
+def mirror_distribution(distribution, overwrite=False):
+    """
+    Stores the file of ``distribution`` in the local mirror (without saving
+    the distribution). Raises ``MirrorError`` if the download fails or the
+    md5 does not match.
+    """
+    content_addressed = blobs.is_content_addressed()
+    storage = distribution.file.storage
+    if not overwrite and content_addressed and distribution.md5_digest:
+        blob = blobs.blob_name(distribution.md5_digest)
+        if storage.exists(blob):
+            print u"   already in blob store '%s'" % blob
+            blobs.link_distribution(distribution, blob)
+            distribution.mirrored_at = datetime.datetime.now()
+            return
+    elif not overwrite:
+        name = stored_copy(distribution)
+        if name:
+            print u"   already in storage '%s'" % name
+            distribution.file = name
+            distribution.mirrored_at = datetime.datetime.now()
+            return
+    if not distribution.url:
+        raise MirrorError(u"%s has no url" % distribution)
+    path = partial_path(distribution)
+    print u"   downloading from '%s'" % distribution.url
+    try:
+        digests = download(distribution.url, path)
+    except (urllib2.HTTPError, urllib2.URLError, ValueError, IOError), e:
+        raise MirrorError(u"failed! %s (%s)" % (e, type(e)))
+    md5 = digests.md5
+    if distribution.md5_digest and md5 != distribution.md5_digest:
+        os.remove(path)
+        raise MirrorError(u"md5 mismatch for %s: expected %s, got %s" % (
+                            distribution.url, distribution.md5_digest, md5))
+    if content_addressed:
+        blob = blobs.blob_name(md5)
+        if overwrite and storage.exists(blob):
+            storage.delete(blob)
+        blobs.link_distribution(distribution, blobs.add_blob(storage, path, md5))
+        distribution.md5_digest = md5
+        distribution.sha256_digest = digests.sha256
+        distribution.mirrored_at = datetime.datetime.now()
+        return
+    name = distribution.file.field.generate_filename(distribution, distribution.filename)
+    if overwrite and storage.exists(name):
+        storage.delete(name)
+    with open(path, 'rb') as fh:
+        content = PartialFile(fh)
+        # the file may be moved away by the storage
+        content.size = os.path.getsize(path)
+        distribution.file.save(distribution.filename, content, save=False)
+    if os.path.exists(path):
+        os.remove(path)
+    distribution.md5_digest = md5
+    distribution.sha256_digest = digests.sha256
+    distribution.mirrored_at = datetime.datetime.now()
+
+def mirror_distributions(distributions, overwrite=False, concurrency=None):
+    """
+    Mirrors the files of all ``distributions`` with ``concurrency`` parallel
+    downloads. Returns the list of distributions that failed.
+    """
+    if concurrency is None:
+        concurrency = conf.MIRROR_CONCURRENCY
+    failed = []
+    lock = threading.Lock()
+
+    def mirror(distribution):
+        try:
+            mirrored = distribution.mirror_package(overwrite=overwrite, commit=True)
+        except Exception, e:
+            print u"      failed to mirror %s: %s (%s)" % (distribution, e, type(e))
+            mirrored = False
+        if not mirrored:
+            with lock:
+                failed.append(distribution)
+
+    run_concurrently(mirror, distributions, concurrency)
+    return failed
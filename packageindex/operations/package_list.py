@@ -0,0 +1,128 @@
+#-*- coding: utf-8 -*-
+"""
+The xml-rpc ``list_packages`` response, written as a stream.
+
+The package names are read in batches of ``LIST_PACKAGES_BATCH_SIZE`` (by
+name, so no batch has to skip over the previous ones) and written one by one
+into a gzip compressed file in ``LIST_PACKAGES_CACHE_DIR``. The file, its
+ETag (the md5 of the uncompressed response) and its size are kept in the
+django cache with the journal serial of the last package that was added or
+removed (see ``journal.last_package_serial``). A listing with an older
+serial is written again, so the names are only read from the database once
+per change (and process, if the cache is not shared) and no response is
+ever held in memory as a whole.
+"""
+from __future__ import with_statement
+import glob
+import gzip
+import os
+import tempfile
+import xmlrpclib
+
+from django.core.cache import cache
+from django.utils.hashcompat import md5_constructor
+
+from packageindex import conf
+from packageindex.models import Package
+from packageindex.operations import journal
+
+CACHE_KEY = 'packageindex:xmlrpc:list_packages'
+FILE_PATTERN = 'packageindex-list_packages-%s.xml.gz'
+HEADER = "<?xml version='1.0'?>\n<methodResponse>\n<params>\n<param>\n" \
+         "<value><array><data>\n"
+FOOTER = "</data></array></value>\n</param>\n</params>\n</methodResponse>\n"
+
+
+def iter_package_names(batch_size=None):
+    batch_size = batch_size or conf.LIST_PACKAGES_BATCH_SIZE
+    last = None
+    while True:
+        names = Package.objects.order_by('name').values_list('name', flat=True)
+        if last is not None:
+            names = names.filter(name__gt=last)
+        names = list(names[:batch_size])
+        if not names:
+            break
+        for name in names:
+            yield name
+        last = names[-1]
+
+def iter_response(names):
+    """ The parts of the xml-rpc response with the array of ``names``, like
+    ``xmlrpclib.dumps`` writes it """
+    yield HEADER
+    for name in names:
+        yield "<value><string>%s</string></value>\n" % xmlrpclib.escape(
+                                                            name.encode('utf-8'))
+    yield FOOTER
+
+def cache_dir():
+    return conf.LIST_PACKAGES_CACHE_DIR or tempfile.gettempdir()
+
+def build():
+    """ Writes the compressed response and returns its description, a dict
+    with the ``path`` of the file, the ``etag``, the uncompressed ``size``
+    and the journal ``serial`` it was written at """
+    serial = journal.last_package_serial()
+    directory = cache_dir()
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-list_packages-')
+    digest = md5_constructor()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            gz = gzip.GzipFile(filename='', mode='wb', fileobj=fh)
+            for part in iter_response(iter_package_names()):
+                digest.update(part)
+                size += len(part)
+                gz.write(part)
+            gz.close()
+        etag = digest.hexdigest()
+        path = os.path.join(directory, FILE_PATTERN % etag)
+        os.rename(temp_path, path)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    listing = {'path': path, 'etag': etag, 'size': size, 'serial': serial}
+    cache.set(CACHE_KEY, listing, conf.LIST_PACKAGES_CACHE_TIMEOUT)
+    # responses that are being sent keep their open file
+    for old_path in glob.glob(os.path.join(directory, FILE_PATTERN % '*')):
+        if old_path != path:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+    return listing
+
+def get_listing():
+    listing = cache.get(CACHE_KEY)
+    if listing is None or listing.get('serial') != journal.last_package_serial() \
+            or not os.path.exists(listing['path']):
+        listing = build()
+    return listing
+
+def open_listing():
+    """ Returns the description of the response and its open file """
+    listing = get_listing()
+    try:
+        return listing, open(listing['path'], 'rb')
+    except IOError:
+        # replaced by another process in the meantime
+        listing = build()
+        return listing, open(listing['path'], 'rb')
+
+def invalidate():
+    cache.delete(CACHE_KEY)
+
+def iter_file(fh, decompress=False, chunk_size=64 * 1024):
+    """ Reads the open response file ``fh`` in chunks (decompressed if
+    ``decompress`` is set) and closes it at the end """
+    source = decompress and gzip.GzipFile(fileobj=fh, mode='rb') or fh
+    try:
+        for chunk in iter(lambda: source.read(chunk_size), ''):
+            yield chunk
+    finally:
+        source.close()
+        fh.close()
@@ -1,13 +1,26 @@
 #-*- coding: utf-8 -*-
 from packageindex.models import Package, Release, Distribution
+from packageindex.operations.mirror import mirror_distributions
+from packageindex.operations.reconcile import reconcile_package
+from packageindex.operations.transport import server_proxy
+from packageindex.utils import multicall
+import calendar
 import datetime
 import pprint
-import time
-import xmlrpclib
 
 PYPI_API_URL = 'http://pypi.python.org/pypi'
 TIMEFORMAT = "%Y%m%dT%H:%M:%S"
 
+_client = None
+
+def upstream_client():
+    """ The proxy for PYPI_API_URL, shared by all functions and threads (its
+    transport borrows a pooled connection for every call) """
+    global _client
+    if _client is None:
+        _client = server_proxy(PYPI_API_URL)
+    return _client
+
 def get_package(package, create=False):
     """
     returns a package or none if it does not exist. 
@@ -24,7 +37,7 @@ def get_package(package, create=False):
 
 
 def update_package_list(url=None):
-    client = xmlrpclib.ServerProxy(PYPI_API_URL)
+    client = upstream_client()
     for package_name in client.list_packages():
         package, created = Package.objects.get_or_create(name=package_name)
         print package, created
@@ -40,62 +53,66 @@ def update_package(package, create=False, update_releases=True,
                    update_distributions=True, mirror_distributions=False):
     package = get_package(package, create=create)
     print "updating %s" % package.name
-    client = xmlrpclib.ServerProxy(PYPI_API_URL)
+    client = upstream_client()
     if update_releases:
-        for release in client.package_releases(package.name, True): # True-> show hidden
-            release = create_or_update_release(
-                            package, release, 
-                            update_distributions=update_distributions, 
-                            mirror_distributions=mirror_distributions)
+        versions = filter(is_valid_version,
+                          client.package_releases(package.name, True)) # True-> show hidden
+        arglist = [(package.name, version) for version in versions]
+        releases_data = multicall(client, 'release_data', arglist)
+        releases_urls = [None] * len(versions)
+        if update_distributions:
+            releases_urls = multicall(client, 'release_urls', arglist)
+        result = reconcile_package(package, zip(versions, releases_data, releases_urls))
+        print "  %s" % result
+        if mirror_distributions:
+            mirror_release_distributions(package.releases.filter(version__in=versions))
+
+
+def is_valid_version(version):
+    if not len(version) <= 128:
+        # TODO: more general validation and save to statistics
+        print u'  "%s" is not  a valid version number!' % version
+        return False
+    return True
 
 
 def create_or_update_release(package, release, 
                              update_distributions=False, 
-                             mirror_distributions=False):
-    client = xmlrpclib.ServerProxy(PYPI_API_URL)
+                             mirror_distributions=False,
+                             release_data=None, release_urls=None):
+    """
+    ``release_data`` and ``release_urls`` are the upstream xml-rpc results for
+    this release. They are fetched if they are not passed in.
+    """
+    client = upstream_client()
     package = get_package(package)
-    if isinstance(release, basestring):
-        if not len(release) <= 128:
-            # TODO: more general validation and save to statistics
-            print u'  "%s" is not  a valid version number!' % release
-            return
-        release, created = Release.objects.get_or_create(package=package, 
-                                                         version=release)
-    data = client.release_data(package.name, release.version)
-    release.hidden = data.get('_pypi_hidden', False)
-    for key, value in data.items():
-        release.package_info[key] = value
-    release.save()
+    if isinstance(release, Release):
+        release = release.version
+    if not is_valid_version(release):
+        return
+    if release_data is None:
+        release_data = client.release_data(package.name, release)
     if update_distributions:
-        for dist in client.release_urls(package.name, release.version):
-#            pprint.pprint({'name': package.name, 'release': release.version, 'dist':dist})
-            data = {
-                'filename': dist['filename'],
-                'md5_digest': dist['md5_digest'],
-                'size': dist['size'],
-                'url': dist['url'],
-                'comment': dist['comment_text'],
-            }
-            try:
-                data['uploaded_at'] = datetime.datetime.strptime(dist['upload_time'].value, TIMEFORMAT)
-            except:
-                pass
-            distribution, created = Distribution.objects.get_or_create(
-                                        release=release,
-                                        filetype=dist['packagetype'],
-                                        pyversion=dist['python_version'],
-                                        defaults=data)
-            if not created:
-                # this means we have to update the existing record
-                for key, value in data.items():
-                    setattr(distribution, key, value)
-            distribution.mirror_package(commit=False)
-            distribution.save()
+        if release_urls is None:
+            release_urls = client.release_urls(package.name, release)
+    else:
+        release_urls = None
+    reconcile_package(package, [(release, release_data, release_urls)])
+    release = package.releases.get(version=release)
+    if mirror_distributions:
+        mirror_release_distributions([release])
+    return release
+
+
+def mirror_release_distributions(releases):
+    mirror_distributions(Distribution.objects.filter(release__in=releases))
+
 
 def process_changelog(since, update_releases=True, 
                       update_distributions=True, mirror_distributions=False):
-    client = xmlrpclib.ServerProxy(PYPI_API_URL)
-    timestamp = int(time.mktime(since.timetuple()))
+    """ Updates the packages changed since the UTC datetime ``since`` """
+    client = upstream_client()
+    timestamp = calendar.timegm(since.utctimetuple())
     packages = {}
     for item in client.changelog(timestamp):
         packages[item[0]] = True
@@ -107,7 +124,7 @@ def process_changelog(since, update_releases=True,
                        mirror_distributions=mirror_distributions)
 
 def awesome_test():
-    client = xmlrpclib.ServerProxy(PYPI_API_URL)
+    client = upstream_client()
 #    pprint.pprint(client.list_packages())
     pprint.pprint(client.package_releases('django-filer'))
     pprint.pprint(client.package_urls('django-filer', '0.8.2'))
@@ -0,0 +1,199 @@
+#-*- coding: utf-8 -*-
+"""
+Pull-through proxy for packages that are not in the local index.
+
+With ``PROXY_MISSING`` and ``PROXY_PULL_THROUGH`` the simple page of a
+missing package is read from ``PROXY_BASE_URL`` and its releases and
+distributions are created (in the index with that simple url, or a new
+``PROXY_INDEX_SLUG`` index), so the page is served locally. Pulled packages
+are read again (with a conditional request, see ``operations.crawler``)
+once they are older than ``PROXY_CACHE_TIMEOUT`` seconds, packages that
+don't exist upstream either are remembered as missing for as long.
+Distribution files are stored in the local mirror on their first download.
+
+Concurrent requests for the same package or file are coalesced: one request
+reads upstream while the others wait (for at most ``PROXY_LOCK_TIMEOUT``
+seconds) and then use its result. The lock is shared between threads and,
+through ``cache.add``, between processes using the same cache.
+"""
+from __future__ import with_statement
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from django.utils.hashcompat import md5_constructor
+
+from packageindex import conf
+from packageindex.models import Package, PackageIndex, Distribution
+from packageindex.operations import simple_pages
+from packageindex.operations.crawler import FETCH_ERRORS, fetch_page, \
+                                             file_link, is_distribution_url
+
+FRESH = 'fresh'
+MISSING = 'missing'
+LOCAL = 'local'
+
+
+class ProxyError(Exception):
+    """ The upstream index could not be read """
+    pass
+
+
+def _key(prefix, name):
+    # package names may contain characters that memcached does not accept
+    return 'packageindex:proxy:%s:%s' % (prefix, md5_constructor(
+                                                name.encode('utf-8')).hexdigest())
+
+def state_key(package_name):
+    return _key('state', package_name)
+
+def is_enabled():
+    return conf.PROXY_MISSING and conf.PROXY_PULL_THROUGH
+
+def upstream_url(package_name):
+    return '%s/%s/' % (conf.PROXY_BASE_URL.rstrip('/'),
+                       urllib.quote(package_name.encode('utf-8')))
+
+def get_index():
+    """ The index of the proxied packages """
+    base_url = conf.PROXY_BASE_URL.rstrip('/')
+    indexes = PackageIndex.objects.filter(simple_url__in=(base_url, base_url + '/'))
+    if indexes:
+        return indexes[0]
+    return PackageIndex.objects.get_or_create(slug=conf.PROXY_INDEX_SLUG,
+                                              defaults={'simple_url': base_url})[0]
+
+def is_proxy_index(index):
+    """ Whether ``index`` holds the proxied packages (see ``get_index``),
+    without reading the database """
+    return index.simple_url.rstrip('/') == conf.PROXY_BASE_URL.rstrip('/') \
+        or index.slug == conf.PROXY_INDEX_SLUG
+
+def is_proxied_package(package):
+    """ ``is_proxied`` for a ``Package`` instance """
+    return package.updated_from_remote_at is None and \
+        is_proxy_index(package.index)
+
+def is_proxied(package_name):
+    """ Whether the package was pulled from upstream (and is not synced over
+    xml-rpc) """
+    return Package.objects.filter(name=package_name, index=get_index(),
+                                  updated_from_remote_at__isnull=True).exists()
+
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+def _poll(acquire, deadline):
+    # neither lock can be acquired with a timeout
+    while not acquire():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+@contextmanager
+def coalesced(name):
+    """ Holds the lock for ``name``, yields False if it could not be acquired
+    within ``PROXY_LOCK_TIMEOUT`` seconds """
+    with _locks_lock:
+        lock, users = _locks.get(name, (threading.Lock(), 0))
+        _locks[name] = (lock, users + 1)
+    key = _key('lock', name)
+    acquired = added = False
+    try:
+        deadline = time.time() + conf.PROXY_LOCK_TIMEOUT
+        acquired = _poll(lambda: lock.acquire(False), deadline)
+        added = acquired and _poll(
+                    lambda: cache.add(key, 1, conf.PROXY_LOCK_TIMEOUT), deadline)
+        yield added
+    finally:
+        if added:
+            cache.delete(key)
+        if acquired:
+            lock.release()
+        with _locks_lock:
+            lock, users = _locks[name]
+            if users > 1:
+                _locks[name] = (lock, users - 1)
+            else:
+                del _locks[name]
+
+def pull(package_name):
+    """ Reads the simple page of the package from upstream and creates its
+    releases and distributions. Returns False if the package does not exist
+    upstream, raises ``ProxyError`` if upstream can't be read. """
+    url = upstream_url(package_name)
+    print u"pulling %s from %s" % (package_name, url)
+    try:
+        page = fetch_page(url)[0]
+    except urllib2.HTTPError, e:
+        if e.code == 404:
+            return False
+        raise ProxyError(u"failed to read %s: %s" % (url, e))
+    except FETCH_ERRORS, e:
+        raise ProxyError(u"failed to read %s: %s (%s)" % (url, e, type(e)))
+    package, created = Package.objects.get_or_create(
+                            name=package_name, defaults={'index': get_index()})
+    # also if the page is not modified: it may have been read by the crawler,
+    # which only adds external links, or an earlier pull may not have finished
+    files = []
+    for href, rel in page.get_links():
+        href = urlparse.urljoin(url, href)
+        if urlparse.urlsplit(href)[0] in ('http', 'https') and \
+                is_distribution_url(href):
+            files.append(file_link(href))
+    package.add_distribution_links(files, is_from_external=False)
+    return True
+
+def get_package_page(package_name):
+    """
+    The simple page of a package (see ``operations.simple_pages``), pulled
+    from upstream if it is missing or its proxied copy is stale. Returns None
+    if the package does not exist upstream either. Raises ``ProxyError`` if
+    upstream can't be read and there is no local copy.
+    """
+    state = cache.get(state_key(package_name))
+    if state == MISSING:
+        return None
+    page = simple_pages.get_package_page(package_name)
+    if state is not None:
+        return page
+    if page is not None and not is_proxied(package_name):
+        cache.set(state_key(package_name), LOCAL, conf.SIMPLE_PAGE_CACHE_TIMEOUT)
+        return page
+    with coalesced(package_name) as locked:
+        state = cache.get(state_key(package_name))
+        if state is not None:
+            # pulled by the request we waited for
+            return state != MISSING and simple_pages.get_package_page(package_name) or None
+        if not locked:
+            if page is None:
+                raise ProxyError(u"timed out waiting for %s to be pulled" % package_name)
+            return page
+        try:
+            found = pull(package_name)
+        except ProxyError:
+            if page is None:
+                raise
+            # serve the stale copy
+            print u"could not refresh %s, serving the stale page" % package_name
+            return page
+        cache.set(state_key(package_name), found and FRESH or MISSING,
+                  conf.PROXY_CACHE_TIMEOUT)
+        if not found:
+            return None
+        return simple_pages.get_package_page(package_name)
+
+def mirror_distribution(distribution):
+    """ Stores the file of ``distribution`` in the local mirror, once for all
+    concurrent requests. Returns the distribution as stored. """
+    with coalesced('distribution:%s' % distribution.pk) as locked:
+        distribution = Distribution.objects.get(pk=distribution.pk)
+        if locked and not distribution.file:
+            distribution.mirror_package()
+    return distribution
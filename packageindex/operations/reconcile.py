@@ -0,0 +1,321 @@
+#-*- coding: utf-8 -*-
+"""
+Bulk reconciliation of the releases and distributions of a package with the
+data returned by the upstream xml-rpc api.
+
+Instead of a ``get_or_create`` (and a ``save``) per row, the existing rows of
+a package are loaded once, diffed against the upstream data in memory and
+only new or changed rows are written: new rows with one bulk insert per
+model, changed rows with a single ``update`` query each. No model signals
+are sent, autohide is applied (or, during a sync, scheduled, see
+``operations.autohide``) and the simple page is rendered once per changed
+package at the end, which also outdates its cached xml-rpc responses (see
+``operations.release_cache``). The changes are recorded in the journal, the
+search terms of new and changed releases are indexed and their descriptions
+are rendered. The columns that are copied from ``package_info`` (see
+``models.DENORMALIZED_FIELDS``) and the classifiers of releases are kept in
+step.
+
+Rows whose stored digest (``Release.metadata_digest``,
+``Distribution.upstream_digest``) matches the digest of the upstream data are
+skipped without comparing (or decoding) their fields.
+"""
+import datetime
+
+from django.utils.datastructures import MultiValueDict
+
+from packageindex.models import Release, Distribution, TIMEFORMAT, \
+                                DENORMALIZED_FIELDS, denormalized_values, \
+                                normalize_package_info, package_info_digest, \
+                                sync_release_classifiers, upstream_dist_digest
+from packageindex.operations import autohide, descriptions, journal, \
+                                    search, simple_pages
+from packageindex.utils import bulk_create
+
+
+class ReconcileResult(object):
+    """ Counts of inserted, updated and unchanged rows per model. """
+    def __init__(self):
+        self.releases = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+        self.distributions = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+
+    def add(self, other):
+        for key in self.releases:
+            self.releases[key] += other.releases[key]
+            self.distributions[key] += other.distributions[key]
+        return self
+
+    @property
+    def has_changes(self):
+        return bool(self.releases['inserted'] or self.releases['updated'] or
+                    self.distributions['inserted'] or self.distributions['updated'])
+
+    @property
+    def writes_avoided(self):
+        return self.releases['unchanged'] + self.distributions['unchanged']
+
+    def __str__(self):
+        return "releases: %(inserted)s new" % self.releases + \
+            ", %(updated)s updated, %(unchanged)s unchanged" % self.releases + \
+            "; distributions: %(inserted)s new" % self.distributions + \
+            ", %(updated)s updated, %(unchanged)s unchanged" % self.distributions + \
+            "; %s writes avoided" % self.writes_avoided
+
+
+def release_values(data, is_from_external=False):
+    """ The Release field values for upstream ``release_data`` """
+    package_info = MultiValueDict()
+    for key, value in data.items():
+        package_info[key] = value
+    values = {
+        'hidden': data.get('_pypi_hidden', False),
+        'package_info': package_info,
+        'metadata_digest': package_info_digest(package_info),
+        'is_from_external': is_from_external,
+    }
+    values.update(denormalized_values(package_info))
+    return values
+
+def distribution_key(dist):
+    return (dist['packagetype'], dist['python_version'])
+
+def distribution_values(dist):
+    """ The Distribution field values for one upstream ``release_urls`` entry
+    (without the ``filetype`` and ``pyversion`` key fields) """
+    values = {
+        'filename': dist['filename'],
+        'md5_digest': dist['md5_digest'],
+        'size': dist['size'],
+        'url': dist['url'],
+        'comment': dist['comment_text'],
+        'upstream_digest': upstream_dist_digest(dist),
+    }
+    try:
+        values['uploaded_at'] = datetime.datetime.strptime(dist['upload_time'].value, TIMEFORMAT)
+    except (KeyError, AttributeError, ValueError):
+        pass
+    return values
+
+def _changed_release_values(release, values):
+    changed = {}
+    digest_matches = release.metadata_digest == values['metadata_digest']
+    for key, value in values.items():
+        if key == 'package_info':
+            if digest_matches:
+                continue
+            if normalize_package_info(release.package_info) != normalize_package_info(value):
+                changed[key] = value
+        elif getattr(release, key) != value:
+            changed[key] = value
+    return changed
+
+def _changed_distribution_values(distribution, values):
+    if distribution.upstream_digest == values['upstream_digest']:
+        return {}
+    changed = {}
+    for key, value in values.items():
+        if getattr(distribution, key) != value:
+            changed[key] = value
+    return changed
+
+def reconcile_package(package, releases, is_from_external=False):
+    """
+    Brings the releases and distributions of ``package`` in line with
+    ``releases``, a list of ``(version, release_data, release_urls)`` tuples
+    as returned by the upstream xml-rpc api. If ``release_urls`` is None the
+    distributions of that release are left alone.
+
+    Returns a ``ReconcileResult``.
+    """
+    result = ReconcileResult()
+    existing = dict((release.version, release)
+                    for release in package.releases.all())
+
+    new_releases = []
+    entries = []
+    reindex = []
+    for version, data, dists in releases:
+        values = release_values(data, is_from_external=is_from_external)
+        release = existing.get(version)
+        if release is None:
+            new_releases.append(Release(package=package, version=version, **values))
+            continue
+        if package.auto_hide:
+            # the visibility of existing releases is managed by autohide
+            del values['hidden']
+        changed = _changed_release_values(release, values)
+        if changed:
+            Release.objects.filter(pk=release.pk).update(**changed)
+            fields = sorted(field for field in changed
+                            if field != 'metadata_digest' and
+                               field not in DENORMALIZED_FIELDS)
+            if fields:
+                entries.append((package.pk, version, u"update %s" % ", ".join(fields)))
+            if 'package_info' in changed:
+                reindex.append(release)
+            for field, value in changed.items():
+                setattr(release, field, value)
+            result.releases['updated'] += 1
+        else:
+            result.releases['unchanged'] += 1
+    if new_releases:
+        bulk_create(Release, new_releases)
+        result.releases['inserted'] += len(new_releases)
+        entries.extend((package.pk, release.version, u"new release")
+                       for release in new_releases)
+        # bulk inserts do not set the primary keys
+        for release in package.releases.filter(version__in=[r.version for r in new_releases]):
+            existing[release.version] = release
+            reindex.append(release)
+
+    journal.record_many(entries)
+    search.index_releases(reindex)
+    descriptions.prerender_releases(reindex)
+    sync_release_classifiers(reindex)
+
+    releases_with_dists = [(existing[version], dists)
+                           for version, data, dists in releases
+                           if dists is not None]
+    if releases_with_dists:
+        result.add(reconcile_distributions(releases_with_dists,
+                                           regenerate_pages=False))
+
+    if new_releases:
+        autohide.apply(package, unhide_latest=True)
+    elif result.releases['updated']:
+        autohide.apply(package)
+    if result.has_changes:
+        simple_pages.package_changed(package.pk)
+    return result
+
+def reconcile_distributions(releases, regenerate_pages=True):
+    """
+    ``releases`` is a list of ``(release, release_urls)`` tuples. The existing
+    distributions of all releases are loaded with one query.
+    """
+    result = ReconcileResult()
+    changed_releases = set()
+    now = datetime.datetime.now()
+    existing = {}
+    for distribution in Distribution.objects.filter(release__in=[r.pk for r, d in releases]):
+        existing[(distribution.release_id, distribution.filetype, distribution.pyversion)] = distribution
+
+    new_distributions = {}
+    for release, dists in releases:
+        for dist in dists:
+            filetype, pyversion = distribution_key(dist)
+            key = (release.pk, filetype, pyversion)
+            values = distribution_values(dist)
+            distribution = existing.get(key)
+            if distribution is None:
+                # later entries for the same key win, like the repeated
+                # get_or_create/save did
+                new_distributions[key] = Distribution(release=release,
+                                                      filetype=filetype,
+                                                      pyversion=pyversion,
+                                                      **values)
+                continue
+            changed = _changed_distribution_values(distribution, values)
+            if changed:
+                changed['updated_at'] = now
+                changed_releases.add((release.package_id, release.version))
+                Distribution.objects.filter(pk=distribution.pk).update(**changed)
+                for field, value in changed.items():
+                    setattr(distribution, field, value)
+                result.distributions['updated'] += 1
+            else:
+                result.distributions['unchanged'] += 1
+    if new_distributions:
+        bulk_create(Distribution, new_distributions.values())
+        result.distributions['inserted'] += len(new_distributions)
+        changed_releases.update((d.release.package_id, d.release.version)
+                                for d in new_distributions.values())
+        journal.record_many((d.release.package_id, d.release.version,
+                             journal.add_file_action(d))
+                            for d in new_distributions.values())
+    if regenerate_pages:
+        for package_id in set(package_id for package_id, version in changed_releases):
+            simple_pages.package_changed(package_id)
+    return result
+
+def reconcile_links(package, links, is_from_external=True):
+    """
+    Adds the releases and distributions for ``links``, a list of ``(version,
+    filetype, pyversion, filename, url, md5)`` tuples of links to
+    distribution files (see ``Package.add_distribution_links``), in bulk like
+    ``reconcile_package``. Existing distributions only take the filename, url
+    and md5 of a link if they have not been mirrored and come from the same
+    kind of source.
+
+    Returns a ``ReconcileResult``.
+    """
+    result = ReconcileResult()
+    now = datetime.datetime.now()
+    existing = dict((release.version, release) for release in
+                    package.releases.without_package_info())
+
+    new_releases = {}
+    for link in links:
+        version = link[0]
+        if version not in existing and version not in new_releases:
+            new_releases[version] = Release(package=package, version=version,
+                                            **release_values({}, is_from_external))
+    entries = []
+    if new_releases:
+        bulk_create(Release, new_releases.values())
+        result.releases['inserted'] += len(new_releases)
+        entries.extend((package.pk, version, u"new release")
+                       for version in new_releases)
+        # bulk inserts do not set the primary keys
+        for release in package.releases.without_package_info()\
+                                       .filter(version__in=new_releases.keys()):
+            existing[release.version] = release
+    result.releases['unchanged'] += len(set(link[0] for link in links)) - \
+                                    len(new_releases)
+
+    distributions = dict(((d.release_id, d.filetype, d.pyversion), d) for d in
+                         Distribution.objects.filter(release__package=package))
+    new_distributions = {}
+    for version, filetype, pyversion, filename, url, md5 in links:
+        release = existing[version]
+        key = (release.pk, filetype, pyversion)
+        distribution = distributions.get(key) or new_distributions.get(key)
+        if distribution is None:
+            new_distributions[key] = Distribution(release=release, filetype=filetype,
+                                                  pyversion=pyversion, filename=filename,
+                                                  url=url, md5_digest=md5,
+                                                  is_from_external=is_from_external)
+            continue
+        if distribution.is_from_external != is_from_external or distribution.file:
+            # mirrored files and links of the other kind of source are kept
+            result.distributions['unchanged'] += 1
+            continue
+        values = {'filename': filename, 'url': url}
+        if md5:
+            values['md5_digest'] = md5
+        changed = dict((field, value) for field, value in values.items()
+                       if getattr(distribution, field) != value)
+        for field, value in changed.items():
+            setattr(distribution, field, value)
+        if key in new_distributions:
+            # later links for the same key win, like the repeated
+            # get_or_create/save did
+            continue
+        if changed:
+            changed['updated_at'] = now
+            Distribution.objects.filter(pk=distribution.pk).update(**changed)
+            result.distributions['updated'] += 1
+        else:
+            result.distributions['unchanged'] += 1
+    if new_distributions:
+        bulk_create(Distribution, new_distributions.values())
+        result.distributions['inserted'] += len(new_distributions)
+        entries.extend((package.pk, d.release.version, journal.add_file_action(d))
+                       for d in new_distributions.values())
+
+    journal.record_many(entries)
+    if new_releases:
+        autohide.apply(package, unhide_latest=True)
+    if result.has_changes:
+        simple_pages.package_changed(package.pk)
+    return result
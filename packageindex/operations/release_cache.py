@@ -0,0 +1,49 @@
+#-*- coding: utf-8 -*-
+"""
+Cache of the serialized xml-rpc responses about a single release
+(``release_urls`` and ``release_data``).
+
+Every response has its own cache entry, keyed by the release and the method
+(and the base url of the request, which is part of the ``release_urls``
+payload). Entries hold the ``Package.last_modified`` they were built from and
+are checked against it on read (see ``simple_pages.is_current``), so changes
+made by any process, e.g. a sync command with a cache that is not shared,
+are seen right away.
+"""
+import datetime
+
+from django.core.cache import cache
+from django.utils.hashcompat import md5_constructor
+
+from packageindex import conf
+from packageindex.models import Package
+from packageindex.operations.simple_pages import is_current
+
+
+def response_key(package_name, version, method):
+    key = u'%s\0%s\0%s' % (package_name, version, method)
+    return 'packageindex:xmlrpc:release:%s' % md5_constructor(key.encode('utf-8')).hexdigest()
+
+def get_or_build(package_name, version, method, build):
+    """
+    The cached response to ``method`` for a release, or the result of
+    ``build()`` which is cached. Responses are ``(params, content)`` tuples,
+    ``build()`` returns None if the release does not exist (which is not
+    cached). Returns None if the package does not exist.
+    """
+    now = datetime.datetime.now()
+    last_modified = Package.objects.filter(name=package_name)\
+                                   .values_list('last_modified', flat=True)
+    if not last_modified:
+        return None
+    key = response_key(package_name, version, method)
+    entry = cache.get(key)
+    if entry is not None and is_current(entry, last_modified[0]):
+        return entry['response']
+    response = build()
+    if response is not None:
+        cache.set(key, {'response': response,
+                        'package_modified': last_modified[0],
+                        'rendered_at': now},
+                  conf.XMLRPC_RELEASE_CACHE_TIMEOUT)
+    return response
@@ -0,0 +1,215 @@
+#-*- coding: utf-8 -*-
+"""
+Disk-backed cache of upstream responses, with record and replay.
+
+Entries are pickled into ``UPSTREAM_CACHE_DIR``, one file per response,
+named by the sha1 of the key: the url and the request body for xml-rpc calls
+(so the method and all arguments are part of the key), the url of the simple
+page for the external links of a package. ``UPSTREAM_CACHE_MODE`` is one of
+
+``None``
+    the cache is not used.
+``'cache'``
+    entries younger than their ttl (``UPSTREAM_CACHE_TTLS``, by method, 0
+    for methods that are not listed) are used instead of calling upstream.
+    Stale external link listings are revalidated with a conditional request
+    for every page they were read from (the simple page of the package and
+    the home and download pages it links to), with the validators that the
+    crawler stored when it last read the page. The listing is only used again
+    if none of the pages has changed.
+``'record'``
+    upstream is always called and every response is stored.
+``'replay'``
+    only stored responses (of any age) are used, a missing response raises
+    ``ReplayMiss``. With recorded responses a sync runs offline and without
+    rate limits.
+"""
+from __future__ import with_statement
+import cPickle as pickle
+import os
+import re
+import tempfile
+import time
+import urllib2
+
+from django.utils.hashcompat import sha_constructor
+
+from packageindex import conf
+
+CACHE = 'cache'
+RECORD = 'record'
+REPLAY = 'replay'
+
+MULTICALL_METHODS_RE = re.compile(
+        r'<name>methodName</name>\s*<value>\s*(?:<string>)?([^<\s]+)')
+
+
+class ReplayMiss(Exception):
+    """ A response that has not been recorded was needed in replay mode """
+    pass
+
+
+def mode():
+    return conf.UPSTREAM_CACHE_DIR and conf.UPSTREAM_CACHE_MODE or None
+
+def is_replaying():
+    return mode() == REPLAY
+
+def ttl(method):
+    return conf.UPSTREAM_CACHE_TTLS.get(method, 0)
+
+def xmlrpc_ttl(method, request_body):
+    """ The ttl of a call, the smallest ttl of the batched methods for
+    ``system.multicall`` """
+    if method == 'system.multicall':
+        methods = MULTICALL_METHODS_RE.findall(request_body)
+        return methods and min(ttl(name) for name in methods) or 0
+    return ttl(method)
+
+
+class ResponseStore(object):
+    """ Pickled entries in ``directory`` """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        digest = sha_constructor(key).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, key):
+        try:
+            with open(self.path(key), 'rb') as fh:
+                entry = pickle.load(fh)
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return None
+        # a sha1 collision is unlikely, a changed key format is not
+        if entry.get('key') != key:
+            return None
+        return entry
+
+    def put(self, key, value, **validators):
+        entry = {'key': key, 'value': value, 'stored_at': time.time()}
+        entry.update(validators)
+        path = self.path(key)
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # created by another thread
+                pass
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                pickle.dump(entry, fh, pickle.HIGHEST_PROTOCOL)
+            os.rename(temp_path, path)
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return entry
+
+    def touch(self, entry):
+        """ Marks ``entry`` as fresh again after a successful revalidation """
+        validators = dict((key, value) for key, value in entry.items()
+                          if key not in ('key', 'value', 'stored_at'))
+        return self.put(entry['key'], entry['value'], **validators)
+
+
+def get_store():
+    return ResponseStore(conf.UPSTREAM_CACHE_DIR)
+
+def is_fresh(entry, max_age):
+    return max_age > 0 and time.time() - entry['stored_at'] < max_age
+
+def xmlrpc_response(url, method, request_body, fetch):
+    """ The raw response to the xml-rpc call ``request_body`` to ``url``,
+    from the cache or from ``fetch()`` (see the module documentation).
+    Returns ``(data, cached)``. """
+    current_mode = mode()
+    if not current_mode:
+        return fetch(), False
+    store = get_store()
+    key = 'xmlrpc:%s\0%s' % (url, request_body)
+    if current_mode == REPLAY:
+        entry = store.get(key)
+        if entry is None:
+            raise ReplayMiss(u"no recorded response for %s to %s" % (method, url))
+        return entry['value'], True
+    max_age = xmlrpc_ttl(method, request_body)
+    if current_mode == CACHE:
+        entry = store.get(key)
+        if entry is not None and is_fresh(entry, max_age):
+            return entry['value'], True
+    data = fetch()
+    if current_mode == RECORD or max_age > 0:
+        store.put(key, data)
+    return data, False
+
+def revalidate(url, entry):
+    """ Whether the page at ``url`` is unchanged since ``entry`` was stored
+    (by its ETag or Last-Modified date) """
+    request = urllib2.Request(url)
+    if entry.get('etag'):
+        request.add_header('If-None-Match', entry['etag'])
+    if entry.get('last_modified'):
+        request.add_header('If-Modified-Since', entry['last_modified'])
+    try:
+        response = urllib2.urlopen(request, timeout=conf.UPSTREAM_TIMEOUT)
+    except urllib2.HTTPError, e:
+        return e.code == 304
+    except (urllib2.URLError, IOError):
+        return False
+    response.close()
+    return False
+
+def page_validators(url):
+    """ The ETag and Last-Modified date of the page at ``url`` as stored by
+    the last read (see ``operations.crawler.fetch_page``) """
+    from packageindex.models import CrawledPage
+    try:
+        page = CrawledPage.objects.get(url_digest=CrawledPage.digest(url))
+    except CrawledPage.DoesNotExist:
+        return {}
+    return {'etag': page.etag, 'last_modified': page.last_modified}
+
+def pages_unchanged(pages):
+    """ Whether none of the ``(url, validators)`` ``pages`` has changed since
+    it was read """
+    for url, validators in pages:
+        # without validators the conditional request would be a plain GET
+        # on top of the one of the crawler
+        if not (validators.get('etag') or validators.get('last_modified')):
+            return False
+        if not revalidate(url, validators):
+            return False
+    return True
+
+def page_listing(url, fetch):
+    """ The listing that ``fetch()`` reads from the page at ``url`` and the
+    pages it links to, from the cache (see the module documentation).
+    ``fetch()`` returns the listing and the urls of all pages it read. """
+    current_mode = mode()
+    if not current_mode:
+        return fetch()[0]
+    store = get_store()
+    key = 'page:%s' % url
+    entry = store.get(key)
+    if current_mode == REPLAY:
+        if entry is None:
+            raise ReplayMiss(u"no recorded listing of %s" % url)
+        return entry['value']
+    max_age = ttl('external_links')
+    if current_mode == CACHE and entry is not None:
+        if is_fresh(entry, max_age):
+            return entry['value']
+        if entry.get('pages') and pages_unchanged(entry['pages']):
+            store.touch(entry)
+            return entry['value']
+    value, page_urls = fetch()
+    if current_mode == RECORD or max_age > 0:
+        store.put(key, value, pages=[(page_url, page_validators(page_url))
+                                     for page_url in page_urls])
+    return value
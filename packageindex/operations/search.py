@@ -0,0 +1,91 @@
+#-*- coding: utf-8 -*-
+"""
+Search over the ``package_info`` of releases with an inverted index.
+
+The words of every searchable field are stored as ``SearchTerm`` rows. A
+search value matches a release if every word of the value is the prefix of a
+word in that field, so all lookups are indexed ``term LIKE 'word%'`` range
+scans instead of scans over the serialized ``package_info``. ``version`` is
+matched exactly.
+"""
+import operator
+import re
+
+from django.db.models import Q
+
+from packageindex.models import Release, SearchTerm
+from packageindex.utils import bulk_create
+
+# the spec keys of the xml-rpc search, see views.xmlrpc.search
+SEARCH_FIELDS = ('name', 'version', 'author', 'author_email', 'maintainer',
+                 'maintainer_email', 'home_page', 'license', 'summary',
+                 'description', 'keywords', 'platform', 'download_url')
+INDEXED_FIELDS = [field for field in SEARCH_FIELDS if field != 'version']
+
+TERM_LENGTH = 64
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def words(value):
+    if not isinstance(value, basestring):
+        value = u' '.join(value)
+    if isinstance(value, str):
+        value = value.decode('utf-8', 'replace')
+    return set(word[:TERM_LENGTH] for word in WORD_RE.findall(value.lower()))
+
+def release_terms(release):
+    terms = []
+    for field in INDEXED_FIELDS:
+        if field == 'name':
+            values = [release.package_id]
+        else:
+            values = release.package_info.getlist(field)
+        for word in words([value for value in values if value]):
+            terms.append(SearchTerm(release_id=release.pk, field=field, term=word))
+    return terms
+
+def index_releases(releases):
+    """ (Re)builds the search terms of ``releases`` """
+    releases = [release for release in releases if release.pk]
+    if not releases:
+        return
+    SearchTerm.objects.filter(release__in=[release.pk for release in releases]).delete()
+    terms = []
+    for release in releases:
+        terms.extend(release_terms(release))
+    bulk_create(SearchTerm, terms)
+
+def _value_query(field, value):
+    if field == 'version':
+        return Q(version=value)
+    value_words = words(value)
+    if not value_words:
+        return None
+    return reduce(operator.and_, [
+        Q(pk__in=SearchTerm.objects.filter(field=field, term__startswith=word)
+                                   .values('release'))
+        for word in value_words])
+
+def search_releases(spec, operator_name='and'):
+    """
+    Returns the releases matching ``spec``, a dict of field names and a
+    string or a list of strings (which are combined with "or"). The fields
+    are combined with ``operator_name`` ("and" or "or"), unknown fields are
+    ignored.
+    """
+    operator_name = operator_name.lower()
+    if operator_name not in ('and', 'or'):
+        raise ValueError("operator must be 'and' or 'or'")
+    field_queries = []
+    for field, values in spec.items():
+        if field not in SEARCH_FIELDS:
+            continue
+        if isinstance(values, basestring):
+            values = [values]
+        queries = [q for q in [_value_query(field, value) for value in values] if q]
+        if queries:
+            field_queries.append(reduce(operator.or_, queries))
+    if not field_queries:
+        return Release.objects.none()
+    combine = operator_name == 'and' and operator.and_ or operator.or_
+    return Release.objects.filter(reduce(combine, field_queries))
@@ -0,0 +1,119 @@
+#-*- coding: utf-8 -*-
+"""
+Precomputed ``/simple/`` pages.
+
+The simple page of a package is rendered (with a single query for all its
+distributions) whenever one of its releases or distributions changes and is
+kept in the django cache together with its ETag and Last-Modified date. The
+``/simple/`` root listing is dropped from the cache when a package is added
+or removed and rendered again on the next request. Pages that are missing
+from the cache (e.g. after a restart) are rendered on demand.
+
+Every change is recorded in ``Package.last_modified``, which the static
+export (``pi_export_simple``) uses to find the pages it has to write again.
+Other processes (the sync commands, other web workers) can only drop the
+pages from their own cache if the cache backend is not shared, so every page
+also holds the ``last_modified`` it was rendered from and is checked against
+it on read with one query. The root listing holds the journal serial of the
+last package that was added or removed.
+"""
+import datetime
+
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.hashcompat import md5_constructor
+
+from packageindex import conf
+from packageindex.models import Package, Distribution
+from packageindex.operations import journal
+
+INDEX_KEY = 'packageindex:simple:index'
+
+
+def package_key(package_name):
+    # package names may contain characters that memcached does not accept
+    return 'packageindex:simple:package:%s' % md5_constructor(
+                                        package_name.encode('utf-8')).hexdigest()
+
+def _page(html):
+    return {
+        'html': html,
+        'etag': md5_constructor(html.encode('utf-8')).hexdigest(),
+        'last_modified': datetime.datetime.utcnow().replace(microsecond=0),
+    }
+
+def render_package_page(package):
+    distributions = Distribution.objects.filter(release__package=package)\
+                                .select_related('release__package__index')\
+                                .order_by('-release__created', 'pk')
+    return render_to_string('packageindex/package_detail_simple.html',
+                            {'package': package,
+                             'distributions': distributions})
+
+def render_index_page():
+    packages = Package.objects.order_by('name').values('name')
+    return render_to_string('packageindex/package_list_simple.html',
+                            {'package_list': packages})
+
+def is_current(page, last_modified):
+    """ Whether ``page`` was rendered from the state of the package with the
+    given ``last_modified`` """
+    if page.get('package_modified') != last_modified:
+        return False
+    if last_modified is None:
+        return True
+    # databases that store whole seconds can't tell changes within the same
+    # second apart, such pages are rendered again
+    return page['rendered_at'] - last_modified >= datetime.timedelta(seconds=1)
+
+def regenerate_package_page(package_name):
+    """ Renders and stores the simple page of a package. Returns the page or
+    None if the package does not exist. """
+    now = datetime.datetime.now()
+    try:
+        package = Package.objects.get(name=package_name)
+    except Package.DoesNotExist:
+        cache.delete(package_key(package_name))
+        return None
+    page = _page(render_package_page(package))
+    page['package_modified'] = package.last_modified
+    page['rendered_at'] = now
+    cache.set(package_key(package_name), page, conf.SIMPLE_PAGE_CACHE_TIMEOUT)
+    return page
+
+def invalidate_package_page(package_name):
+    cache.delete(package_key(package_name))
+
+def package_changed(package_name, regenerate=True):
+    """ Records that the releases or distributions of a package changed and
+    renders its page again (or, with ``regenerate=False``, drops it from the
+    cache) """
+    Package.objects.filter(name=package_name)\
+                   .update(last_modified=datetime.datetime.now())
+    if regenerate:
+        regenerate_package_page(package_name)
+    else:
+        invalidate_package_page(package_name)
+
+def invalidate_index_page():
+    cache.delete(INDEX_KEY)
+
+def get_package_page(package_name):
+    """ Returns the cached simple page of a package as a dict with ``html``,
+    ``etag`` and ``last_modified``, or None if the package does not exist """
+    page = cache.get(package_key(package_name))
+    if page is not None:
+        last_modified = Package.objects.filter(name=package_name)\
+                                       .values_list('last_modified', flat=True)
+        if last_modified and is_current(page, last_modified[0]):
+            return page
+    return regenerate_package_page(package_name)
+
+def get_index_page():
+    serial = journal.last_package_serial()
+    page = cache.get(INDEX_KEY)
+    if page is None or page.get('serial') != serial:
+        page = _page(render_index_page())
+        page['serial'] = serial
+        cache.set(INDEX_KEY, page, conf.SIMPLE_PAGE_CACHE_TIMEOUT)
+    return page
@@ -0,0 +1,283 @@
+#-*- coding: utf-8 -*-
+"""
+Concurrent synchronisation of a local package index with its upstream index.
+
+A ``SyncEngine`` keeps a bounded pool of worker threads busy with the
+blocking xml-rpc calls (``package_releases``, ``release_data`` and
+``release_urls``) that are needed to update a package. Calls to the same
+host are spaced out by a shared ``RateLimiter`` and every package is
+committed in its own transaction, so an interrupted sync only loses the
+packages that were in flight.
+
+Full syncs are run by a ``QueuedSyncEngine`` which keeps the package list
+and the state of every package in the ``SyncQueueItem`` table, so they can be
+resumed after an interruption and failed packages are retried with backoff.
+"""
+from __future__ import with_statement
+import datetime
+import threading
+import time
+import urlparse
+
+from django.db import transaction
+from django.db.models import Q
+
+from packageindex import conf
+from packageindex.models import Package, PackageIndex, SyncQueueItem
+from packageindex.operations import autohide, response_cache
+from packageindex.operations.reconcile import ReconcileResult
+from packageindex.operations.transport import server_proxy
+from packageindex.utils import bulk_create, run_concurrently
+
+
+class RateLimiter(object):
+    """
+    Limits the number of calls per second that are made to a host. The limits
+    are shared between all threads using the same ``RateLimiter`` instance.
+    ``rates`` maps host names to calls per second, hosts that are not listed
+    use ``default`` (``None`` means no limit).
+    """
+    def __init__(self, rates=None, default=None):
+        self.rates = rates or {}
+        self.default = default
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, host):
+        rate = self.rates.get(host, self.default)
+        if not rate:
+            return
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + 1.0 / rate
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class _ThrottledMethod(object):
+    def __init__(self, proxy, name):
+        self._proxy = proxy
+        self._name = name
+
+    def __getattr__(self, name):
+        return _ThrottledMethod(self._proxy, "%s.%s" % (self._name, name))
+
+    def __call__(self, *args):
+        # recorded responses are replayed at full speed
+        if not response_cache.is_replaying():
+            self._proxy._limiter.wait(self._proxy._host)
+        return getattr(self._proxy._server, self._name)(*args)
+
+
+class ThrottledServerProxy(object):
+    """
+    Wraps a ``xmlrpclib.ServerProxy`` (see ``operations.transport``) and asks
+    a ``RateLimiter`` for permission before every call to the remote server.
+    """
+    def __init__(self, uri, limiter, **kwargs):
+        self._server = server_proxy(uri, **kwargs)
+        self._host = urlparse.urlparse(uri)[1]
+        self._limiter = limiter
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return _ThrottledMethod(self, name)
+
+
+class SyncEngine(object):
+    """
+    Updates the packages of ``index`` with ``concurrency`` worker threads.
+    With a concurrency of 1 (or less) packages are synced one after another
+    in the calling thread.
+    """
+    def __init__(self, index, concurrency=None, rate_limits=None,
+                 update_distribution_metadata=True):
+        self.index = index
+        if concurrency is None:
+            concurrency = conf.SYNC_CONCURRENCY
+        self.concurrency = max(int(concurrency), 1)
+        if rate_limits is None:
+            rate_limits = conf.SYNC_RATE_LIMITS
+        self.limiter = RateLimiter(rate_limits, conf.SYNC_DEFAULT_RATE_LIMIT)
+        self.update_distribution_metadata = update_distribution_metadata
+        self.synced = []
+        self.failed = []
+        self.result = ReconcileResult()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def run(self, package_names):
+        """
+        Syncs all packages in ``package_names`` (any iterable, it is consumed
+        lazily) and returns a dict with the names of the ``synced`` and the
+        ``failed`` packages and the ``ReconcileResult`` of all packages as
+        ``result``.
+        """
+        run_concurrently(self._sync_package, package_names, self.concurrency)
+        return {'synced': self.synced, 'failed': self.failed,
+                'result': self.result}
+
+    def _worker_index(self):
+        # every worker thread gets its own PackageIndex instance with its own
+        # (throttled) client, the connections are shared in the pool of
+        # operations.transport
+        index = getattr(self._local, 'index', None)
+        if index is None:
+            index = PackageIndex.objects.get(pk=self.index.pk)
+            index._client = ThrottledServerProxy(index.xml_rpc_url, self.limiter)
+            self._local.index = index
+        return index
+
+    def _sync_package(self, package_name):
+        try:
+            result = self.sync_package(self._worker_index(), package_name)
+        except Exception, e:
+            print u"failed to sync %s: %s (%s)" % (package_name, e, type(e))
+            with self._lock:
+                self.failed.append(package_name)
+            self._call_hook(self.package_failed, package_name, e)
+        else:
+            with self._lock:
+                self.synced.append(package_name)
+                self.result.add(result)
+            self._call_hook(self.package_synced, package_name, result)
+
+    def _call_hook(self, hook, package_name, *args):
+        # e.g. a database error while updating the sync queue must not stop
+        # the worker
+        try:
+            hook(package_name, *args)
+        except Exception, e:
+            print u"%s failed for %s: %s (%s)" % (hook.__name__, package_name,
+                                                 e, type(e))
+
+    def package_synced(self, package_name, result):
+        """ Called (in the worker thread) after a package has been synced """
+        pass
+
+    def package_failed(self, package_name, error):
+        """ Called (in the worker thread) after a package failed to sync """
+        pass
+
+    @transaction.commit_on_success
+    def sync_package(self, index, package_name):
+        now = datetime.datetime.now()
+        package, created = Package.objects.get_or_create(
+                                index=index, name=package_name,
+                                defaults={'updated_from_remote_at': now})
+        print package, created
+        # make sure the package uses this worker's client
+        package.index = index
+        with autohide.suspended():
+            return package.update_release_metadata(
+                update_distribution_metadata=self.update_distribution_metadata)
+
+
+class QueuedSyncEngine(SyncEngine):
+    """
+    Runs a full sync of ``index`` from a persistent queue of packages. If a
+    full sync is already in progress (``index.full_sync_started_at`` is set)
+    it is resumed, otherwise the queue is filled from ``list_packages``.
+    """
+    batch_size = None
+
+    def run_full(self, restart=False):
+        if restart or not self.index.full_sync_started_at:
+            self.enqueue_all()
+        else:
+            # packages that were in flight when the last run was interrupted
+            self.queue.filter(state=SyncQueueItem.IN_PROGRESS)\
+                      .update(state=SyncQueueItem.PENDING)
+        while True:
+            package_names = self.claim_batch()
+            if package_names:
+                self.run(package_names)
+                continue
+            retry_at = self.next_retry_at()
+            if retry_at is None:
+                break
+            delay = retry_at - datetime.datetime.now()
+            time.sleep(max(delay.days * 86400 + delay.seconds, 0) + 1)
+        self.index.updated_from_remote_at = self.index.full_sync_started_at
+        self.index.full_sync_started_at = None
+        self.index.save()
+        # packages that failed before are in synced if a retry succeeded
+        failed = self.queue.filter(state=SyncQueueItem.FAILED)\
+                           .values_list('package_name', flat=True)
+        return {'synced': self.synced, 'failed': list(failed),
+                'result': self.result}
+
+    @property
+    def queue(self):
+        return SyncQueueItem.objects.filter(index=self.index)
+
+    @transaction.commit_on_success
+    def enqueue_all(self):
+        from packageindex.operations.changelog import last_serial
+        now = datetime.datetime.now()
+        # incremental syncs continue from the changelog position at the start
+        # of the full sync
+        self.index.changelog_serial = last_serial(self.index.client)
+        package_names = sorted(set(self.index.client.list_packages()))
+        self.queue.delete()
+        while package_names:
+            chunk, package_names = package_names[:1000], package_names[1000:]
+            bulk_create(SyncQueueItem, [SyncQueueItem(index=self.index,
+                                                      package_name=name)
+                                        for name in chunk])
+        self.index.full_sync_started_at = now
+        self.index.save()
+
+    def claim_batch(self):
+        """ Marks the next batch of due packages as in progress and returns
+        their names """
+        batch_size = self.batch_size or conf.SYNC_QUEUE_BATCH_SIZE
+        now = datetime.datetime.now()
+        items = list(self.queue.filter(state=SyncQueueItem.PENDING)
+                               .filter(Q(next_attempt_at__isnull=True) |
+                                       Q(next_attempt_at__lte=now))
+                               .order_by('pk')
+                               .values_list('pk', 'package_name')[:batch_size])
+        # update() does not set the auto_now updated_at by itself
+        SyncQueueItem.objects.filter(pk__in=[pk for pk, name in items])\
+                             .update(state=SyncQueueItem.IN_PROGRESS, updated_at=now)
+        return [name for pk, name in items]
+
+    def release_stale(self, timeout=None):
+        """ Puts packages that have been in progress for more than ``timeout``
+        (``SYNC_CLAIM_TIMEOUT``) seconds back into the queue, they were
+        claimed by a run that crashed """
+        if timeout is None:
+            timeout = conf.SYNC_CLAIM_TIMEOUT
+        stale = datetime.datetime.now() - datetime.timedelta(seconds=timeout)
+        return self.queue.filter(state=SyncQueueItem.IN_PROGRESS,
+                                 updated_at__lt=stale)\
+                         .update(state=SyncQueueItem.PENDING)
+
+    def next_retry_at(self):
+        retries = self.queue.filter(state=SyncQueueItem.PENDING)\
+                            .order_by('next_attempt_at')\
+                            .values_list('next_attempt_at', flat=True)[:1]
+        if retries:
+            return retries[0]
+        return None
+
+    def package_synced(self, package_name, result):
+        self.queue.filter(package_name=package_name)\
+                  .update(state=SyncQueueItem.DONE, last_error='')
+
+    def package_failed(self, package_name, error):
+        item = self.queue.get(package_name=package_name)
+        item.retries += 1
+        item.last_error = u"%s: %s" % (type(error).__name__, error)
+        if item.retries < conf.SYNC_MAX_RETRIES:
+            backoff = conf.SYNC_RETRY_BACKOFF * 2 ** (item.retries - 1)
+            item.state = SyncQueueItem.PENDING
+            item.next_attempt_at = datetime.datetime.now() + \
+                                   datetime.timedelta(seconds=backoff)
+        else:
+            item.state = SyncQueueItem.FAILED
+        item.save()
+
@@ -0,0 +1,267 @@
+#-*- coding: utf-8 -*-
+"""
+Transport for all xml-rpc traffic to upstream indexes.
+
+``server_proxy`` returns a ``xmlrpclib.ServerProxy`` that sends its calls
+through a ``PooledTransport``:
+
+* HTTP/1.1 connections are kept alive and shared between all proxies and
+  threads in a ``ConnectionPool`` (at most ``UPSTREAM_POOL_SIZE`` idle
+  connections per host). The transport keeps no connection of its own, so
+  one proxy can be used by several threads.
+* Responses are requested gzip encoded. Requests larger than
+  ``UPSTREAM_GZIP_THRESHOLD`` bytes are sent gzip encoded if it is set.
+* Connections time out after ``UPSTREAM_TIMEOUT`` seconds. Failed calls
+  (network errors and 5xx responses, not xml-rpc faults) are retried up to
+  ``UPSTREAM_RETRIES`` times, waiting ``UPSTREAM_RETRY_BACKOFF`` seconds
+  before the first retry and twice as long before each further one, with
+  random jitter.
+* The latency of every call is recorded per method in ``metrics``.
+* Responses are cached on disk, recorded or replayed as configured in
+  ``operations.response_cache``.
+"""
+from __future__ import with_statement
+import gzip
+import httplib
+import random
+import re
+import socket
+import threading
+import time
+import urlparse
+import xmlrpclib
+from cStringIO import StringIO
+
+from packageindex import conf
+from packageindex.operations import response_cache
+
+METHOD_NAME_RE = re.compile(r'<methodName>\s*([^<\s]+)\s*</methodName>')
+
+
+def gzip_encode(data):
+    buffer = StringIO()
+    gz = gzip.GzipFile(mode='wb', fileobj=buffer)
+    gz.write(data)
+    gz.close()
+    return buffer.getvalue()
+
+def gzip_decode(data):
+    return gzip.GzipFile(mode='rb', fileobj=StringIO(data)).read()
+
+def method_name(request_body):
+    match = METHOD_NAME_RE.search(request_body[:1024])
+    return match and match.group(1) or 'unknown'
+
+
+class ConnectionPool(object):
+    """ Idle keep-alive connections per ``(scheme, host)`` """
+    def __init__(self, size=None):
+        self.size = size
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, scheme, host, timeout=None):
+        """ Returns ``(connection, reused)`` """
+        with self._lock:
+            idle = self._idle.get((scheme, host))
+            if idle:
+                return idle.pop(), True
+        if scheme == 'https':
+            connection_class = httplib.HTTPSConnection
+        else:
+            connection_class = httplib.HTTPConnection
+        return connection_class(host, timeout=timeout), False
+
+    def release(self, scheme, host, connection):
+        size = self.size
+        if size is None:
+            size = conf.UPSTREAM_POOL_SIZE
+        with self._lock:
+            idle = self._idle.setdefault((scheme, host), [])
+            if len(idle) < size:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def idle_count(self, scheme, host):
+        with self._lock:
+            return len(self._idle.get((scheme, host), ()))
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+class CallMetrics(object):
+    """ Number of calls, errors, retries and the latency of upstream calls
+    per method. Shared between threads. """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.methods = {}
+
+    def _method(self, name):
+        return self.methods.setdefault(name, {'calls': 0, 'errors': 0,
+                                              'retries': 0, 'cache_hits': 0,
+                                              'total_time': 0.0,
+                                              'max_time': 0.0})
+
+    def record(self, name, duration, error=False):
+        with self._lock:
+            method = self._method(name)
+            method['calls'] += 1
+            method['total_time'] += duration
+            method['max_time'] = max(method['max_time'], duration)
+            if error:
+                method['errors'] += 1
+
+    def record_retry(self, name):
+        with self._lock:
+            self._method(name)['retries'] += 1
+
+    def record_cache_hit(self, name):
+        with self._lock:
+            self._method(name)['cache_hits'] += 1
+
+    def summary(self):
+        """ A copy of the metrics with the ``mean_time`` of every method """
+        with self._lock:
+            summary = {}
+            for name, method in self.methods.items():
+                method = dict(method)
+                method['mean_time'] = method['calls'] and \
+                                      method['total_time'] / method['calls'] or 0.0
+                summary[name] = method
+            return summary
+
+    def __str__(self):
+        lines = []
+        for name, method in sorted(self.summary().items()):
+            lines.append("%s: %s calls, %s errors, %s retries, "
+                         "%s cache hits, mean %.3fs, max %.3fs" % (
+                            name, method['calls'], method['errors'],
+                            method['retries'], method['cache_hits'],
+                            method['mean_time'], method['max_time']))
+        return "\n".join(lines)
+
+
+pool = ConnectionPool()
+metrics = CallMetrics()
+
+
+def is_retryable(error):
+    if isinstance(error, xmlrpclib.ProtocolError):
+        return error.errcode >= 500
+    return isinstance(error, (socket.error, httplib.HTTPException))
+
+
+class PooledTransport(xmlrpclib.Transport):
+    """ A xml-rpc transport that borrows its connections from ``pool``, see
+    the module documentation """
+    def __init__(self, scheme='http', use_datetime=0, connection_pool=None,
+                 call_metrics=None):
+        xmlrpclib.Transport.__init__(self, use_datetime=use_datetime)
+        self.scheme = scheme
+        self.pool = connection_pool or pool
+        self.metrics = call_metrics or metrics
+
+    def request(self, host, handler, request_body, verbose=0):
+        name = method_name(request_body)
+        url = '%s://%s%s' % (self.scheme, host, handler)
+        data, cached = response_cache.xmlrpc_response(url, name, request_body,
+                            lambda: self.fetch(host, handler, request_body, verbose, name))
+        if cached:
+            self.metrics.record_cache_hit(name)
+        self.verbose = verbose
+        parser, unmarshaller = self.getparser()
+        parser.feed(data)
+        parser.close()
+        return unmarshaller.close()
+
+    def fetch(self, host, handler, request_body, verbose=0, name=None):
+        """ Sends the call, with retries, and returns the raw response """
+        name = name or method_name(request_body)
+        retries = conf.UPSTREAM_RETRIES
+        attempt = 0
+        while True:
+            started = time.time()
+            try:
+                result = self.single_request(host, handler, request_body, verbose)
+            except Exception, e:
+                self.metrics.record(name, time.time() - started, error=True)
+                if attempt >= retries or not is_retryable(e):
+                    raise
+                self.metrics.record_retry(name)
+                time.sleep(conf.UPSTREAM_RETRY_BACKOFF * (2 ** attempt) *
+                           random.uniform(0.5, 1.5))
+                attempt += 1
+                continue
+            self.metrics.record(name, time.time() - started)
+            return result
+
+    def single_request(self, host, handler, request_body, verbose=0):
+        """ Sends the call once and returns the raw response """
+        chost, extra_headers, x509 = self.get_host_info(host)
+        headers = dict(extra_headers or ())
+        # a kept alive connection may have been closed by the server, such
+        # a call is repeated at once on a new connection
+        connection, reused = self.pool.acquire(self.scheme, chost,
+                                               conf.UPSTREAM_TIMEOUT)
+        try:
+            response, data = self._send(connection, handler, headers,
+                                        request_body, verbose)
+        except (socket.error, httplib.HTTPException):
+            connection.close()
+            if not reused:
+                raise
+            connection, reused = self.pool.acquire(self.scheme, chost,
+                                                   conf.UPSTREAM_TIMEOUT)
+            try:
+                response, data = self._send(connection, handler, headers,
+                                            request_body, verbose)
+            except:
+                connection.close()
+                raise
+        except:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self.pool.release(self.scheme, chost, connection)
+        if response.status != 200:
+            raise xmlrpclib.ProtocolError(host + handler, response.status,
+                                          response.reason, response.msg)
+        if response.getheader('content-encoding', '') == 'gzip':
+            data = gzip_decode(data)
+        return data
+
+    def _send(self, connection, handler, headers, request_body, verbose):
+        if verbose:
+            connection.set_debuglevel(1)
+        headers = dict(headers)
+        headers['Content-Type'] = 'text/xml'
+        headers['User-Agent'] = self.user_agent
+        headers['Accept-Encoding'] = 'gzip'
+        threshold = conf.UPSTREAM_GZIP_THRESHOLD
+        if threshold is not None and len(request_body) > threshold:
+            request_body = gzip_encode(request_body)
+            headers['Content-Encoding'] = 'gzip'
+        connection.request('POST', handler, request_body, headers)
+        response = connection.getresponse()
+        return response, response.read()
+
+
+def server_proxy(uri, **kwargs):
+    """ A ``xmlrpclib.ServerProxy`` for ``uri`` that uses a
+    ``PooledTransport`` """
+    scheme = urlparse.urlparse(uri)[0]
+    kwargs.setdefault('transport', PooledTransport(
+                            scheme=scheme, use_datetime=kwargs.get('use_datetime', 0)))
+    return xmlrpclib.ServerProxy(uri, **kwargs)
@@ -12,13 +12,17 @@ if 'haystack' in settings.INSTALLED_APPS:
         text = CharField(document=True, use_template=True, null=True, stored=False,
                          template_name='packageindex/haystack/package_text.txt')
         author = MultiValueField(stored=False, null=True)
-        classifier = MultiValueField(stored=False, null=True,
-                                     model_attr='latest__classifiers')
+        classifier = MultiValueField(stored=False, null=True)
         summary = CharField(stored=False, null=True,
                             model_attr='latest__summary')
         description = CharField(stored=False, null=True,
                                 model_attr='latest__description')
         
+        def prepare_classifier(self, obj):
+            if obj.latest:
+                return [c.name for c in obj.latest.classifiers.all()]
+            return []
+        
         def prepare_author(self, obj):
             output = []
             for user in list(obj.owners.all()) + list(obj.maintainers.all()):
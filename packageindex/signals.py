@@ -1,25 +1,27 @@
 from django.db.models import signals
-from django.utils.hashcompat import md5_constructor
 
 from packageindex.models import Package, Release, Distribution
+from packageindex.operations import autohide, descriptions, journal, \
+                                    package_list, search, simple_pages
+from packageindex.operations.hashing import hash_distribution
 
 def autohide_new_release_handler(sender, instance, created, *args, **kwargs):
     """ Autohide other releases on the creation of a new release when the 
     package 'auto-hide' is True"""
-    if not created or not instance.package.auto_hide:
+    if not created:
         return
-    
-    for release in instance.package.releases.exclude(pk=instance.pk).filter(hidden=False):
-        release.hidden = True
-        release.save()
-    
-    if instance.hidden:
-        instance.hidden = False
-        instance.save()
+    if autohide.is_suspended():
+        autohide.schedule(instance.package_id, unhide_latest=True)
+        return
+    if instance.package.auto_hide:
+        autohide.apply(instance.package, unhide_latest=True, latest=instance)
 
 def autohide_save_release_handler(sender, instance, *args, **kwargs):
     """ When saving a release, check to see if it should be hidden or not """
-    if instance.pk is None:
+    if instance.pk is None or instance.hidden:
+        return
+    if autohide.is_suspended():
+        autohide.schedule(instance.package_id)
         return
     
     if not instance.package.auto_hide:
@@ -30,29 +32,129 @@ def autohide_save_release_handler(sender, instance, *args, **kwargs):
     except Release.DoesNotExist:
         return
     
-    if instance != latest and not instance.hidden:
+    if instance != latest:
         instance.hidden = True
 
 def autohide_save_package_handler(sender, instance, *args, **kwargs):
+    """ Hides the old releases of a package that is saved with 'auto-hide' """
     if not instance.auto_hide:
         return
-    
-    for release in instance.releases.filter(hidden=False):
-        release.save()
+    if autohide.is_suspended():
+        autohide.schedule(instance.pk)
+        return
+    autohide.apply(instance)
 
 def distribution_hash(sender, instance, *args, **kwargs):
-    if not instance.md5_digest and instance.content:
-        digest = md5_constructor()
+    """ Hashes stored files whose digests are not known (without saving the
+    distribution again) """
+    if instance.file and not (instance.md5_digest and instance.sha256_digest):
         try:
-            fh = instance.content.storage.open(instance.content.name)
-            map(digest.update,fh.readlines())
-            fh.close()
-            instance.md5_digest = digest.hexdigest()
-            instance.save()
+            hash_distribution(instance)
         except Exception, e:
             print str(e)
 
+def _release(instance):
+    """ The (package name, version) of a release or of the release of a
+    distribution """
+    if isinstance(instance, Distribution):
+        release = Release.objects.filter(pk=instance.release_id)\
+                                 .values_list('package', 'version')
+        return release and release[0] or (None, None)
+    return instance.package_id, instance.version
+
+def release_changed_handler(sender, instance, *args, **kwargs):
+    """ Renders the simple page of the package again when a release or
+    distribution changed (which also outdates the cached xml-rpc responses
+    of the release) """
+    package_id, version = _release(instance)
+    if package_id:
+        simple_pages.package_changed(package_id)
+
+def release_deleted_handler(sender, instance, *args, **kwargs):
+    # deletes cascade over many rows, the page is rendered on the next request
+    package_id, version = _release(instance)
+    if package_id:
+        simple_pages.package_changed(package_id, regenerate=False)
+
+def simple_index_handler(sender, instance, created=True, *args, **kwargs):
+    """ Drops the simple index and the list_packages response when a package
+    is added or removed """
+    if created:
+        simple_pages.invalidate_index_page()
+        package_list.invalidate()
+        simple_pages.package_changed(instance.name, regenerate=False)
+
+def journal_package_saved(sender, instance, created, *args, **kwargs):
+    if created:
+        journal.record(instance.name, None, u"create")
+
+def journal_package_deleted(sender, instance, *args, **kwargs):
+    journal.record(instance.name, None, u"remove")
+
+def release_pre_save(sender, instance, *args, **kwargs):
+    """ Remembers which fields of an existing release change, for the
+    journal and the search index """
+    instance._changed_fields = []
+    if instance.pk is None:
+        return
+    old = Release.objects.filter(pk=instance.pk)\
+                         .values_list('metadata_digest', 'hidden')
+    if not old:
+        return
+    metadata_digest, hidden = old[0]
+    # Release.save() has updated the digest if package_info changed
+    if metadata_digest != instance.metadata_digest:
+        instance._changed_fields.append('package_info')
+    if hidden != instance.hidden:
+        instance._changed_fields.append('hidden')
+
+def journal_release_saved(sender, instance, created, *args, **kwargs):
+    if created:
+        journal.record(instance.package_id, instance.version, u"new release")
+    elif getattr(instance, '_changed_fields', None):
+        journal.record(instance.package_id, instance.version,
+                       u"update %s" % ", ".join(instance._changed_fields))
+
+def journal_release_deleted(sender, instance, *args, **kwargs):
+    journal.record(instance.package_id, instance.version, u"remove")
+
+def journal_distribution_saved(sender, instance, created, *args, **kwargs):
+    if created:
+        package_id, version = _release(instance)
+        journal.record(package_id, version, journal.add_file_action(instance))
+
+def journal_distribution_deleted(sender, instance, *args, **kwargs):
+    # pre_delete, the release is gone after cascading deletes
+    package_id, version = _release(instance)
+    if package_id:
+        journal.record(package_id, version, journal.remove_file_action(instance))
+
+def search_index_handler(sender, instance, created, *args, **kwargs):
+    if created or 'package_info' in getattr(instance, '_changed_fields', ()):
+        search.index_releases([instance])
+
+def description_handler(sender, instance, created, *args, **kwargs):
+    """ Renders the description of new and changed releases (in the
+    background) so pages are not rendered on request """
+    if created or 'package_info' in getattr(instance, '_changed_fields', ()):
+        descriptions.prerender_releases([instance])
+
 signals.post_save.connect(autohide_new_release_handler, sender=Release)
 signals.pre_save.connect(autohide_save_release_handler, sender=Release)
 signals.pre_save.connect(autohide_save_package_handler, sender=Package)
 signals.post_save.connect(distribution_hash, sender=Distribution)
+signals.post_save.connect(release_changed_handler, sender=Release)
+signals.post_delete.connect(release_deleted_handler, sender=Release)
+signals.post_save.connect(release_changed_handler, sender=Distribution)
+signals.post_delete.connect(release_deleted_handler, sender=Distribution)
+signals.post_save.connect(simple_index_handler, sender=Package)
+signals.post_delete.connect(simple_index_handler, sender=Package)
+signals.post_save.connect(journal_package_saved, sender=Package)
+signals.pre_delete.connect(journal_package_deleted, sender=Package)
+signals.pre_save.connect(release_pre_save, sender=Release)
+signals.post_save.connect(journal_release_saved, sender=Release)
+signals.pre_delete.connect(journal_release_deleted, sender=Release)
+signals.post_save.connect(journal_distribution_saved, sender=Distribution)
+signals.pre_delete.connect(journal_distribution_deleted, sender=Distribution)
+signals.post_save.connect(search_index_handler, sender=Release)
+signals.post_save.connect(description_handler, sender=Release)
@@ -1,12 +1,57 @@
+from __future__ import with_statement
+import calendar
+import datetime
+import gzip
+import hashlib
+import threading
+import time
 import unittest
 import xmlrpclib
 import StringIO
+import BaseHTTPServer
+import os
+import shutil
+import socket
+import sys
+import tempfile
+from SimpleHTTPServer import SimpleHTTPRequestHandler
+from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+from django.utils.hashcompat import md5_constructor
+from django.utils.datastructures import MultiValueDict
 #from packageindex.views import parse_distutils_request, simple
-from packageindex.models import Package, Release
-from django.test.client import Client
+from packageindex import conf
+from packageindex.models import Package, Release, Distribution, PackageIndex, \
+                                SyncQueueItem, JournalEntry, CrawledPage, \
+                                COMPRESSED_PREFIX
+from packageindex.operations.sync import SyncEngine, QueuedSyncEngine, \
+                                         RateLimiter
+from packageindex.operations.mirror import mirror_distributions, partial_path
+from packageindex.operations.blobs import blob_name, collect_garbage
+from packageindex.operations.reconcile import reconcile_package
+from packageindex.operations.export import export_simple
+from packageindex.operations.hashing import hash_distributions
+from packageindex.operations.crawler import ExternalLinkCrawler, parse_links
+from packageindex.operations.transport import PooledTransport, \
+                                              ConnectionPool, CallMetrics, \
+                                              server_proxy
+from packageindex.views.packages import simple_details, download
+from packageindex.views.xmlrpc import release_urls, release_data, changelog, \
+                                       changelog_last_serial, changelog_since_serial
+from packageindex.views.xmlrpc import search as xmlrpc_search, list_packages, \
+                                       multicall as xmlrpc_multicall
+from packageindex.operations import autohide, descriptions, journal, proxy, \
+                                    package_list, release_cache, simple_pages
+from packageindex.templatetags.safemarkup import saferst
+from packageindex.operations.changelog import plan_changes
+from packageindex.management.commands.pi_compress_package_info import recompress
+from packageindex.http import parse_distutils_request
+from packageindex.utils import multicall, run_concurrently
+from django.test.client import Client, RequestFactory
 from django.core.urlresolvers import reverse
+from django.core.management import call_command
+from django.core.cache import cache
 from django.contrib.auth.models import User
-from django.http import HttpRequest
+from django.http import HttpRequest, Http404
 
 def create_post_data(action):
     data = {
@@ -208,5 +253,1635 @@ class TestXmlRpc(unittest.TestCase):
         pypi_hits = pypi.package_releases('foo')
         expected = ['1.0']
         self.assertEqual(pypi_hits, expected)
-    
-        
\ No newline at end of file
+
+
+class UpstreamStub(object):
+    """
+    A stand-in for the xml-rpc api of an upstream index like pypi
+    """
+    def __init__(self, packages):
+        # {package_name: {version: [dist, ...]}}
+        self.packages = packages
+        self.calls = []
+        # [(name, version, timestamp, action, serial), ...]
+        self.changelog = []
+
+    def list_packages(self):
+        self.calls.append('list_packages')
+        return self.packages.keys()
+
+    def package_releases(self, package_name, show_hidden=False):
+        self.calls.append('package_releases')
+        return self.packages.get(package_name, {}).keys()
+
+    def release_data(self, package_name, version):
+        self.calls.append('release_data')
+        return {'name': package_name, 'version': version,
+                'summary': 'summary of %s %s' % (package_name, version)}
+
+    def release_urls(self, package_name, version):
+        self.calls.append('release_urls')
+        return self.packages[package_name][version]
+
+    def changelog_last_serial(self):
+        self.calls.append('changelog_last_serial')
+        return self.changelog and self.changelog[-1][4] or 0
+
+    def changelog_since_serial(self, serial):
+        self.calls.append('changelog_since_serial')
+        return [event for event in self.changelog if event[4] > serial]
+
+
+def upstream_dist(package_name, version, packagetype='sdist'):
+    filename = '%s-%s.tar.gz' % (package_name, version)
+    return {'filename': filename,
+            'url': 'http://example.com/%s' % filename,
+            'md5_digest': 'd41d8cd98f00b204e9800998ecf8427e',
+            'size': 0,
+            'packagetype': packagetype,
+            'python_version': 'source',
+            'comment_text': '',
+            'upload_time': xmlrpclib.DateTime('20110515T12:00:00')}
+
+
+class UpstreamServerTestCase(unittest.TestCase):
+    """
+    Runs an ``UpstreamStub`` on a local xml-rpc server and points a
+    ``PackageIndex`` at it.
+    """
+    upstream_packages = {
+        'foo': {'1.0': [upstream_dist('foo', '1.0')],
+                '1.1': [upstream_dist('foo', '1.1')]},
+        'bar': {'0.1': [upstream_dist('bar', '0.1')]},
+        # release_urls returns garbage for this one
+        'broken': {'1.0': [{}]},
+    }
+
+    supports_multicall = True
+    request_handler = SimpleXMLRPCRequestHandler
+
+    def setUp(self):
+        self.upstream = UpstreamStub(self.upstream_packages)
+        self.server = SimpleXMLRPCServer(('127.0.0.1', 0), logRequests=False,
+                                         allow_none=True,
+                                         requestHandler=self.request_handler)
+        self.server.register_instance(self.upstream)
+        if self.supports_multicall:
+            self.server.register_multicall_functions()
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.index = PackageIndex.objects.create(
+                        slug='upstream-stub',
+                        xml_rpc_url='http://127.0.0.1:%s/' % self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        Package.objects.filter(index=self.index).delete()
+        self.index.delete()
+
+
+class TestSyncEngine(UpstreamServerTestCase):
+
+    def test_sync_packages(self):
+        result = SyncEngine(self.index, concurrency=1).run(['foo', 'bar'])
+        self.assertEqual(sorted(result['synced']), ['bar', 'foo'])
+        self.assertEqual(result['failed'], [])
+        self.assertEqual(sorted(Release.objects.filter(package__name='foo').values_list('version', flat=True)),
+                         ['1.0', '1.1'])
+        self.assertEqual(Distribution.objects.filter(release__package__index=self.index).count(), 3)
+
+    def test_resync_reports_unchanged_rows(self):
+        result = SyncEngine(self.index, concurrency=1).run(['foo'])['result']
+        self.assertEqual(result.releases['inserted'], 2)
+        self.assertEqual(result.distributions['inserted'], 2)
+        self.upstream.packages['foo']['1.1'][0]['comment_text'] = 'changed'
+        result = SyncEngine(self.index, concurrency=1).run(['foo'])['result']
+        self.assertEqual(result.releases, {'inserted': 0, 'updated': 0, 'unchanged': 2})
+        self.assertEqual(result.distributions, {'inserted': 0, 'updated': 1, 'unchanged': 1})
+        self.assertEqual(result.writes_avoided, 3)
+        self.upstream.packages['foo']['1.1'][0]['comment_text'] = ''
+
+    def test_digests(self):
+        SyncEngine(self.index, concurrency=1).run(['foo'])
+        release = Release.objects.get(package__name='foo', version='1.0')
+        self.assertEqual(len(release.metadata_digest), 40)
+        digest = release.metadata_digest
+        release.save()
+        self.assertEqual(Release.objects.get(pk=release.pk).metadata_digest, digest)
+        release.package_info['summary'] = 'changed locally'
+        release.save()
+        self.assertNotEqual(Release.objects.get(pk=release.pk).metadata_digest, digest)
+        result = SyncEngine(self.index, concurrency=1).run(['foo'])['result']
+        self.assertEqual(result.releases['updated'], 1)
+        self.assertEqual(Release.objects.get(pk=release.pk).summary, 'summary of foo 1.0')
+
+    def test_autohide_after_sync(self):
+        SyncEngine(self.index, concurrency=1).run(['foo'])
+        self.assertEqual(Release.objects.filter(package__name='foo', hidden=False).count(), 1)
+
+    def test_failed_package_does_not_stop_sync(self):
+        result = SyncEngine(self.index, concurrency=1).run(['broken', 'foo'])
+        self.assertEqual(result['synced'], ['foo'])
+        self.assertEqual(result['failed'], ['broken'])
+        # the failed package was rolled back
+        self.assertFalse(Release.objects.filter(package__name='broken').exists())
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter({'example.com': 100})
+        start = time.time()
+        for i in range(5):
+            limiter.wait('example.com')
+        self.assertTrue(time.time() - start >= 0.04)
+
+    def test_failing_hook_does_not_stop_sync(self):
+        class BrokenHookEngine(SyncEngine):
+            def package_failed(self, package_name, error):
+                raise ValueError("queue is gone")
+        result = BrokenHookEngine(self.index, concurrency=1).run(['broken', 'foo'])
+        self.assertEqual(result['synced'], ['foo'])
+        self.assertEqual(result['failed'], ['broken'])
+
+
+class TestRunConcurrently(unittest.TestCase):
+
+    def test_failing_items_do_not_stop_workers(self):
+        done = []
+        lock = threading.Lock()
+        def func(item):
+            if item % 2:
+                raise ValueError(item)
+            with lock:
+                done.append(item)
+        stderr, sys.stderr = sys.stderr, StringIO.StringIO()
+        try:
+            run_concurrently(func, range(20), concurrency=2)
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(sorted(done), range(0, 20, 2))
+
+
+class TestQueuedSync(UpstreamServerTestCase):
+
+    def setUp(self):
+        super(TestQueuedSync, self).setUp()
+        self.max_retries = conf.SYNC_MAX_RETRIES
+        conf.SYNC_MAX_RETRIES = 1
+
+    def tearDown(self):
+        conf.SYNC_MAX_RETRIES = self.max_retries
+        super(TestQueuedSync, self).tearDown()
+
+    def test_full_sync(self):
+        result = self.index.update_package_list(full=True, concurrency=1)
+        self.assertEqual(sorted(result['synced']), ['bar', 'foo'])
+        self.assertEqual(result['failed'], ['broken'])
+        index = PackageIndex.objects.get(pk=self.index.pk)
+        self.assertTrue(index.updated_from_remote_at)
+        self.assertEqual(index.full_sync_started_at, None)
+        progress = index.sync_progress()
+        self.assertEqual((progress['done'], progress['failed'], progress['total']), (2, 1, 3))
+        self.assertTrue(SyncQueueItem.objects.get(index=index, package_name='broken').last_error)
+
+    def test_resume(self):
+        self.index.full_sync_started_at = datetime.datetime.now()
+        self.index.save()
+        for name, state in (('foo', SyncQueueItem.DONE),
+                            ('bar', SyncQueueItem.IN_PROGRESS)):
+            SyncQueueItem.objects.create(index=self.index, package_name=name,
+                                         state=state)
+        result = QueuedSyncEngine(self.index, concurrency=1).run_full()
+        self.assertEqual(result['synced'], ['bar'])
+        self.assertFalse('list_packages' in self.upstream.calls)
+        self.assertEqual(self.index.sync_progress()['done'], 2)
+
+    def test_full_sync_stores_serial(self):
+        self.upstream.changelog = [('foo', '1.0', 0, 'new release', 42)]
+        self.index.update_package_list(full=True, concurrency=1)
+        self.assertEqual(PackageIndex.objects.get(pk=self.index.pk).changelog_serial, 42)
+        self.upstream.changelog = []
+
+class TestChangelogSync(UpstreamServerTestCase):
+
+    def test_apply_events(self):
+        SyncEngine(self.index, concurrency=1).run(['foo', 'bar'])
+        self.index.changelog_serial = 10
+        self.index.save()
+        self.upstream.packages['foo']['1.2'] = [upstream_dist('foo', '1.2')]
+        self.upstream.changelog = [
+            ('foo', '1.2', 0, 'new release', 11),
+            ('foo', '1.2', 0, 'add source file foo-1.2.tar.gz', 12),
+            ('foo', '1.0', 0, 'remove file foo-1.0.tar.gz', 13),
+            ('bar', None, 0, 'remove', 14),
+            ('foo', None, 0, 'add Owner someone', 15),
+        ]
+        self.upstream.calls = []
+        result = self.index.update_package_list()
+        del self.upstream.packages['foo']['1.2']
+        self.assertEqual(sorted(result['synced']), ['bar', 'foo'])
+        self.assertEqual(self.index.changelog_serial, 15)
+        self.assertEqual(PackageIndex.objects.get(pk=self.index.pk).changelog_serial, 15)
+        self.assertTrue(Release.objects.filter(package__name='foo', version='1.2').exists())
+        self.assertFalse(Distribution.objects.filter(release__package__name='foo',
+                                                     release__version='1.0').exists())
+        self.assertFalse(Package.objects.filter(name='bar').exists())
+        # only the new release was fetched
+        self.assertFalse('package_releases' in self.upstream.calls)
+        self.assertEqual(self.upstream.calls.count('release_data'), 1)
+        self.assertEqual(self.upstream.calls.count('release_urls'), 1)
+
+    def test_failed_package_is_queued_and_retried(self):
+        self.index.changelog_serial = 10
+        self.index.save()
+        self.upstream.changelog = [
+            ('broken', '1.0', 0, 'new release', 11),
+            ('bar', '0.1', 0, 'new release', 12),
+        ]
+        result = self.index.update_package_list(concurrency=1)
+        self.assertEqual(result['synced'], ['bar'])
+        self.assertEqual(result['failed'], ['broken'])
+        # the cursor moves on, the package is synced completely later
+        self.assertEqual(self.index.changelog_serial, 12)
+        item = SyncQueueItem.objects.get(index=self.index, package_name='broken')
+        self.assertEqual(item.state, SyncQueueItem.PENDING)
+        self.assertEqual(item.retries, 1)
+        self.assertTrue(item.next_attempt_at > datetime.datetime.now())
+
+        broken = self.upstream.packages['broken']
+        self.upstream.packages['broken'] = {'1.0': [upstream_dist('broken', '1.0')]}
+        try:
+            SyncQueueItem.objects.filter(pk=item.pk).update(
+                next_attempt_at=datetime.datetime.now() - datetime.timedelta(seconds=1))
+            result = self.index.update_package_list(concurrency=1)
+        finally:
+            self.upstream.packages['broken'] = broken
+        self.assertEqual(result['synced'], ['broken'])
+        self.assertEqual(result['failed'], [])
+        self.assertEqual(SyncQueueItem.objects.get(pk=item.pk).state,
+                         SyncQueueItem.DONE)
+        self.assertTrue(Release.objects.filter(package__name='broken',
+                                               version='1.0').exists())
+
+    def test_stale_in_progress_package_is_retried(self):
+        self.index.changelog_serial = 10
+        self.index.save()
+        self.upstream.changelog = []
+        # claimed by a run that crashed an hour ago, and one that is running
+        stale = SyncQueueItem.objects.create(index=self.index, package_name='bar',
+                                             state=SyncQueueItem.IN_PROGRESS)
+        SyncQueueItem.objects.filter(pk=stale.pk).update(
+            updated_at=datetime.datetime.now() - datetime.timedelta(
+                                seconds=conf.SYNC_CLAIM_TIMEOUT + 60))
+        running = SyncQueueItem.objects.create(index=self.index, package_name='foo',
+                                               state=SyncQueueItem.IN_PROGRESS)
+        result = self.index.update_package_list(concurrency=1)
+        self.assertEqual(result['synced'], ['bar'])
+        self.assertEqual(SyncQueueItem.objects.get(pk=stale.pk).state,
+                         SyncQueueItem.DONE)
+        self.assertEqual(SyncQueueItem.objects.get(pk=running.pk).state,
+                         SyncQueueItem.IN_PROGRESS)
+
+class TestMultiCall(UpstreamServerTestCase):
+
+    def test_batches(self):
+        results = multicall(self.index.client, 'release_data',
+                            [('foo', '1.0'), ('foo', '1.1'), ('bar', '0.1')],
+                            batch_size=2)
+        self.assertEqual([r['version'] for r in results], ['1.0', '1.1', '0.1'])
+        self.assertEqual(self.upstream.calls, ['release_data'] * 3)
+
+    def test_sync_uses_multicall(self):
+        SyncEngine(self.index, concurrency=1).run(['foo'])
+        self.assertEqual(Release.objects.filter(package__name='foo').count(), 2)
+
+
+class TestMultiCallFallback(UpstreamServerTestCase):
+    supports_multicall = False
+
+    def test_fallback_to_single_calls(self):
+        client = self.index.client
+        results = multicall(client, 'release_data',
+                            [('foo', '1.0'), ('foo', '1.1')])
+        self.assertEqual([r['version'] for r in results], ['1.0', '1.1'])
+        self.assertTrue(vars(client)['_multicall_unsupported'])
+
+    def test_sync_without_multicall(self):
+        result = SyncEngine(self.index, concurrency=1).run(['foo', 'bar'])
+        self.assertEqual(sorted(result['synced']), ['bar', 'foo'])
+        self.assertEqual(Distribution.objects.filter(release__package__index=self.index).count(), 3)
+
+
+class FailingMultiCallServer(object):
+    """ A server whose ``system.multicall`` fails with ``error`` """
+    def __init__(self, error):
+        self.error = error
+        self.system = self
+
+    def multicall(self, calls):
+        raise self.error
+
+    def release_data(self, package_name, version):
+        return {'version': version}
+
+
+class TestMultiCallErrors(unittest.TestCase):
+    """
+    Only errors that mean that system.multicall is missing switch to single
+    calls
+    """
+    def test_unsupported(self):
+        for error in (xmlrpclib.Fault(-32601, 'method not found'),
+                      xmlrpclib.ProtocolError('/', 501, 'Not Implemented', {})):
+            server = FailingMultiCallServer(error)
+            results = multicall(server, 'release_data', [('foo', '1.0'), ('foo', '1.1')])
+            self.assertEqual([r['version'] for r in results], ['1.0', '1.1'])
+            self.assertTrue(vars(server)['_multicall_unsupported'])
+
+    def test_other_errors_are_raised(self):
+        for error in (xmlrpclib.ProtocolError('/', 503, 'Service Unavailable', {}),
+                      xmlrpclib.ProtocolError('/', 429, 'Too Many Requests', {}),
+                      xmlrpclib.Fault(1, 'database is locked')):
+            server = FailingMultiCallServer(error)
+            self.assertRaises(type(error), multicall, server, 'release_data',
+                              [('foo', '1.0'), ('foo', '1.1')])
+            self.assertFalse(vars(server).get('_multicall_unsupported'))
+
+
+class TestXmlRpcMultiCall(unittest.TestCase):
+
+    def setUp(self):
+        self.index = PackageIndex.objects.create(slug='multicall')
+        self.pkg = Package.objects.create(index=self.index, name='multicall-pkg')
+        self.release = Release.objects.create(package=self.pkg, version='1.0')
+
+    def tearDown(self):
+        self.pkg.delete()
+        self.index.delete()
+
+    def test_system_multicall(self):
+        calls = [{'methodName': 'package_releases', 'params': ['multicall-pkg']},
+                 {'methodName': 'release_data', 'params': ['multicall-pkg', '1.0']},
+                 {'methodName': 'no_such_method', 'params': []}]
+        response = client.post(reverse('packageindex-root'),
+                               xmlrpclib.dumps((calls,), 'system.multicall'),
+                               content_type='text/xml')
+        results = xmlrpclib.loads(response.content)[0][0]
+        self.assertEqual(results[0], [['1.0']])
+        self.assertEqual(results[1][0]['version'], '1.0')
+        self.assertTrue('faultCode' in results[2])
+
+
+class QuietHTTPRequestHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class RangeHTTPRequestHandler(QuietHTTPRequestHandler):
+    """ Answers requests with a ``Range: bytes=<start>-`` header """
+    def send_head(self):
+        header = self.headers.getheader('Range')
+        if not header:
+            return QuietHTTPRequestHandler.send_head(self)
+        path = self.translate_path(self.path)
+        content = open(path, 'rb').read()
+        start = int(header.split('=')[1].rstrip('-'))
+        if start >= len(content):
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */%s' % len(content))
+            self.end_headers()
+            return None
+        self.send_response(206)
+        self.send_header('Content-Range', 'bytes %s-%s/%s' % (
+                                start, len(content) - 1, len(content)))
+        self.send_header('Content-Length', str(len(content) - start))
+        self.end_headers()
+        return StringIO.StringIO(content[start:])
+
+
+class TestMirror(unittest.TestCase):
+    """
+    Mirrors distributions from a local http server
+    """
+    content = 'not really a tarball\n' * 1000
+
+    def setUp(self):
+        self.served_dir = tempfile.mkdtemp()
+        open(os.path.join(self.served_dir, 'mirror-pkg-1.0.tar.gz'), 'wb').write(self.content)
+        self.cwd = os.getcwd()
+        os.chdir(self.served_dir)
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), RangeHTTPRequestHandler)
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.index = PackageIndex.objects.create(slug='mirror')
+        self.pkg = Package.objects.create(index=self.index, name='mirror-pkg')
+        self.release = Release.objects.create(package=self.pkg, version='1.0')
+        self.dist = Distribution.objects.create(
+                        release=self.release, filetype='sdist', pyversion='source',
+                        filename='mirror-pkg-1.0.tar.gz',
+                        url='http://127.0.0.1:%s/mirror-pkg-1.0.tar.gz' % self.server.server_address[1],
+                        md5_digest=md5_constructor(self.content).hexdigest(),
+                        size=len(self.content))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.served_dir)
+        for dist in Distribution.objects.filter(release=self.release):
+            if dist.file:
+                dist.file.delete(save=False)
+        self.pkg.delete()
+        self.index.delete()
+
+    def test_mirror(self):
+        self.assertEqual(mirror_distributions([self.dist], concurrency=1), [])
+        dist = Distribution.objects.get(pk=self.dist.pk)
+        self.assertTrue(dist.is_hosted_locally)
+        self.assertTrue(dist.mirrored_at)
+        self.assertEqual(dist.file.read(), self.content)
+        self.assertEqual(dist.sha256_digest, hashlib.sha256(self.content).hexdigest())
+        self.assertFalse(os.path.exists(partial_path(dist)))
+
+    def test_hash_distributions(self):
+        mirror_distributions([self.dist], concurrency=1)
+        Distribution.objects.filter(pk=self.dist.pk).update(sha256_digest='')
+        failed, mismatched = hash_distributions(
+                    Distribution.objects.filter(pk=self.dist.pk), concurrency=1)
+        self.assertEqual((failed, mismatched), ([], []))
+        self.assertEqual(Distribution.objects.get(pk=self.dist.pk).sha256_digest,
+                         hashlib.sha256(self.content).hexdigest())
+        Distribution.objects.filter(pk=self.dist.pk).update(md5_digest='0' * 32)
+        failed, mismatched = hash_distributions(
+                    Distribution.objects.filter(pk=self.dist.pk), concurrency=1)
+        self.assertEqual([d.pk for d in mismatched], [self.dist.pk])
+
+    def test_stored_copy_is_not_downloaded_again(self):
+        mirror_distributions([self.dist], concurrency=1)
+        name = Distribution.objects.get(pk=self.dist.pk).file.name
+        Distribution.objects.filter(pk=self.dist.pk).update(file=None)
+        self.server.shutdown()
+        dist = Distribution.objects.get(pk=self.dist.pk)
+        self.assertTrue(dist.mirror_package())
+        self.assertEqual(Distribution.objects.get(pk=self.dist.pk).file.name, name)
+
+    def test_resume_partial_file(self):
+        open(partial_path(self.dist), 'wb').write(self.content[:100])
+        self.assertEqual(mirror_distributions([self.dist], concurrency=1), [])
+        self.assertEqual(Distribution.objects.get(pk=self.dist.pk).file.read(), self.content)
+
+    def test_complete_partial_file(self):
+        # the range request is answered with 416
+        open(partial_path(self.dist), 'wb').write(self.content)
+        self.assertEqual(mirror_distributions([self.dist], concurrency=1), [])
+        self.assertEqual(Distribution.objects.get(pk=self.dist.pk).file.read(), self.content)
+        self.assertFalse(os.path.exists(partial_path(self.dist)))
+
+    def test_oversized_partial_file(self):
+        open(partial_path(self.dist), 'wb').write(self.content + 'garbage')
+        self.assertEqual(mirror_distributions([self.dist], concurrency=1), [])
+        self.assertEqual(Distribution.objects.get(pk=self.dist.pk).file.read(), self.content)
+
+    def test_md5_mismatch(self):
+        self.dist.md5_digest = 'd41d8cd98f00b204e9800998ecf8427e'
+        self.assertEqual(mirror_distributions([self.dist], concurrency=1), [self.dist])
+        self.assertFalse(Distribution.objects.get(pk=self.dist.pk).file)
+
+
+class TestContentAddressedMirror(TestMirror):
+    """
+    Mirrors distributions into the content addressed blob store
+    """
+    def setUp(self):
+        super(TestContentAddressedMirror, self).setUp()
+        self._layout = conf.DISTRIBUTION_STORAGE_LAYOUT
+        conf.DISTRIBUTION_STORAGE_LAYOUT = 'content_hash'
+        self.storage = self.dist.file.storage
+        self.blob = blob_name(self.dist.md5_digest)
+
+    def tearDown(self):
+        conf.DISTRIBUTION_STORAGE_LAYOUT = self._layout
+        if self.storage.exists(self.blob):
+            self.storage.delete(self.blob)
+        super(TestContentAddressedMirror, self).tearDown()
+
+    def test_identical_files_are_stored_once(self):
+        release = Release.objects.create(package=self.pkg, version='1.1')
+        copy = Distribution.objects.create(
+                        release=release, filetype='sdist', pyversion='source',
+                        filename='mirror-pkg-1.1.tar.gz', url=self.dist.url,
+                        md5_digest=self.dist.md5_digest, size=self.dist.size)
+        mirror_distributions([self.dist], concurrency=1)
+        # the second file is linked without downloading it
+        self.server.shutdown()
+        self.assertEqual(mirror_distributions([copy], concurrency=1), [])
+        self.assertTrue(self.storage.exists(self.blob))
+        blob_stat = os.stat(self.storage.path(self.blob))
+        for dist in Distribution.objects.filter(pk__in=[self.dist.pk, copy.pk]):
+            self.assertEqual(dist.file.read(), self.content)
+            self.assertEqual(os.stat(dist.file.path).st_ino, blob_stat.st_ino)
+
+    def test_collect_garbage(self):
+        mirror_distributions([self.dist], concurrency=1)
+        name = Distribution.objects.get(pk=self.dist.pk).file.name
+        self.assertEqual(collect_garbage(self.storage, set([name])), (0, 0))
+        self.assertTrue(self.storage.exists(self.blob))
+        self.assertEqual(collect_garbage(self.storage, set(), dry_run=True),
+                         (1, len(self.content)))
+        self.assertTrue(self.storage.exists(self.blob))
+        collect_garbage(self.storage, set())
+        self.assertFalse(self.storage.exists(self.blob))
+
+    def test_gc_keeps_blobs_of_changed_md5s(self):
+        mirror_distributions([self.dist], concurrency=1)
+        # e.g. a reconcile updated the md5 without mirroring the file again
+        Distribution.objects.filter(pk=self.dist.pk).update(md5_digest='0' * 32)
+        call_command('pi_gc_blobs')
+        self.assertTrue(self.storage.exists(self.blob))
+        self.assertEqual(Distribution.objects.get(pk=self.dist.pk).file.read(), self.content)
+
+class TestSimplePages(unittest.TestCase):
+    """
+    The /simple/ pages are served from the cache and kept up to date
+    """
+    def setUp(self):
+        self.index = PackageIndex.objects.create(slug='simple')
+        self.pkg = Package.objects.create(index=self.index, name='simple-pkg')
+        self.release = Release.objects.create(package=self.pkg, version='1.0')
+        self.url = reverse('packageindex-package-simple', kwargs={'package': 'simple-pkg'})
+
+    def tearDown(self):
+        self.pkg.delete()
+        self.index.delete()
+
+    def test_page_changes_with_distributions(self):
+        response = client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse('simple-pkg-1.0.tar.gz' in response.content)
+        Distribution.objects.create(release=self.release, filetype='sdist',
+                                    pyversion='source', filename='simple-pkg-1.0.tar.gz',
+                                    url='http://example.com/simple-pkg-1.0.tar.gz')
+        response = client.get(self.url)
+        self.assertTrue('simple-pkg-1.0.tar.gz' in response.content)
+        reconcile_package(self.pkg, [('1.1', {'name': 'simple-pkg', 'version': '1.1'},
+                                      [upstream_dist('simple-pkg', '1.1')])])
+        self.assertTrue('simple-pkg-1.1.tar.gz' in client.get(self.url).content)
+
+    def test_conditional_get(self):
+        response = client.get(self.url)
+        self.assertTrue(response['ETag'])
+        self.assertTrue(response['Last-Modified'])
+        response = client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        response = client.get(self.url, HTTP_IF_NONE_MATCH='"outdated"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_index_page(self):
+        url = reverse('packageindex-package-index-simple')
+        self.assertTrue('simple-pkg' in client.get(url).content)
+        Package.objects.create(index=self.index, name='simple-pkg-2')
+        self.assertTrue('simple-pkg-2' in client.get(url).content)
+        Package.objects.get(name='simple-pkg-2').delete()
+        self.assertFalse('simple-pkg-2' in client.get(url).content)
+
+    def test_changes_in_other_processes(self):
+        # the cache of this process still holds the pages from before changes
+        # that another process made
+        page = simple_pages.get_package_page('simple-pkg')
+        index_page = simple_pages.get_index_page()
+        Distribution.objects.create(release=self.release, filetype='sdist',
+                                    pyversion='source', filename='simple-pkg-1.0.tar.gz',
+                                    url='http://example.com/simple-pkg-1.0.tar.gz')
+        Package.objects.create(index=self.index, name='simple-pkg-3')
+        Package.objects.filter(name='simple-pkg').update(
+                last_modified=datetime.datetime.now() - datetime.timedelta(seconds=5))
+        cache.set(simple_pages.package_key('simple-pkg'), page)
+        cache.set(simple_pages.INDEX_KEY, index_page)
+        self.assertTrue('simple-pkg-1.0.tar.gz' in client.get(self.url).content)
+        url = reverse('packageindex-package-index-simple')
+        self.assertTrue('simple-pkg-3' in client.get(url).content)
+        Package.objects.get(name='simple-pkg-3').delete()
+        # unchanged pages are served from the cache
+        rendered_at = simple_pages.get_package_page('simple-pkg')['rendered_at']
+        self.assertEqual(simple_pages.get_package_page('simple-pkg')['rendered_at'],
+                         rendered_at)
+
+    def test_missing_package(self):
+        self.assertRaises(Http404, simple_details, HttpRequest(), 'no-such-pkg')
+
+class TestExportSimple(unittest.TestCase):
+    """
+    Exports the simple pages into a directory
+    """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index = PackageIndex.objects.create(slug='export')
+        self.pkg = Package.objects.create(index=self.index, name='export-pkg')
+        self.other = Package.objects.create(index=self.index, name='export-other')
+        self.release = Release.objects.create(package=self.pkg, version='1.0')
+        Package.objects.filter(index=self.index)\
+                       .update(last_modified=datetime.datetime(2000, 1, 1))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        Package.objects.filter(index=self.index).delete()
+        self.index.delete()
+
+    def read(self, *path):
+        return open(os.path.join(self.directory, *path)).read()
+
+    def test_export_matches_views(self):
+        written, removed = export_simple(self.directory)
+        self.assertEqual(written, Package.objects.count())
+        url = reverse('packageindex-package-simple', kwargs={'package': 'export-pkg'})
+        self.assertEqual(self.read('export-pkg', 'index.html'), client.get(url).content)
+        url = reverse('packageindex-package-index-simple')
+        self.assertEqual(self.read('index.html'), client.get(url).content)
+
+    def test_incremental_export(self):
+        export_simple(self.directory)
+        Distribution.objects.create(release=self.release, filetype='sdist',
+                                    pyversion='source', filename='export-pkg-1.0.tar.gz',
+                                    url='http://example.com/export-pkg-1.0.tar.gz')
+        self.other.delete()
+        self.assertEqual(export_simple(self.directory, incremental=True), (1, 1))
+        self.assertTrue('export-pkg-1.0.tar.gz' in self.read('export-pkg', 'index.html'))
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'export-other')))
+        self.assertFalse('export-other' in self.read('index.html'))
+
+class MockRequest(object):
+    def __init__(self, raw_post_data, content_type='multipart/form-data'):
+        self.raw_post_data = raw_post_data
+        self.META = {'CONTENT_TYPE': content_type}
+        self.FILES = MultiValueDict()
+
+
+class TestParseDistutilsRequest(unittest.TestCase):
+    """
+    Parses distutils uploads in small chunks
+    """
+    content = '\x1f\x8b not really a tarball\r\n\n--' * 500
+
+    def setUp(self):
+        self._chunk_size = conf.UPLOAD_CHUNK_SIZE
+        conf.UPLOAD_CHUNK_SIZE = 7
+
+    def tearDown(self):
+        conf.UPLOAD_CHUNK_SIZE = self._chunk_size
+
+    def distutils_body(self, extra_newline=True):
+        body = create_request(create_post_data('file_upload'))
+        boundary = '\n--' + body.splitlines()[1][2:]
+        content = self.content
+        if extra_newline and content.endswith('\r'):
+            # like create_request
+            content += '\n'
+        return body[:-len(boundary + '--\n')] + boundary + \
+            '\nContent-Disposition: form-data; name="content"; filename="foo-0.1.tar.gz"' + \
+            '\n\n' + content + boundary + '--\n'
+
+    def assertParsed(self, request):
+        parse_distutils_request(request)
+        data = create_post_data('file_upload')
+        self.assertEqual(request.POST['name'], 'foo')
+        self.assertEqual(request.POST['description'], data['description'])
+        self.assertEqual(request.POST.getlist('classifiers'), data['classifiers'])
+        uploaded = request.FILES['content']
+        self.assertEqual(uploaded.name, 'foo-0.1.tar.gz')
+        self.assertEqual(uploaded.read(), self.content)
+        self.assertEqual(uploaded.size, len(self.content))
+        self.assertEqual(uploaded.md5_digest, md5_constructor(self.content).hexdigest())
+        self.assertEqual(uploaded.sha256_digest, hashlib.sha256(self.content).hexdigest())
+
+    def test_distutils_upload(self):
+        self.assertParsed(MockRequest(self.distutils_body()))
+
+    def test_distutils_upload_ending_in_cr(self):
+        self.content += '\r'
+        self.assertParsed(MockRequest(self.distutils_body()))
+
+    def test_crlf_upload_ending_in_cr(self):
+        self.content += '\r'
+        self.test_crlf_upload_with_boundary_header()
+
+    def test_crlf_upload_with_boundary_header(self):
+        body = self.distutils_body(extra_newline=False)
+        boundary = body.splitlines()[1][2:]
+        body = body.replace('\n--' + boundary, '\r\n--' + boundary)\
+                   .replace('"\n\n', '"\r\n\r\n')\
+                   .replace('--' + boundary + '\n', '--' + boundary + '\r\n')
+        self.assertParsed(MockRequest(body[2:], 'multipart/form-data; boundary=%s' % boundary))
+
+class TestReleaseCache(unittest.TestCase):
+    """
+    release_urls and release_data are cached per release
+    """
+    def setUp(self):
+        self.index = PackageIndex.objects.create(slug='release-cache')
+        self.pkg = Package.objects.create(index=self.index, name='cached-pkg')
+        self.release = Release.objects.create(package=self.pkg, version='1.0',
+                                              package_info=MultiValueDict({'summary': ['cached']}))
+        self.dist = Distribution.objects.create(release=self.release, filetype='sdist',
+                                                pyversion='source', filename='cached-pkg-1.0.tar.gz',
+                                                url='http://example.com/cached-pkg-1.0.tar.gz',
+                                                size=0)
+        self.request = RequestFactory().post('/pypi/')
+
+    def tearDown(self):
+        self.pkg.delete()
+        self.index.delete()
+
+    def call(self, view, *args):
+        return xmlrpclib.loads(view(self.request, *args).content)[0][0]
+
+    def test_release_urls(self):
+        # responses built within a second of a change are not reused
+        Package.objects.filter(name='cached-pkg').update(
+                last_modified=datetime.datetime.now() - datetime.timedelta(seconds=5))
+        dists = self.call(release_urls, 'cached-pkg', '1.0')
+        self.assertEqual([d['filename'] for d in dists], ['cached-pkg-1.0.tar.gz'])
+        # updates without signals are not seen
+        Distribution.objects.filter(pk=self.dist.pk).update(filename='changed.tar.gz')
+        dists = self.call(release_urls, 'cached-pkg', '1.0')
+        self.assertEqual(dists[0]['filename'], 'cached-pkg-1.0.tar.gz')
+        self.dist.filename = 'changed.tar.gz'
+        self.dist.save()
+        dists = self.call(release_urls, 'cached-pkg', '1.0')
+        self.assertEqual(dists[0]['filename'], 'changed.tar.gz')
+        self.assertEqual(self.call(release_urls, 'cached-pkg', '2.0'), [])
+
+    def test_release_data(self):
+        self.assertEqual(self.call(release_data, 'cached-pkg', '1.0')['summary'], ['cached'])
+        reconcile_package(self.pkg, [('1.0', {'summary': 'reconciled'}, None)])
+        self.assertEqual(self.call(release_data, 'cached-pkg', '1.0')['summary'], ['reconciled'])
+        self.assertEqual(self.call(release_data, 'cached-pkg', '2.0')['name'], '')
+
+    def test_changes_in_other_processes(self):
+        self.call(release_data, 'cached-pkg', '1.0')
+        self.call(release_urls, 'cached-pkg', '1.0')
+        key = release_cache.response_key('cached-pkg', '1.0', 'release_data')
+        entry = cache.get(key)
+        reconcile_package(self.pkg, [('1.0', {'summary': 'elsewhere'}, None)])
+        Package.objects.filter(name='cached-pkg').update(
+                last_modified=datetime.datetime.now() - datetime.timedelta(seconds=5))
+        # the cache of this process still holds the old response
+        cache.set(key, entry)
+        self.assertEqual(self.call(release_data, 'cached-pkg', '1.0')['summary'], ['elsewhere'])
+        # the responses of both methods are kept
+        self.assertEqual(self.call(release_urls, 'cached-pkg', '1.0')[0]['filename'],
+                         'cached-pkg-1.0.tar.gz')
+        self.assertTrue(cache.get(key) is not None)
+
+class TestJournal(unittest.TestCase):
+    """
+    Changes are journaled and served by the changelog xml-rpc methods
+    """
+    def setUp(self):
+        self.serial = journal.last_serial()
+        self.index = PackageIndex.objects.create(slug='journal')
+        self.request = RequestFactory().post('/pypi/')
+
+    def tearDown(self):
+        Package.objects.filter(index=self.index).delete()
+        self.index.delete()
+
+    def call(self, view, *args):
+        return xmlrpclib.loads(view(self.request, *args).content)[0][0]
+
+    def actions(self):
+        return [(name, version, action) for name, version, timestamp, action, serial
+                in self.call(changelog_since_serial, self.serial)]
+
+    def test_model_changes(self):
+        pkg = Package.objects.create(index=self.index, name='journal-pkg')
+        release = Release.objects.create(package=pkg, version='1.0')
+        Distribution.objects.create(release=release, filetype='sdist', pyversion='source',
+                                    filename='journal-pkg-1.0.tar.gz')
+        release.package_info = MultiValueDict({'summary': ['changed']})
+        release.save()
+        release.save()
+        pkg.delete()
+        self.assertEqual(self.actions(), [
+            ('journal-pkg', None, 'create'),
+            ('journal-pkg', '1.0', 'new release'),
+            ('journal-pkg', '1.0', 'add source file journal-pkg-1.0.tar.gz'),
+            ('journal-pkg', '1.0', 'update package_info'),
+            ('journal-pkg', '1.0', 'remove file journal-pkg-1.0.tar.gz'),
+            ('journal-pkg', '1.0', 'remove'),
+            ('journal-pkg', None, 'remove'),
+        ])
+        self.assertEqual(self.call(changelog_last_serial), self.serial + 7)
+
+    def test_reconcile_changes(self):
+        pkg = Package.objects.create(index=self.index, name='journal-pkg', auto_hide=False)
+        reconcile_package(pkg, [('1.0', {'summary': 'one'}, [upstream_dist('journal-pkg', '1.0')])])
+        reconcile_package(pkg, [('1.0', {'summary': 'two'}, None)])
+        self.assertEqual(self.actions(), [
+            ('journal-pkg', None, 'create'),
+            ('journal-pkg', '1.0', 'new release'),
+            ('journal-pkg', '1.0', 'add source file journal-pkg-1.0.tar.gz'),
+            ('journal-pkg', '1.0', 'update package_info'),
+        ])
+        # the journal can be applied by ChangelogSync
+        changes = plan_changes(self.call(changelog_since_serial, self.serial))
+        self.assertEqual(changes[0].releases, {'1.0': set(['data', 'urls'])})
+
+    def test_changelog_since(self):
+        Package.objects.create(index=self.index, name='journal-pkg')
+        now = calendar.timegm(datetime.datetime.utcnow().utctimetuple())
+        self.assertTrue(['journal-pkg', None, 'create'] in
+                        [item[:2] + item[3:] for item in self.call(changelog, now - 60)])
+        self.assertEqual(self.call(changelog, now + 60), [])
+        item = self.call(changelog, now - 60, True)[-1]
+        self.assertEqual(item[4], journal.last_serial())
+
+class TestSearchIndex(unittest.TestCase):
+    """
+    The xml-rpc search uses the inverted index of package_info
+    """
+    def setUp(self):
+        self.index = PackageIndex.objects.create(slug='search')
+        self.spam = Package.objects.create(index=self.index, name='spam-tools')
+        Release.objects.create(package=self.spam, version='1.0',
+                               package_info=MultiValueDict({'summary': ['Spam and eggs'],
+                                                            'author': ['Graham Chapman']}))
+        self.eggs = Package.objects.create(index=self.index, name='eggs')
+        reconcile_package(self.eggs, [('0.1', {'summary': 'Just eggs',
+                                               'author': 'John Cleese'}, [])])
+        self.request = RequestFactory().post('/pypi/')
+
+    def tearDown(self):
+        Package.objects.filter(index=self.index).delete()
+        self.index.delete()
+
+    def test_web_search(self):
+        response = client.get(reverse('packageindex-search'), {'q': 'am-to'})
+        self.assertEqual(list(response.context['package_list']), [self.spam])
+        response = client.get(reverse('packageindex-search'), {'q': 'eggs'})
+        self.assertEqual(sorted(p.name for p in response.context['package_list']),
+                         ['eggs', 'spam-tools'])
+
+    def search(self, *args):
+        result = xmlrpclib.loads(xmlrpc_search(self.request, *args).content)[0][0]
+        return sorted((r['name'], r['version']) for r in result)
+
+    def test_search(self):
+        self.assertEqual(self.search({'summary': 'eggs'}),
+                         [('eggs', '0.1'), ('spam-tools', '1.0')])
+        self.assertEqual(self.search({'summary': 'eggs', 'author': 'john'}),
+                         [('eggs', '0.1')])
+        self.assertEqual(self.search({'summary': 'spam', 'author': 'john'}, 'or'),
+                         [('eggs', '0.1'), ('spam-tools', '1.0')])
+        self.assertEqual(self.search({'name': ['spam', 'nothing']}),
+                         [('spam-tools', '1.0')])
+        self.assertEqual(self.search({'name': 'spam tools', 'version': '1.0'}),
+                         [('spam-tools', '1.0')])
+        self.assertEqual(self.search({'unknown': 'eggs'}), [])
+
+    def test_index_follows_changes(self):
+        release = self.spam.releases.get()
+        release.package_info = MultiValueDict({'summary': ['Lumberjacks']})
+        release.save()
+        self.assertEqual(self.search({'summary': 'lumber'}), [('spam-tools', '1.0')])
+        reconcile_package(self.eggs, [('0.1', {'summary': 'Lumberjacks too'}, None)])
+        self.assertEqual(self.search({'summary': 'lumber'}),
+                         [('eggs', '0.1'), ('spam-tools', '1.0')])
+        self.assertEqual(self.search({'summary': 'eggs'}), [])
+
+class TestDenormalizedFields(unittest.TestCase):
+    """
+    Frequently read package_info fields are kept in step as release columns
+    """
+    def setUp(self):
+        self.index = PackageIndex.objects.create(slug='denormalized')
+        self.package = Package.objects.create(index=self.index, name='denormalized')
+
+    def tearDown(self):
+        Package.objects.filter(index=self.index).delete()
+        self.index.delete()
+
+    def test_save(self):
+        release = Release.objects.create(package=self.package, version='1.0',
+            package_info=MultiValueDict({'summary': ['Spam'],
+                                         'license': ['BSD'],
+                                         'classifier': ['Framework :: Django']}))
+        release = Release.objects.without_package_info().get(pk=release.pk)
+        self.assertEqual((release.summary, release.license, release.author),
+                         (u'Spam', u'BSD', u''))
+        self.assertEqual([c.name for c in release.classifiers.all()],
+                         [u'Framework :: Django'])
+        release.package_info = MultiValueDict({'summary': ['Eggs']})
+        release.save()
+        self.assertEqual(Release.objects.filter(summary='Eggs').count(), 1)
+        self.assertEqual(release.classifiers.count(), 0)
+
+    def test_reconcile(self):
+        reconcile_package(self.package, [('1.0', {'summary': 'Spam',
+                                                  'requires_python': '>=2.5',
+                                                  'classifiers': ['License :: OSI Approved',
+                                                                  'Framework :: Django']},
+                                          [])])
+        release = self.package.releases.get()
+        self.assertEqual((release.summary, release.requires_python), (u'Spam', u'>=2.5'))
+        self.assertEqual(sorted(c.name for c in release.classifiers.all()),
+                         [u'Framework :: Django', u'License :: OSI Approved'])
+        reconcile_package(self.package, [('1.0', {'summary': 'Eggs',
+                                                  'classifiers': ['Framework :: Django']},
+                                          None)])
+        release = self.package.releases.get()
+        self.assertEqual((release.summary, release.requires_python), (u'Eggs', u''))
+        self.assertEqual([c.name for c in release.classifiers.all()],
+                         [u'Framework :: Django'])
+
+class TestLazyPackageInfo(unittest.TestCase):
+    """
+    package_info is decoded on first access and only encoded again if it
+    was changed
+    """
+    def setUp(self):
+        self.index = PackageIndex.objects.create(slug='lazy')
+        self.package = Package.objects.create(index=self.index, name='lazy')
+        self.release = Release.objects.create(package=self.package, version='1.0',
+            package_info=MultiValueDict({'summary': ['Spam']}))
+
+    def tearDown(self):
+        Package.objects.filter(index=self.index).delete()
+        self.index.delete()
+
+    def test_lazy(self):
+        release = Release.objects.get(pk=self.release.pk)
+        self.assertTrue(isinstance(release.__dict__['package_info'], basestring))
+        release.hidden = True
+        release.save()
+        self.assertTrue(isinstance(release.__dict__['package_info'], basestring))
+        self.assertEqual(release.package_info['summary'], u'Spam')
+        self.assertFalse(release.package_info.changed)
+
+    def test_changes_are_saved(self):
+        release = Release.objects.get(pk=self.release.pk)
+        release.package_info['summary'] = u'Eggs'
+        self.assertTrue(release.package_info.changed)
+        release.save()
+        release = Release.objects.without_package_info().get(pk=self.release.pk)
+        self.assertEqual(release.summary, u'Eggs')
+        self.assertEqual(release.package_info.getlist('summary'), [u'Eggs'])
+
+    def test_save_deferred(self):
+        release = Release.objects.without_package_info().get(pk=self.release.pk)
+        release.hidden = True
+        release.save()
+        release = Release.objects.get(pk=self.release.pk)
+        self.assertTrue(release.hidden)
+        self.assertEqual(release.package_info.getlist('summary'), [u'Spam'])
+
+class TestCompressedPackageInfo(unittest.TestCase):
+    """
+    package_info can be stored compressed, rows in both formats are read
+    """
+    def setUp(self):
+        self.compression = conf.PACKAGE_INFO_COMPRESSION
+        self.index = PackageIndex.objects.create(slug='compressed')
+        self.package = Package.objects.create(index=self.index, name='compressed')
+        self.info = MultiValueDict({'summary': ['Spam'],
+                                    'description': ['Spam, eggs and spam. ' * 100]})
+
+    def tearDown(self):
+        conf.PACKAGE_INFO_COMPRESSION = self.compression
+        Package.objects.filter(index=self.index).delete()
+        self.index.delete()
+
+    def raw(self, release):
+        return Release.objects.filter(pk=release.pk).values_list('package_info', flat=True)[0]
+
+    def test_compressed(self):
+        plain = Release.objects.create(package=self.package, version='1.0',
+                                       package_info=self.info)
+        conf.PACKAGE_INFO_COMPRESSION = True
+        compressed = Release.objects.create(package=self.package, version='2.0',
+                                            package_info=self.info)
+        self.assertTrue(self.raw(plain).startswith('{'))
+        self.assertTrue(self.raw(compressed).startswith(COMPRESSED_PREFIX))
+        self.assertTrue(len(self.raw(compressed)) < len(self.raw(plain)))
+        for release in (plain, compressed):
+            release = Release.objects.get(pk=release.pk)
+            self.assertEqual(release.package_info.getlist('description'),
+                             self.info.getlist('description'))
+
+    def test_command(self):
+        release = Release.objects.create(package=self.package, version='1.0',
+                                         package_info=self.info)
+        conf.PACKAGE_INFO_COMPRESSION = True
+        call_command('pi_compress_package_info')
+        self.assertTrue(self.raw(release).startswith(COMPRESSED_PREFIX))
+        call_command('pi_compress_package_info', decompress=True)
+        self.assertTrue(self.raw(release).startswith('{'))
+
+    def test_command_keeps_concurrent_changes(self):
+        release = Release.objects.create(package=self.package, version='1.0',
+                                         package_info=self.info)
+        rows = Release.objects.filter(pk=release.pk)\
+                              .values_list('pk', 'metadata_digest', 'package_info')
+        rows = list(rows)
+        # saved by another process after the rows were read
+        release.package_info['summary'] = u'changed'
+        release.save()
+        self.assertEqual(recompress(rows, True), (0, 0, 0))
+        release = Release.objects.get(pk=release.pk)
+        self.assertEqual(release.package_info['summary'], u'changed')
+
+class TestDescriptions(unittest.TestCase):
+    """
+    Descriptions are rendered when releases are saved and cached
+    """
+    def setUp(self):
+        self.background = conf.RST_PRERENDER_IN_BACKGROUND
+        conf.RST_PRERENDER_IN_BACKGROUND = False
+        self.index = PackageIndex.objects.create(slug='descriptions')
+        self.package = Package.objects.create(index=self.index, name='descriptions')
+
+    def tearDown(self):
+        conf.RST_PRERENDER_IN_BACKGROUND = self.background
+        Package.objects.filter(index=self.index).delete()
+        self.index.delete()
+
+    def test_prerender(self):
+        text = u'Spam <b>and</b> eggs %s' % time.time()
+        key = descriptions.description_key(text)
+        Release.objects.create(package=self.package, version='1.0',
+                               package_info=MultiValueDict({'description': [text]}))
+        self.assertEqual(cache.get(key), descriptions.render(text))
+        cache.set(key, u'<p>cached</p>')
+        self.assertEqual(saferst(text), u'<p>cached</p>')
+        self.assertEqual(descriptions.prerender([text]), 0)
+
+    def test_reconcile(self):
+        text = u'Lumberjacks %s' % time.time()
+        reconcile_package(self.package, [('1.0', {'description': text}, [])])
+        self.assertTrue(cache.get(descriptions.description_key(text)) is not None)
+
+    def test_background(self):
+        conf.RST_PRERENDER_IN_BACKGROUND = True
+        texts = [u'Dead parrot %s %s' % (i, time.time()) for i in range(3)]
+        for i, text in enumerate(texts):
+            Release.objects.create(package=self.package, version='1.%s' % i,
+                                   package_info=MultiValueDict({'description': [text]}))
+        descriptions.wait()
+        for text in texts:
+            self.assertEqual(cache.get(descriptions.description_key(text)),
+                             descriptions.render(text))
+
+class TestAutohide(unittest.TestCase):
+    """
+    Autohide is applied with set-based updates and can be suspended
+    """
+    def setUp(self):
+        self.index = PackageIndex.objects.create(slug='autohide')
+        self.package = Package.objects.create(index=self.index, name='autohide')
+
+    def tearDown(self):
+        Package.objects.filter(index=self.index).delete()
+        self.index.delete()
+
+    def visible(self):
+        return list(self.package.releases.filter(hidden=False)
+                                         .values_list('version', flat=True))
+
+    def create_release(self, version, **kwargs):
+        release = Release.objects.create(package=self.package, version=version,
+                                         package_info=MultiValueDict(), **kwargs)
+        # created is only precise to the second in some databases
+        Release.objects.filter(pk=release.pk).update(
+            created=datetime.datetime(2010, 1, 1) + datetime.timedelta(days=release.pk))
+        return release
+
+    def test_new_release(self):
+        self.create_release('1.0')
+        self.create_release('2.0', hidden=True)
+        self.assertEqual(self.visible(), ['2.0'])
+        entries = JournalEntry.objects.filter(name='autohide', action=u"update hidden")
+        self.assertEqual(sorted(entries.values_list('version', flat=True)), ['1.0', '2.0'])
+
+    def test_suspended(self):
+        with autohide.suspended():
+            self.create_release('1.0')
+            self.create_release('2.0')
+            self.package.save()
+            self.assertEqual(sorted(self.visible()), ['1.0', '2.0'])
+        self.assertEqual(self.visible(), ['2.0'])
+
+    def test_package_save(self):
+        self.package.auto_hide = False
+        self.package.save()
+        self.create_release('1.0')
+        self.create_release('2.0')
+        self.assertEqual(sorted(self.visible()), ['1.0', '2.0'])
+        self.package.auto_hide = True
+        self.package.save()
+        self.assertEqual(self.visible(), ['2.0'])
+
+class TestListPackages(unittest.TestCase):
+    """
+    list_packages is streamed from a precompressed file with an ETag
+    """
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.settings = (conf.LIST_PACKAGES_CACHE_DIR, conf.LIST_PACKAGES_BATCH_SIZE)
+        conf.LIST_PACKAGES_CACHE_DIR = self.cache_dir
+        conf.LIST_PACKAGES_BATCH_SIZE = 2
+        self.index = PackageIndex.objects.create(slug='list-packages')
+        for name in (u'list-spam', u'list-eggs', u'list-<ham>', u'list-sp\xe4m'):
+            Package.objects.create(index=self.index, name=name)
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        conf.LIST_PACKAGES_CACHE_DIR, conf.LIST_PACKAGES_BATCH_SIZE = self.settings
+        Package.objects.filter(index=self.index).delete()
+        self.index.delete()
+        shutil.rmtree(self.cache_dir)
+
+    def names(self, content):
+        return [name for name in xmlrpclib.loads(content)[0][0]
+                if name.startswith('list-')]
+
+    def test_list_packages(self):
+        expected = sorted(Package.objects.values_list('name', flat=True))
+        response = list_packages(self.factory.post('/pypi/'))
+        content = response.content
+        self.assertEqual(int(response['Content-Length']), len(content))
+        self.assertEqual(xmlrpclib.loads(content)[0][0], expected)
+
+        response = list_packages(self.factory.post('/pypi/', HTTP_ACCEPT_ENCODING='gzip'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        content = gzip.GzipFile(fileobj=StringIO.StringIO(response.content)).read()
+        self.assertEqual(xmlrpclib.loads(content)[0][0], expected)
+
+        response = list_packages(self.factory.post('/pypi/', HTTP_IF_NONE_MATCH=response['ETag']))
+        self.assertEqual(response.status_code, 304)
+
+    def test_invalidation(self):
+        etag = list_packages(self.factory.post('/pypi/'))['ETag']
+        Package.objects.create(index=self.index, name=u'list-new')
+        response = list_packages(self.factory.post('/pypi/', HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(u'list-new' in self.names(response.content))
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+    def test_changes_in_other_processes(self):
+        list_packages(self.factory.post('/pypi/')).close()
+        listing = cache.get(package_list.CACHE_KEY)
+        Package.objects.create(index=self.index, name=u'list-other')
+        # another process still has the entry from before the package was added
+        cache.set(package_list.CACHE_KEY, listing)
+        response = list_packages(self.factory.post('/pypi/'))
+        self.assertTrue(u'list-other' in self.names(response.content))
+
+    def test_multicall_closes_file(self):
+        opened = []
+        open_listing = package_list.open_listing
+        def recording_open_listing(*args, **kwargs):
+            listing, fh = open_listing(*args, **kwargs)
+            opened.append(fh)
+            return listing, fh
+        package_list.open_listing = recording_open_listing
+        try:
+            content = xmlrpc_multicall(self.factory.post('/pypi/'),
+                                       [{'methodName': 'list_packages'}]).content
+        finally:
+            package_list.open_listing = open_listing
+        self.assertTrue(u'list-spam' in xmlrpclib.loads(content)[0][0][0][0])
+        self.assertEqual(len(opened), 1)
+        self.assertTrue(opened[0].closed)
+
+
+class KeepAliveRequestHandler(SimpleXMLRPCRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+
+class TestPooledTransport(UpstreamServerTestCase):
+    """
+    Upstream calls share kept alive connections, are gzip encoded, retried
+    and measured
+    """
+    request_handler = KeepAliveRequestHandler
+
+    def setUp(self):
+        super(TestPooledTransport, self).setUp()
+        self.settings = (conf.UPSTREAM_RETRIES, conf.UPSTREAM_RETRY_BACKOFF)
+        self.pool = ConnectionPool()
+        self.metrics = CallMetrics()
+
+    def tearDown(self):
+        conf.UPSTREAM_RETRIES, conf.UPSTREAM_RETRY_BACKOFF = self.settings
+        # the server handles a kept alive connection until it is closed
+        self.pool.clear()
+        super(TestPooledTransport, self).tearDown()
+
+    def proxy(self, url):
+        return server_proxy(url, transport=PooledTransport(
+                                connection_pool=self.pool, call_metrics=self.metrics))
+
+    def test_keep_alive(self):
+        proxy = self.proxy(self.index.xml_rpc_url)
+        self.assertEqual(sorted(proxy.list_packages()), ['bar', 'broken', 'foo'])
+        self.assertEqual(proxy.package_releases('bar'), ['0.1'])
+        self.assertEqual(self.pool.idle_count('http', '127.0.0.1:%s' % self.server.server_address[1]), 1)
+        summary = self.metrics.summary()
+        self.assertEqual(summary['list_packages']['calls'], 1)
+        self.assertEqual(summary['package_releases']['calls'], 1)
+
+    def test_gzip(self):
+        # both the request and the response are larger than the thresholds
+        threshold = conf.UPSTREAM_GZIP_THRESHOLD
+        conf.UPSTREAM_GZIP_THRESHOLD = 1400
+        try:
+            name = 'spam' * 1000
+            data = self.proxy(self.index.xml_rpc_url).release_data(name, '1.0')
+        finally:
+            conf.UPSTREAM_GZIP_THRESHOLD = threshold
+        self.assertEqual(data['summary'], 'summary of %s 1.0' % name)
+
+    def test_retries(self):
+        conf.UPSTREAM_RETRIES = 2
+        conf.UPSTREAM_RETRY_BACKOFF = 0
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        url = 'http://127.0.0.1:%s/' % sock.getsockname()[1]
+        sock.close()
+        self.assertRaises(socket.error, self.proxy(url).list_packages)
+        summary = self.metrics.summary()['list_packages']
+        self.assertEqual((summary['calls'], summary['errors'], summary['retries']),
+                         (3, 3, 2))
+
+
+class TestResponseCache(UpstreamServerTestCase):
+    """
+    Upstream responses are cached, recorded and replayed
+    """
+    def setUp(self):
+        super(TestResponseCache, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.settings = (conf.UPSTREAM_CACHE_DIR, conf.UPSTREAM_CACHE_MODE)
+        conf.UPSTREAM_CACHE_DIR = self.cache_dir
+
+    def tearDown(self):
+        conf.UPSTREAM_CACHE_DIR, conf.UPSTREAM_CACHE_MODE = self.settings
+        shutil.rmtree(self.cache_dir)
+        super(TestResponseCache, self).tearDown()
+
+    def test_cache(self):
+        conf.UPSTREAM_CACHE_MODE = 'cache'
+        client = server_proxy(self.index.xml_rpc_url)
+        for i in range(2):
+            self.assertEqual(client.package_releases('bar'), ['0.1'])
+            client.changelog_last_serial()
+        self.assertEqual(self.upstream.calls, ['package_releases',
+                                               'changelog_last_serial',
+                                               'changelog_last_serial'])
+
+    def test_record_and_replay(self):
+        conf.UPSTREAM_CACHE_MODE = 'record'
+        SyncEngine(self.index, concurrency=1).run(['foo'])
+        versions = sorted(Release.objects.filter(package__name='foo')
+                                         .values_list('version', flat=True))
+        Package.objects.filter(index=self.index).delete()
+        self.upstream.calls = []
+
+        conf.UPSTREAM_CACHE_MODE = 'replay'
+        result = SyncEngine(self.index, concurrency=1).run(['foo', 'bar'])
+        self.assertEqual(result['synced'], ['foo'])
+        # bar was not recorded
+        self.assertEqual(result['failed'], ['bar'])
+        self.assertEqual(self.upstream.calls, [])
+        self.assertEqual(sorted(Release.objects.filter(package__name='foo')
+                                               .values_list('version', flat=True)),
+                         versions)
+
+
+class ConditionalHTTPRequestHandler(QuietHTTPRequestHandler):
+    """ Answers requests with a matching If-Modified-Since with 304 and
+    records the requested paths """
+    requests = []
+
+    def send_head(self):
+        since = self.headers.getheader('If-Modified-Since')
+        self.requests.append((self.path, since))
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            path = os.path.join(path, 'index.html')
+        if since and os.path.exists(path) and \
+                since == self.date_time_string(int(os.path.getmtime(path))):
+            self.send_response(304)
+            self.end_headers()
+            return None
+        return SimpleHTTPRequestHandler.send_head(self)
+
+
+class TestExternalLinkCrawler(unittest.TestCase):
+    """
+    Crawls a simple page and the home page it links to from a local http
+    server
+    """
+    def write(self, path, content, mtime=None):
+        path = os.path.join(self.served_dir, path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, 'wb').write(content)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def setUp(self):
+        self.served_dir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.served_dir)
+        ConditionalHTTPRequestHandler.requests = []
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), ConditionalHTTPRequestHandler)
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.base_url = 'http://127.0.0.1:%s' % self.server.server_address[1]
+        self.write('simple/crawl-pkg/index.html',
+                   '<html><body>'
+                   '<a href="../../packages/source/c/crawl-pkg/crawl-pkg-0.9.tar.gz#md5=%s">hosted</a>'
+                   '<a href="%s/files/crawl-pkg-1.0.tar.gz#md5=%s">crawl-pkg-1.0.tar.gz</a>'
+                   '<a href="%s/home/" rel="homepage">1.0 home_page</a>'
+                   '</body></html>' % ('1' * 32, self.base_url, '2' * 32, self.base_url))
+        self.write('home/index.html',
+                   '<html><body><a href="../files/crawl-pkg-2.0.zip">download</a>'
+                   '<a href="/about/">about</a></body></html>', time.time() - 60)
+        self.index = PackageIndex.objects.create(slug='crawl',
+                                                 simple_url=self.base_url + '/simple/')
+        self.pkg = Package.objects.create(index=self.index, name='crawl-pkg')
+        self.crawler = ExternalLinkCrawler(concurrency=1, limiter=RateLimiter())
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.served_dir)
+        CrawledPage.objects.all().delete()
+        self.pkg.delete()
+        self.index.delete()
+
+    def distributions(self):
+        return sorted(Distribution.objects.filter(release__package=self.pkg)
+                          .values_list('release__version', 'filename', 'url',
+                                       'md5_digest', 'is_from_external'))
+
+    def test_parse_links(self):
+        self.assertEqual(parse_links(u'<a href=" a.zip " rel="download">x</a>'
+                                     u'<a name="top">top</a><p><a href="b/">'),
+                         [(u'a.zip', u'download'), (u'b/', u'')])
+
+    def test_crawl(self):
+        self.assertEqual(self.crawler.crawl([self.pkg]), [])
+        self.assertEqual(self.distributions(), [
+            (u'1.0', u'crawl-pkg-1.0.tar.gz', self.base_url + '/files/crawl-pkg-1.0.tar.gz', '2' * 32, True),
+            (u'2.0', u'crawl-pkg-2.0.zip', self.base_url + '/files/crawl-pkg-2.0.zip', '', True),
+        ])
+        self.assertTrue(Release.objects.get(package=self.pkg, version='1.0').is_from_external)
+        self.assertTrue(Package.objects.get(pk=self.pkg.pk).parsed_external_links_at)
+        self.assertEqual(CrawledPage.objects.count(), 2)
+
+    def test_unchanged_pages_are_not_downloaded(self):
+        self.crawler.crawl([self.pkg])
+        ConditionalHTTPRequestHandler.requests = []
+        pkg = Package.objects.get(pk=self.pkg.pk)
+        crawler = ExternalLinkCrawler(concurrency=1, limiter=RateLimiter())
+        self.assertEqual(crawler.crawl([pkg]), [])
+        self.assertEqual(sorted(path for path, since in ConditionalHTTPRequestHandler.requests if since),
+                         ['/home/', '/simple/crawl-pkg/'])
+        self.assertEqual((crawler.stats['fetched'], crawler.stats['unchanged'],
+                          crawler.stats['skipped']), (0, 2, 1))
+        self.assertEqual(len(self.distributions()), 2)
+
+    def test_changed_page(self):
+        self.crawler.crawl([self.pkg])
+        self.write('home/index.html',
+                   '<html><body><a href="../files/crawl-pkg-2.0.zip">download</a>'
+                   '<a href="../files/crawl-pkg-2.1.tar.bz2">download</a></body></html>')
+        pkg = Package.objects.get(pk=self.pkg.pk)
+        crawler = ExternalLinkCrawler(concurrency=1, limiter=RateLimiter())
+        crawler.crawl([pkg])
+        self.assertEqual((crawler.stats['fetched'], crawler.stats['unchanged'],
+                          crawler.stats['skipped']), (1, 1, 0))
+        self.assertEqual([d[0] for d in self.distributions()], [u'1.0', u'2.0', u'2.1'])
+
+    def test_cached_listing(self):
+        settings = (conf.UPSTREAM_CACHE_DIR, conf.UPSTREAM_CACHE_MODE,
+                    conf.UPSTREAM_CACHE_TTLS)
+        conf.UPSTREAM_CACHE_DIR = tempfile.mkdtemp()
+        conf.UPSTREAM_CACHE_MODE = 'cache'
+        conf.UPSTREAM_CACHE_TTLS = {'external_links': 3600}
+        try:
+            self.crawler.crawl([self.pkg])
+            # the simple page is read once, the listing keeps its validators
+            self.assertEqual([path for path, since in ConditionalHTTPRequestHandler.requests],
+                             ['/simple/crawl-pkg/', '/home/'])
+            ConditionalHTTPRequestHandler.requests = []
+            conf.UPSTREAM_CACHE_TTLS = {'external_links': -1}
+            pkg = Package.objects.get(pk=self.pkg.pk)
+            crawler = ExternalLinkCrawler(concurrency=1, limiter=RateLimiter())
+            self.assertEqual(crawler.crawl([pkg]), [])
+            # the stale listing is revalidated page by page, nothing is read
+            self.assertEqual([path for path, since in ConditionalHTTPRequestHandler.requests
+                              if since], ['/simple/crawl-pkg/', '/home/'])
+            self.assertEqual(len(ConditionalHTTPRequestHandler.requests), 2)
+            self.assertEqual(crawler.stats['fetched'], 0)
+
+            # a changed home page is read again, with an unchanged simple page
+            self.write('home/index.html',
+                       '<html><body><a href="../files/crawl-pkg-2.0.zip">download</a>'
+                       '<a href="../files/crawl-pkg-2.1.tar.bz2">download</a></body></html>')
+            ConditionalHTTPRequestHandler.requests = []
+            pkg = Package.objects.get(pk=self.pkg.pk)
+            crawler = ExternalLinkCrawler(concurrency=1, limiter=RateLimiter())
+            self.assertEqual(crawler.crawl([pkg]), [])
+            self.assertEqual((crawler.stats['fetched'], crawler.stats['unchanged']), (1, 1))
+            self.assertEqual([d[0] for d in self.distributions()], [u'1.0', u'2.0', u'2.1'])
+        finally:
+            shutil.rmtree(conf.UPSTREAM_CACHE_DIR)
+            (conf.UPSTREAM_CACHE_DIR, conf.UPSTREAM_CACHE_MODE,
+             conf.UPSTREAM_CACHE_TTLS) = settings
+
+    def test_links_are_added_in_bulk(self):
+        files = [('http://example.com/crawl-pkg-%s.tar.gz' % version,
+                  'crawl-pkg-%s.tar.gz' % version, '') for version in ('1.0', '1.1', '1.2')]
+        renders = []
+        render_package_page = simple_pages.render_package_page
+        simple_pages.render_package_page = lambda package: renders.append(package) or u''
+        try:
+            result = self.pkg.add_distribution_links(files)
+            self.assertEqual((result.releases['inserted'],
+                              result.distributions['inserted']), (3, 3))
+            self.assertEqual(len(renders), 1)
+            files[0] = ('http://example.com/moved/crawl-pkg-1.0.tar.gz',
+                        'crawl-pkg-1.0.tar.gz', '3' * 32)
+            result = self.pkg.add_distribution_links(files)
+            self.assertEqual((result.distributions['updated'],
+                              result.distributions['unchanged']), (1, 2))
+            self.assertEqual(len(renders), 2)
+        finally:
+            simple_pages.render_package_page = render_package_page
+        self.assertEqual(self.distributions()[0],
+                         (u'1.0', u'crawl-pkg-1.0.tar.gz',
+                          'http://example.com/moved/crawl-pkg-1.0.tar.gz', '3' * 32, True))
+
+    def test_shared_pages_are_bounded(self):
+        shared_pages = conf.CRAWL_SHARED_PAGES
+        conf.CRAWL_SHARED_PAGES = 1
+        try:
+            self.crawler.crawl([self.pkg])
+        finally:
+            conf.CRAWL_SHARED_PAGES = shared_pages
+        self.assertEqual(self.crawler._pages.keys(), [self.base_url + '/home/'])
+        self.assertEqual(len(self.distributions()), 2)
+
+    def test_unreadable_simple_page(self):
+        self.pkg.name = 'missing-pkg'
+        self.assertEqual(self.crawler.crawl([self.pkg]), [self.pkg])
+        self.assertEqual(self.distributions(), [])
+
+
+class TestPullThroughProxy(unittest.TestCase):
+    """
+    Missing packages are pulled from an upstream index on a local http server
+    """
+    content = 'not really a tarball\n' * 100
+
+    def setUp(self):
+        self.served_dir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.served_dir)
+        ConditionalHTTPRequestHandler.requests = []
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), ConditionalHTTPRequestHandler)
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        base_url = 'http://127.0.0.1:%s' % self.server.server_address[1]
+        os.makedirs('simple/proxy-pkg')
+        os.makedirs('packages')
+        open('packages/proxy-pkg-1.0.tar.gz', 'wb').write(self.content)
+        open('simple/proxy-pkg/index.html', 'wb').write(
+            '<html><body><a href="../../packages/proxy-pkg-1.0.tar.gz#md5=%s">'
+            'proxy-pkg-1.0.tar.gz</a></body></html>' % md5_constructor(self.content).hexdigest())
+        os.utime('simple/proxy-pkg/index.html', (time.time() - 60, time.time() - 60))
+        self._settings = (conf.PROXY_MISSING, conf.PROXY_PULL_THROUGH, conf.PROXY_BASE_URL)
+        conf.PROXY_MISSING = conf.PROXY_PULL_THROUGH = True
+        conf.PROXY_BASE_URL = base_url + '/simple'
+        cache.clear()
+
+    def tearDown(self):
+        conf.PROXY_MISSING, conf.PROXY_PULL_THROUGH, conf.PROXY_BASE_URL = self._settings
+        self.server.shutdown()
+        self.server.server_close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.served_dir)
+        for dist in Distribution.objects.filter(release__package__name='proxy-pkg'):
+            if dist.file:
+                dist.file.delete(save=False)
+        Package.objects.filter(name='proxy-pkg').delete()
+        PackageIndex.objects.filter(slug=conf.PROXY_INDEX_SLUG).delete()
+        CrawledPage.objects.all().delete()
+        cache.clear()
+
+    def upstream_requests(self, path):
+        return [since for requested, since in ConditionalHTTPRequestHandler.requests
+                if requested == path]
+
+    def test_pull_missing_package(self):
+        response = client.get(reverse('packageindex-package-simple',
+                                      kwargs={'package': 'proxy-pkg'}))
+        self.assertEqual(response.status_code, 200)
+        dist = Distribution.objects.get(release__package__name='proxy-pkg')
+        self.assertEqual((dist.release.version, dist.filename, dist.is_from_external,
+                          dist.md5_digest),
+                         (u'1.0', u'proxy-pkg-1.0.tar.gz', False,
+                          md5_constructor(self.content).hexdigest()))
+        self.assertEqual(dist.release.package.index.slug, conf.PROXY_INDEX_SLUG)
+        self.assertTrue(reverse('packageindex-distribution-download',
+                                kwargs={'distribution_id': dist.pk,
+                                        'filename': dist.filename}) in response.content)
+        # served locally until the page is stale
+        client.get(reverse('packageindex-package-simple', kwargs={'package': 'proxy-pkg'}))
+        self.assertEqual(len(self.upstream_requests('/simple/proxy-pkg/')), 1)
+
+    def test_stale_package_is_revalidated(self):
+        proxy.get_package_page('proxy-pkg')
+        cache.delete(proxy.state_key('proxy-pkg'))
+        page = proxy.get_package_page('proxy-pkg')
+        self.assertTrue('proxy-pkg-1.0.tar.gz' in page['html'])
+        since = self.upstream_requests('/simple/proxy-pkg/')
+        self.assertEqual(len(since), 2)
+        self.assertTrue(since[1])
+        self.assertEqual(Distribution.objects.filter(release__package__name='proxy-pkg').count(), 1)
+
+    def test_unmodified_page_is_applied(self):
+        proxy.get_package_page('proxy-pkg')
+        # e.g. an interrupted pull
+        Release.objects.filter(package__name='proxy-pkg').delete()
+        cache.delete(proxy.state_key('proxy-pkg'))
+        page = proxy.get_package_page('proxy-pkg')
+        self.assertTrue(self.upstream_requests('/simple/proxy-pkg/')[1])
+        self.assertTrue('proxy-pkg-1.0.tar.gz' in page['html'])
+        self.assertEqual(Distribution.objects.filter(release__package__name='proxy-pkg').count(), 1)
+
+    def test_only_proxied_packages_are_downloaded_through_the_proxy(self):
+        proxy.get_package_page('proxy-pkg')
+        dist = Distribution.objects.get(release__package__name='proxy-pkg')
+        self.assertEqual(dist.path, reverse('packageindex-distribution-download',
+                                            kwargs={'distribution_id': dist.pk,
+                                                    'filename': dist.filename}))
+        index = PackageIndex.objects.create(slug='not-proxied')
+        try:
+            package = Package.objects.create(index=index, name='synced-pkg',
+                                             updated_from_remote_at=datetime.datetime.now())
+            release = Release.objects.create(package=package, version='1.0')
+            synced = Distribution.objects.create(
+                            release=release, filetype='sdist', pyversion='source',
+                            filename='synced-pkg-1.0.tar.gz',
+                            url='http://example.com/synced-pkg-1.0.tar.gz')
+            self.assertEqual(synced.path, synced.url)
+        finally:
+            Package.objects.filter(index=index).delete()
+            index.delete()
+
+    def test_missing_upstream(self):
+        for i in range(2):
+            self.assertRaises(Http404, simple_details, HttpRequest(), 'no-such-pkg')
+        self.assertEqual(len(self.upstream_requests('/simple/no-such-pkg/')), 1)
+        self.assertFalse(Package.objects.filter(name='no-such-pkg').exists())
+
+    def test_unreachable_upstream_redirects(self):
+        conf.PROXY_BASE_URL = 'http://127.0.0.1:1/simple'
+        response = simple_details(HttpRequest(), 'proxy-pkg')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], 'http://127.0.0.1:1/simple/proxy-pkg/')
+
+    def test_download_stores_file(self):
+        proxy.get_package_page('proxy-pkg')
+        dist = Distribution.objects.get(release__package__name='proxy-pkg')
+        self.assertFalse(dist.file)
+        response = download(HttpRequest(), dist.pk, dist.filename)
+        dist = Distribution.objects.get(pk=dist.pk)
+        self.assertEqual(response['Location'], dist.file.url)
+        self.assertEqual(dist.file.read(), self.content)
+        download(HttpRequest(), dist.pk, dist.filename)
+        self.assertEqual(len(self.upstream_requests('/packages/proxy-pkg-1.0.tar.gz')), 1)
+
+    def test_coalesced(self):
+        events = []
+        def request(name):
+            with proxy.coalesced('proxy-pkg') as locked:
+                events.append((name, 'start', locked))
+                time.sleep(0.2)
+                events.append((name, 'end', locked))
+        threads = [threading.Thread(target=request, args=(i,)) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # the requests ran one after the other
+        self.assertEqual([event[1] for event in events], ['start', 'end'] * 3)
+        self.assertTrue(all(event[2] for event in events))
+        self.assertEqual(proxy._locks, {})
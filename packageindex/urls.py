@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 from django.conf.urls.defaults import patterns, url
 from packageindex.feeds import ReleaseFeed
+# Ensure signals get registered (they keep the simple pages up to date)
+from packageindex import signals
 
 # this regex would match all package names as of 2011-05-15. "?!+&():' " srsly?
 #PACKAGE_REGEX = r'(?P<package>[\w\d_\.\-\ \?\!\+\&\(\)\:\']+)'
@@ -18,6 +20,8 @@ urlpatterns = patterns("packageindex.views",
     
     url(r'^simple/' + PACKAGE_REGEX + r'/$','packages.simple_details',
         name='packageindex-package-simple'),
+    url(r'^download/(?P<distribution_id>\d+)/(?P<filename>[^/]+)$',
+        'packages.download', name='packageindex-distribution-download'),
     
     url(r'^pypi/' + PACKAGE_REGEX + r'/$','packages.details',
         name='packageindex-package'),
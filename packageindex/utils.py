@@ -1,5 +1,12 @@
 import sys, traceback
+import Queue
+import threading
+import xmlrpclib
 
+from django.db import connection, connections, router, transaction
+from django.db.models import AutoField
+
+from packageindex import conf
 
 
 def debug(func):
@@ -9,4 +16,120 @@ def debug(func):
             return func(*args, **kwargs)
         except:
             traceback.print_exception(*sys.exc_info())
-    return _wrapped
\ No newline at end of file
+    return _wrapped
+
+# "method not found" in the xml-rpc fault code interoperability spec
+METHOD_NOT_FOUND = -32601
+UNSUPPORTED_STATUSES = (404, 405, 501)
+
+def multicall_unsupported(error):
+    """ Whether the ``xmlrpclib.Fault`` or ``xmlrpclib.ProtocolError``
+    ``error`` means that the server has no ``system.multicall`` """
+    if isinstance(error, xmlrpclib.Fault):
+        return error.faultCode == METHOD_NOT_FOUND or \
+               'system.multicall' in str(error.faultString)
+    return error.errcode in UNSUPPORTED_STATUSES
+
+def multicall(server, method_name, arglist, batch_size=None):
+    """
+    Calls ``method_name`` on the xml-rpc ``server`` once for every tuple of
+    arguments in ``arglist`` and returns a list of the results in the same
+    order. The calls are grouped into ``xmlrpclib.MultiCall`` batches of
+    ``batch_size``. If the server does not support ``system.multicall`` the
+    calls are made one by one (and the server is remembered as such), other
+    errors of the first batch are raised.
+    """
+    if batch_size is None:
+        batch_size = conf.XMLRPC_MULTICALL_BATCH_SIZE
+    arglist = list(arglist)
+    results = []
+    while arglist:
+        if batch_size <= 1 or vars(server).get('_multicall_unsupported'):
+            method = getattr(server, method_name)
+            results.extend([method(*args) for args in arglist])
+            break
+        batch, arglist = arglist[:batch_size], arglist[batch_size:]
+        multi = xmlrpclib.MultiCall(server)
+        for args in batch:
+            getattr(multi, method_name)(*args)
+        try:
+            batch_results = multi()
+        except (xmlrpclib.Fault, xmlrpclib.ProtocolError), e:
+            if results or not multicall_unsupported(e):
+                # multicall worked for the previous batches, or the server
+                # failed for another reason (e.g. a 503 or 429)
+                raise
+            vars(server)['_multicall_unsupported'] = True
+            arglist = batch + arglist
+            continue
+        # iterating the results raises faults of single calls
+        results.extend(list(batch_results))
+    return results
+
+def run_concurrently(func, items, concurrency):
+    """
+    Calls ``func`` for every item of ``items`` (any iterable, it is consumed
+    lazily) in ``concurrency`` worker threads. With a concurrency of 1 (or
+    less) the items are processed in the calling thread. ``func`` should
+    handle its own exceptions, others are printed and the worker goes on
+    with the next item.
+    """
+    if concurrency <= 1:
+        for item in items:
+            func(item)
+        return
+
+    queue = Queue.Queue(maxsize=concurrency * 2)
+    def work():
+        try:
+            while True:
+                item = queue.get()
+                if item is None:
+                    break
+                try:
+                    func(item)
+                except Exception:
+                    traceback.print_exception(*sys.exc_info())
+        finally:
+            # every thread opens its own database connection
+            connection.close()
+    workers = []
+    def put(item):
+        # don't block forever on a queue that no worker reads anymore
+        while True:
+            try:
+                queue.put(item, timeout=1)
+                return
+            except Queue.Full:
+                if not [worker for worker in workers if worker.is_alive()]:
+                    raise RuntimeError("all worker threads have died")
+    for i in range(concurrency):
+        worker = threading.Thread(target=work)
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+    for item in items:
+        put(item)
+    for worker in workers:
+        put(None)
+    for worker in workers:
+        worker.join()
+
+def bulk_create(model, objs):
+    """ Inserts ``objs`` without calling their ``save()`` and without sending
+    model signals, like ``QuerySet.bulk_create`` of django >= 1.4 """
+    if not objs:
+        return
+    if hasattr(model.objects, 'bulk_create'):
+        model.objects.bulk_create(objs)
+        return
+    # django < 1.4: one insert per object, as Model.save_base does it but
+    # without the signals
+    using = router.db_for_write(model)
+    fields = [f for f in model._meta.local_fields if not isinstance(f, AutoField)]
+    for obj in objs:
+        values = [(f, f.get_db_prep_save(f.pre_save(obj, True),
+                                         connection=connections[using]))
+                  for f in fields]
+        model._base_manager._insert(values, using=using)
+    transaction.commit_unless_managed(using=using)
@@ -144,6 +144,12 @@ def register_or_upload(request):
             return HttpResponseBadRequest('That file has already been uploaded...')
 
     md5_digest = request.POST.get('md5_digest','')
+    # computed while the upload was parsed, see parse_distutils_request
+    uploaded_md5 = getattr(uploaded, 'md5_digest', '')
+    if md5_digest and uploaded_md5 and md5_digest != uploaded_md5:
+        transaction.rollback()
+        return HttpResponseBadRequest('The md5 digest does not match the uploaded file')
+    md5_digest = md5_digest or uploaded_md5
     
     try:
         new_file = Distribution.objects.create(release=release,
@@ -153,7 +159,8 @@ def register_or_upload(request):
                                                uploader=request.user,
                                                comment=request.POST.get('comment',''),
                                                signature=request.POST.get('gpg_signature',''),
-                                               md5_digest=md5_digest)
+                                               md5_digest=md5_digest,
+                                               sha256_digest=getattr(uploaded, 'sha256_digest', ''))
     except Exception, e:
         transaction.rollback()
         print str(e)
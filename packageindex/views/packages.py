@@ -1,24 +1,49 @@
+import calendar
+
 from django.conf import settings
 from django.db.models.query import Q
-from django.http import Http404, HttpResponseRedirect
+from django.http import Http404, HttpResponse, HttpResponseNotModified, \
+                        HttpResponseRedirect
 from django.forms.models import inlineformset_factory
 from django.shortcuts import get_object_or_404, render_to_response
 from django.template import RequestContext
+from django.utils.http import http_date, parse_http_date_safe
 from django.views.generic import list_detail, create_update
 
 from packageindex import conf
 from packageindex.decorators import user_owns_package, user_maintains_package
-from packageindex.models import Package, Release
+from packageindex.models import Package, Release, Distribution
 from packageindex.forms import SimplePackageSearchForm, PackageForm
+from packageindex.operations import proxy
+from packageindex.operations.search import search_releases
+from packageindex.operations.simple_pages import get_index_page, get_package_page
 
 def index(request, **kwargs):
     kwargs.setdefault('template_object_name', 'package')
     kwargs.setdefault('queryset', Package.objects.all())
     return list_detail.object_list(request, **kwargs)
 
+def cached_page_response(request, page):
+    """ Answers a request with a precomputed page (see
+    ``operations.simple_pages``), or with 304 if the client has it already """
+    etag = '"%s"' % page['etag']
+    last_modified = calendar.timegm(page['last_modified'].utctimetuple())
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    if if_none_match:
+        not_modified = etag in [tag.strip() for tag in if_none_match.split(',')]
+    else:
+        not_modified = if_modified_since and if_modified_since >= last_modified
+    if not_modified:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(page['html'])
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
+
 def simple_index(request, **kwargs):
-    kwargs.setdefault('template_name', 'packageindex/package_list_simple.html')
-    return index(request, **kwargs)
+    return cached_page_response(request, get_index_page())
 
 def details(request, package, **kwargs):
     kwargs.setdefault('template_object_name', 'package')
@@ -26,15 +51,35 @@ def details(request, package, **kwargs):
     return list_detail.object_detail(request, object_id=package, **kwargs)
 
 def simple_details(request, package, **kwargs):
-    kwargs.setdefault('template_name', 'packageindex/package_detail_simple.html')
-    try:
-        return details(request, package, **kwargs)
-    except Http404, e:
-        if conf.PROXY_MISSING:
+    if proxy.is_enabled():
+        try:
+            page = proxy.get_package_page(package)
+        except proxy.ProxyError, e:
+            print u"%s" % e
+            return HttpResponseRedirect(proxy.upstream_url(package))
+    else:
+        page = get_package_page(package)
+        if page is None and conf.PROXY_MISSING:
             return HttpResponseRedirect('%s/%s/' % 
                                         (conf.PROXY_BASE_URL.rstrip('/'),
                                          package))
-        raise e
+    if page is None:
+        raise Http404(u"No package named %s" % package)
+    return cached_page_response(request, page)
+
+def download(request, distribution_id, filename, **kwargs):
+    """ Redirects to the stored file of a distribution. In pull-through
+    proxy mode the file is stored first if it is not yet, otherwise (or if
+    that fails) the client is sent to the upstream url. """
+    distribution = get_object_or_404(Distribution, pk=distribution_id,
+                                     filename=filename)
+    if not distribution.file and distribution.url and proxy.is_enabled():
+        distribution = proxy.mirror_distribution(distribution)
+    if distribution.file:
+        return HttpResponseRedirect(distribution.file.url)
+    if distribution.url:
+        return HttpResponseRedirect(distribution.url)
+    raise Http404(u"%s has no file" % filename)
 
 def doap(request, package, **kwargs):
     kwargs.setdefault('template_name', 'packageindex/package_doap.xml')
@@ -49,8 +94,10 @@ def search(request, **kwargs):
     
     if form.is_valid():
         q = form.cleaned_data['q']
-        kwargs['queryset'] = Package.objects.filter(Q(name__contains=q) | 
-                                                    Q(releases__package_info__contains=q)).distinct()
+        releases = search_releases({'name': q, 'summary': q, 'keywords': q,
+                                    'description': q}, 'or')
+        kwargs['queryset'] = Package.objects.filter(Q(name__icontains=q) |
+                                                    Q(name__in=releases.values('package')))
 
     return index(request, **kwargs)
 
@@ -13,7 +13,8 @@ from packageindex.forms import ReleaseForm, DistributionUploadForm
 
 def index(request, **kwargs):
     kwargs.setdefault('template_object_name', 'release')
-    kwargs.setdefault('queryset', Release.objects.filter(hidden=False))
+    kwargs.setdefault('queryset', Release.objects.without_package_info()
+                                             .filter(hidden=False))
     return list_detail.object_list(request, **kwargs)
 
 def details(request, package, version, **kwargs):
@@ -1,17 +1,49 @@
+import os
 import xmlrpclib
 
-from django.http import HttpResponseNotAllowed, HttpResponse
+from django.http import HttpResponseNotAllowed, HttpResponseNotModified, \
+                        HttpResponse
 
 from packageindex import conf
-from packageindex.models import Package, Release
+from packageindex.models import Package, Release, Distribution
+from packageindex.operations import journal, package_list, release_cache
+from packageindex.operations.search import search_releases
 
 class XMLRPCResponse(HttpResponse):
     """ A wrapper around the base HttpResponse that dumps the output for xmlrpc
     use """
-    def __init__(self, params=(), methodresponse=True, *args, **kwargs):
-        super(XMLRPCResponse, self).__init__(xmlrpclib.dumps(params,
-                                                             methodresponse=methodresponse),
-                                             *args, **kwargs)
+    def __init__(self, params=(), methodresponse=True, content=None,
+                 allow_none=False, *args, **kwargs):
+        self.params = params
+        if content is None:
+            content = xmlrpclib.dumps(params, methodresponse=methodresponse,
+                                      allow_none=allow_none)
+        super(XMLRPCResponse, self).__init__(content, *args, **kwargs)
+
+def cached_release_response(package_name, version, method, build):
+    """ Returns the response for ``method`` from the release cache, or builds
+    its params with ``build()`` (which returns None if the release does not
+    exist, such responses are not cached) """
+    def build_response():
+        params = build()
+        if params is None:
+            return None
+        return params, XMLRPCResponse(params=params).content
+    cached = release_cache.get_or_build(package_name, version, method,
+                                        build_response)
+    if cached is None:
+        return None
+    params, content = cached
+    return XMLRPCResponse(params=params, content=content)
+
+def get_view_func(command):
+    """ Returns the view for the xmlrpc ``command`` or None """
+    view_func = conf.XMLRPC_COMMANDS.get(command)
+    if isinstance(view_func, basestring):
+        module, func_name = view_func.rsplit('.', 1)
+        view_func = getattr(__import__(module, {}, {}, [func_name]), func_name)
+        conf.XMLRPC_COMMANDS[command] = view_func
+    return view_func
 
 def parse_xmlrpc_request(request):
     """
@@ -19,19 +51,82 @@ def parse_xmlrpc_request(request):
     """
     args, command = xmlrpclib.loads(request.raw_post_data)
     
-    if command in conf.XMLRPC_COMMANDS:
-        view_func = conf.XMLRPC_COMMANDS[command]
-        if isinstance(view_func, basestring):
-            module, func_name = view_func.rsplit('.', 1)
-            view_func = getattr(__import__(module, {}, {}, [func_name]), func_name)
-            conf.XMLRPC_COMMANDS[command] = view_func
+    view_func = get_view_func(command)
+    if view_func is not None:
         return view_func(request, *args)
     else:
         return HttpResponseNotAllowed(conf.XMLRPC_COMMANDS.keys())
 
+def multicall(request, calls):
+    """
+    system.multicall(calls)
+    
+    Runs every call in ``calls`` (a list of {'methodName': ..., 'params': ...}
+    dicts) and returns a list with one entry per call: either a list with
+    the single result of the call or a fault dict.
+    """
+    results = []
+    for call in calls:
+        try:
+            command = call['methodName']
+            if command == 'system.multicall':
+                raise ValueError('recursive system.multicall is not allowed')
+            view_func = get_view_func(command)
+            if view_func is None:
+                raise ValueError('method "%s" is not supported' % command)
+            response = view_func(request, *call.get('params', ()))
+            try:
+                results.append(list(response.params))
+            finally:
+                response.close()
+        except Exception, e:
+            results.append({'faultCode': 1,
+                            'faultString': '%s:%s' % (type(e).__name__, e)})
+    return XMLRPCResponse(params=(results,))
+
+class PackageListResponse(HttpResponse):
+    """ The streamed ``list_packages`` response from the open file ``fh``.
+    ``params`` (only needed by ``multicall``) are read from the database when
+    they are accessed. """
+    def __init__(self, fh, *args, **kwargs):
+        self.file = fh
+        super(PackageListResponse, self).__init__(*args, **kwargs)
+
+    @property
+    def params(self):
+        return (list(package_list.iter_package_names()),)
+
+    def close(self):
+        # the file is not closed by the content iterator if it never ran
+        super(PackageListResponse, self).close()
+        self.file.close()
+
 def list_packages(request):
-    return XMLRPCResponse(params=(list(Package.objects.all().values_list('name', flat=True)),),
-                          content_type='text/xml')
+    """
+    list_packages()
+
+    Retrieve a list of the package names. The response is streamed from a
+    precompressed file (see ``operations.package_list``), with an ETag.
+    """
+    listing, fh = package_list.open_listing()
+    etag = '"%s"' % listing['etag']
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+    if etag in [tag.strip() for tag in if_none_match.split(',')]:
+        fh.close()
+        response = HttpResponseNotModified()
+    elif 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        response = PackageListResponse(fh, package_list.iter_file(fh),
+                                       content_type='text/xml')
+        response['Content-Encoding'] = 'gzip'
+        response['Content-Length'] = os.fstat(fh.fileno()).st_size
+    else:
+        response = PackageListResponse(fh,
+                                       package_list.iter_file(fh, decompress=True),
+                                       content_type='text/xml')
+        response['Content-Length'] = listing['size']
+    response['ETag'] = etag
+    response['Vary'] = 'Accept-Encoding'
+    return response
 
 def package_releases(request, package_name, show_hidden=False):
     try:
@@ -42,9 +137,13 @@ def package_releases(request, package_name, show_hidden=False):
 def release_urls(request, package_name, version):
     base_url = '%s://%s' % (request.is_secure() and 'https' or 'http',
                               request.get_host())
-    dists = []
-    try:
-        for dist in Package.objects.get(name=package_name).releases.get(version=version).distributions.all():
+    def build():
+        dists = []
+        # the urls of proxied distributions depend on the package and index
+        distributions = Distribution.objects.filter(release__package__name=package_name,
+                                                    release__version=version)\
+                                            .select_related('release__package__index')
+        for dist in distributions:
             dists.append({
                 'url': '%s%s' % (base_url, dist.get_absolute_url()),
                 'packagetype': dist.filetype,
@@ -56,10 +155,14 @@ def release_urls(request, package_name, version):
                 'python_version': dist.pyversion,
                 'comment_text': dist.comment
             })
-    except (Package.DoesNotExist, Release.DoesNotExist):
-        pass
-    
-    return XMLRPCResponse(params=(dists,))
+        if not dists:
+            # the release may not exist, don't cache
+            return None
+        return (dists,)
+
+    response = cached_release_response(package_name, version,
+                                       'release_urls:%s' % base_url, build)
+    return response or XMLRPCResponse(params=([],))
 
 def release_data(request, package_name, version):
     output = {
@@ -88,16 +191,19 @@ def release_data(request, package_name, version):
         'obsoletes_dist': '',
         'project_url': '',
     }
-    try:
-        release = Package.objects.get(name=package_name).releases.get(version=version)
+    def build():
+        try:
+            release = Release.objects.get(package__name=package_name, version=version)
+        except Release.DoesNotExist:
+            return None
         output.update({'name': package_name, 'version': version,})
         output.update(release.package_info)
-    except (Package.DoesNotExist, Release.DoesNotExist):
-        pass
-    
-    return XMLRPCResponse(params=(output,))
+        return (output,)
+
+    response = cached_release_response(package_name, version, 'release_data', build)
+    return response or XMLRPCResponse(params=(output,))
 
-def search(request, spec, operator='or'):
+def search(request, spec, operator='and'):
     """
     search(spec[, operator])
     
@@ -117,27 +223,54 @@ def search(request, spec, operator='or'):
     platform
     download_url
     Arguments for different fields are combined using either "and" (the default) or "or". Example: search({'name': 'foo', 'description': 'bar'}, 'or'). The results are returned as a list of dicts {'name': package name, 'version': package release version, 'summary': package release summary}
-    
-    changelog(since)
-    
-    Retrieve a list of four-tuples (name, version, timestamp, action) since the given timestamp. All timestamps are UTC values. The argument is a UTC integer seconds since the epoch.
     """
     
-    output = {
-        'name': '',
-        'version': '',
-        'summary': '',
-    }
+    output = []
+    releases = search_releases(spec, operator).defer('package_info')\
+                                              .order_by('package', 'version')
+    for release in releases[:conf.SEARCH_MAX_RESULTS]:
+        output.append({
+            'name': release.package_id,
+            'version': release.version,
+            'summary': release.summary or '',
+        })
     return XMLRPCResponse(params=(output,))
 
-def changelog(since):
-    output = {
-        'name': '',
-        'version': '',
-        'timestamp': '',
-        'action': '',
-    }
-    return XMLRPCResponse(params=(output,))
+def changelog(request, since, with_ids=False):
+    """
+    changelog(since[, with_ids])
+
+    Retrieve a list of four-tuples (name, version, timestamp, action) since
+    the given UTC timestamp (or five-tuples with the serial if ``with_ids``
+    is true).
+    """
+    output = []
+    for entry in journal.since(since):
+        item = (entry.name, entry.version, journal.timestamp(entry), entry.action)
+        if with_ids:
+            item += (entry.id,)
+        output.append(item)
+    return XMLRPCResponse(params=(output,), allow_none=True)
+
+def changelog_last_serial(request):
+    """
+    changelog_last_serial()
+
+    Retrieve the serial of the last journal entry.
+    """
+    return XMLRPCResponse(params=(journal.last_serial(),))
+
+def changelog_since_serial(request, since_serial):
+    """
+    changelog_since_serial(since_serial)
+
+    Retrieve a list of five-tuples (name, version, timestamp, action, serial)
+    of the journal entries after ``since_serial``.
+    """
+    output = [(entry.name, entry.version, journal.timestamp(entry),
+               entry.action, entry.id)
+              for entry in journal.since_serial(since_serial)]
+    return XMLRPCResponse(params=(output,), allow_none=True)
 
 def ratings(request, name, version, since):
     return XMLRPCResponse(params=([],))